@@ -4,7 +4,26 @@ from enum import Enum
 class DatabaseAddr(Enum):
     CLIENT_ADDR: str = "http://localhost:9200"
     PUMBAA_CLIENT_ADDR: str = "http://watzmann:9200"    # pumbaa and watzmann are servers, the index is on watzmann
-    DB_NAME: str = "txt_db"
+    DB_NAME: str = "txt_db"    # alias of the index currently read from, cf. ESDatabase.rebuild_db
+    DB_INDEX_PREFIX: str = "txt_db_v"  # prefix of the versioned indices the alias points to
+    DB_TEMPLATE_NAME: str = "txt_db_template"  # index template of the versioned indices
+
+
+class IndexSettings(Enum):
+    # settings while reading from the index
+    REFRESH_INTERVAL: str = "1s"
+    NUM_REPLICAS: int = 1
+    NUM_SHARDS: int = 8     # only used by the index template, cf. ESDatabase.put_index_template
+    # settings while bulk loading a new index
+    BULK_REFRESH_INTERVAL: str = "-1"   # disables refreshes
+    BULK_NUM_REPLICAS: int = 0
+
+
+class EmbeddingModel(Enum):  # shared by ingestion (ESDatabase) and topic modeling (TopicModel)
+    NAME: str = "sentence-transformers/msmarco-MiniLM-L-12-v3"
+    DIMS: int = 384
+    # model Top2Vec embeds the documents with if no embeddings are given (TopicModel, TopicModelSweep)
+    TOPIC_MODEL_NAME: str = "distiluse-base-multilingual-cased"
 
 
 class Paths(Enum):  # change the paths to your local/ server paths
@@ -5,7 +5,8 @@ import data.files as files
 import database.init_elasticsearch as db
 import topic.topic_modeling as tm
 from constants import *
-from data.files import save_sentences_to_file, save_df_to_csv
+from data.corpus_store import CorpusWriter, load_corpus
+from data.files import get_partition_path, save_df_to_csv, save_incidence_to_parquet
 from utils.logging_utils import init_debug_config
 
 logger = logging.getLogger(__name__)
@@ -17,40 +18,41 @@ if __name__ == '__main__':
     data_path = Paths.SERVER_DATA_PATH.value
     save_sentences_path = Paths.SERVER_PATH_TO_PROJECT.value + 'dataset/'
     model_path = Paths.SERVER_PATH_TO_PROJECT.value + 'models/'
-    incidence_save_path = Paths.SERVER_INC_SAVE_PATH.value + date + '/'
+    storage_format = 'csv'  # 'csv' or 'parquet' (sparse, partitioned by run date)
+    incidence_save_path = Paths.SERVER_INC_SAVE_PATH.value + date + '/' if storage_format == 'csv' else (
+        get_partition_path(Paths.SERVER_INC_SAVE_PATH.value, run_date=date))
+    save_incidence = save_df_to_csv if storage_format == 'csv' else save_incidence_to_parquet
     plot_save_path = Paths.SERVER_PLOTS_SAVE_PATH.value + date + '/'
     load_existing_topic_model = False
 
-    # texts
-    pdfs = files.get_files(path=data_path)
-    logging.info('Obtained pdfs')
-    sentences = []
-    for i in tqdm.tqdm(range(len(pdfs)), desc='Extracting text from pdfs'):
-        pdf = pdfs[i]
-        sentence = files.extract_text_from_pdf(pdf)
-        if type(sentence) != str:
-            sentence = str(sentence)
-        sentences.extend([sentence])
-    logging.info('Extracted text from pdfs')
-    save_sentences_to_file(sentences=sentences, dataset_path=save_sentences_path,
-                           save_filename=f'sentences_ETYNTKE_{date}.txt')
-    logging.info('Saved sentences to file')
+    # texts: written to a corpus store one document at a time and read lazily afterwards
+    corpus_name = f'corpus_ETYNTKE_{date}'
+    load_existing_corpus = False
+    if not load_existing_corpus:
+        pdfs = files.get_files(path=data_path)
+        logging.info('Obtained pdfs')
+        with CorpusWriter(path=save_sentences_path, name=corpus_name) as writer:
+            for pdf in tqdm.tqdm(pdfs, desc='Extracting text from pdfs'):
+                sentence, success = files.extract_text_from_pdf(pdf)
+                writer.add(sentence, doc_id=pdf)
+        logging.info('Extracted text from pdfs and saved them to the corpus store')
+    corpus = load_corpus(dataset_path=save_sentences_path, filename=corpus_name)
 
     if load_existing_topic_model:
         model = tm.TopicModel(documents=None)
         model.load_model(path=model_path, filename='topic_model_01_05_25')
     else:
-        model = tm.TopicModel(documents=sentences)
+        model = tm.TopicModel(documents=list(corpus))
         model.save_model(path=model_path)  # unique name with date
     logging.info('Created and saved topic model')
 
     # document-topic incidence for all documents
     start = 0
-    duration = len(sentences)
-    doc_ids = list(range(start, start + len(sentences[start:start + duration]) - 1))
+    duration = len(corpus)
+    doc_ids = list(range(start, min(start + duration, len(corpus)) - 1))
 
     doc_topic_incidence = model.get_document_topic_incidence(doc_ids=doc_ids)
-    save_df_to_csv(df=doc_topic_incidence, path=incidence_save_path, file_name=f"doc_topic_incidence_{date}")
+    save_incidence(doc_topic_incidence, path=incidence_save_path, file_name=f"doc_topic_incidence_{date}")
     logging.info("obtained & saved doc-topic incidence")
 
     # determine optimal threshold for document-topic incidence
@@ -59,11 +61,11 @@ if __name__ == '__main__':
                                                                                      save_path=plot_save_path)
     logging.info(f"optimal threshold: {threshold}")
     thres_row_norm_doc_topic_df = model.apply_threshold_doc_topic_incidence(row_norm_doc_topic_df, threshold=threshold)
-    save_df_to_csv(df=thres_row_norm_doc_topic_df, path=incidence_save_path,
+    save_incidence(thres_row_norm_doc_topic_df, path=incidence_save_path,
                    file_name=f"thres_row_norm_doc_topic_incidence_{date}")
     logging.info("obtained & saved thresholded doc-topic incidence")
 
     # term-topic incidence
     term_topic_incidence = model.get_term_topic_incidence(doc_ids=doc_ids)
-    save_df_to_csv(term_topic_incidence, incidence_save_path, f"term_topic_incidence_{date}")
+    save_incidence(term_topic_incidence, path=incidence_save_path, file_name=f"term_topic_incidence_{date}")
     logging.info("obtained & saved term-topic incidence")
@@ -0,0 +1,191 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+import utils.os_manipulation as osm
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct("<Q")  # length prefix of each record: unsigned 64 bit, little endian
+
+
+class CorpusWriter:
+
+    def __init__(self, path: str, name: str, compress: bool = False):
+        """
+        Writes documents to a corpus store (cf. CorpusStore) one at a time, hence the corpus does not have to fit in
+        memory.
+        The store consists of the files <name>.corpus (records: length prefix and utf-8 encoded, optionally
+        zlib compressed text), <name>.offsets.npy (start of every record and the end of the file), <name>.ids.npy
+        (document ids) and <name>.meta.json.
+        :param path: Path to the directory of the store including the '/' at the end
+        :param name: Name of the store, without file ending
+        :param compress: If True, every document is compressed with zlib
+        """
+        osm.exists_or_create(path=path)
+        self.path = path
+        self.name = name
+        self.compress = compress
+        self._file = open(path + name + ".corpus", "wb")
+        self._offsets = [0]
+        self._ids = []
+
+    def add(self, text: str, doc_id=None):
+        """
+        Append a document to the store.
+        :param text: Text of the document
+        :param doc_id: (Optional) Id of the document, e.g. its Elasticsearch id; if None, its position in the store
+        :return: Position of the document in the store
+        """
+        data = str(text).encode("utf-8")
+        if self.compress:
+            data = zlib.compress(data)
+        self._file.write(_LENGTH.pack(len(data)))
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + _LENGTH.size + len(data))
+        self._ids.append(str(len(self._ids) if doc_id is None else doc_id))
+        return len(self._ids) - 1
+
+    def close(self):
+        """
+        Finish the store, i.e. write the offset index, the ids and the metadata.
+        :return: -
+        """
+        self._file.close()
+        np.save(self.path + self.name + ".offsets.npy", np.asarray(self._offsets, dtype=np.int64))
+        np.save(self.path + self.name + ".ids.npy", np.asarray(self._ids, dtype=str))
+        with open(self.path + self.name + ".meta.json", "w") as f:
+            json.dump({"num_docs": len(self._ids), "compress": self.compress}, f)
+        logger.info(f"Saved corpus of {len(self._ids)} documents to {self.path + self.name}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CorpusStore:
+
+    def __init__(self, path: str, name: str, use_mmap: bool = True):
+        """
+        Read access to a corpus written with CorpusWriter.
+        Documents are read lazily: by position (store[i], store[start:end]), by id (get) or sequentially (iteration).
+        :param path: Path to the directory of the store including the '/' at the end
+        :param name: Name of the store, without file ending
+        :param use_mmap: If True, the corpus file is memory mapped, else documents are read with seek and read
+        """
+        with open(path + name + ".meta.json", "r") as f:
+            meta = json.load(f)
+        self.compress = meta["compress"]
+        self.offsets = np.load(path + name + ".offsets.npy", mmap_mode="r")
+        self.ids = np.load(path + name + ".ids.npy")
+        self._id2pos = None
+        self._file = open(path + name + ".corpus", "rb")
+        # an empty file cannot be memory mapped
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if use_mmap and self.offsets[-1] > 0 else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, data: bytes):
+        if self.compress:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def _read(self, position: int):
+        start = int(self.offsets[position]) + _LENGTH.size
+        end = int(self.offsets[position + 1])
+        if self._data is not None:
+            return self._decode(self._data[start:end])
+        self._file.seek(start)
+        return self._decode(self._file.read(end - start))
+
+    def __getitem__(self, position):
+        """
+        Returns the document at a position or a list of the documents of a slice.
+        :param position: Position (int) or slice
+        :return: Text or list of texts
+        """
+        if isinstance(position, slice):
+            return [self._read(i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"Document {position} is not in the corpus of {len(self)} documents")
+        return self._read(position)
+
+    def get(self, doc_id):
+        """
+        Returns the document with the given id.
+        :param doc_id: Id of the document (cf. CorpusWriter.add)
+        :return: Text of the document
+        """
+        if self._id2pos is None:
+            self._id2pos = {doc_id: position for position, doc_id in enumerate(self.ids)}
+        return self._read(self._id2pos[str(doc_id)])
+
+    def __iter__(self):
+        """
+        Iterate over all documents in the order they were written; the length prefixes are read sequentially.
+        :return: Generator of texts
+        """
+        with open(self._file.name, "rb", buffering=1024 ** 2) as f:
+            for _ in range(len(self)):
+                length, = _LENGTH.unpack(f.read(_LENGTH.size))
+                yield self._decode(f.read(length))
+
+    def iter_batches(self, batch_size: int = 1000):
+        """
+        Iterate over all documents in batches, e.g. to embed or assign topics to them.
+        :param batch_size: Number of documents per batch
+        :return: Generator of tuples (ids, texts) of at most batch_size documents
+        """
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            yield self.ids[start:end].tolist(), self[start:end]
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_corpus(sentences, dataset_path: str, save_filename: str = "corpus", ids: list = None,
+                compress: bool = False):
+    """
+    This function saves documents to a corpus store (replaces save_sentences_to_file).
+    :param sentences: Iterable of documents; may be a generator
+    :param dataset_path: Path to the dataset; ends with '/'
+    :param save_filename: Name of the store, without file ending
+    :param ids: (Optional) Ids of the documents in the order of sentences
+    :param compress: If True, every document is compressed with zlib
+    :return: -
+    """
+    with CorpusWriter(path=dataset_path, name=save_filename, compress=compress) as writer:
+        for i, sentence in enumerate(sentences):
+            writer.add(sentence, doc_id=None if ids is None else ids[i])
+
+
+def load_corpus(dataset_path: str, filename: str = "corpus", use_mmap: bool = True):
+    """
+    This function opens a corpus store saved with save_corpus (replaces load_sentences_from_file).
+    The documents are read lazily; use list(store) to load all of them, e.g. to train a topic model.
+    :param dataset_path: Path to the dataset; ends with '/'
+    :param filename: Name of the store, without file ending
+    :param use_mmap: If True, the corpus file is memory mapped
+    :return: CorpusStore
+    """
+    if not os.path.exists(dataset_path + filename + ".meta.json"):
+        raise FileNotFoundError(f"No corpus store {filename} in {dataset_path}")
+    return CorpusStore(path=dataset_path, name=filename, use_mmap=use_mmap)
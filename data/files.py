@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pypdf as pdf
+from scipy import sparse
 import hashlib
 import warnings
 import tqdm
@@ -139,6 +143,8 @@ def save_sentences_to_file(sentences, dataset_path, save_filename: str = 'senten
     """
     This function saves the sentences to a file.
     Each new sentence is preceded by the string 'NEWFILE'.
+    The whole file has to be read at once and non-ASCII characters are stored as escaped bytes; for new corpora use
+    data.corpus_store.save_corpus.
     :param sentences: List of sentences to save
     :param dataset_path: Path to the dataset; ends with '/'
     :param save_filename: Name of the file to save the sentences to
@@ -184,6 +190,227 @@ def save_df_to_csv(df, path, file_name):
     print(f"Dataframe saved to {path}")
 
 
+def save_sparse_to_csv(matrix, path, file_name, index: list = None, columns: list = None, chunk_size: int = 1000):
+    """
+    This function saves a scipy.sparse matrix to a csv file in the same layout as save_df_to_csv.
+    The matrix is written in chunks of rows, hence at most chunk_size rows are dense at a time.
+    :param matrix: scipy.sparse matrix to save
+    :param path: Path to save the file, incl. / at the end
+    :param file_name: Name of the file, without file ending
+    :param index: (Optional) Row labels; if None, the row numbers are used
+    :param columns: (Optional) Column labels; if None, the column numbers are used
+    :param chunk_size: Number of rows written at once
+    :return: -
+    """
+    osm.exists_or_create(path=path)
+    matrix = matrix.tocsr()
+    index = np.arange(matrix.shape[0]) if index is None else np.asarray(index)
+    with open(path + file_name + '.csv', 'w', newline='') as f:
+        for start in range(0, max(matrix.shape[0], 1), chunk_size):
+            chunk = pd.DataFrame(matrix[start:start + chunk_size].toarray(), index=index[start:start + chunk_size],
+                                 columns=columns)
+            chunk.to_csv(f, index=True, header=(start == 0))
+    print(f"Sparse matrix saved to {path}")
+
+
+def save_sparse_to_parquet(matrix, path, file_name, index: list = None, columns: list = None):
+    """
+    This function saves a scipy.sparse matrix to a parquet file in coordinate format.
+    Each row of the file is one non-zero entry (columns 'row', 'col' and 'value'); binary matrices omit 'value'.
+    The row and column labels are stored as metadata of the file.
+    :param matrix: scipy.sparse matrix to save
+    :param path: Path to save the file, incl. / at the end
+    :param file_name: Name of the file, without file ending
+    :param index: (Optional) Row labels; if None, the row numbers are used
+    :param columns: (Optional) Column labels; if None, the column numbers are used
+    :return: -
+    """
+    osm.exists_or_create(path=path)
+    coo = matrix.tocoo()
+    data = {'row': coo.row.astype(np.int64), 'col': coo.col.astype(np.int32)}
+    if not np.all(coo.data == 1):
+        data['value'] = coo.data
+    metadata = {
+        'shape': json.dumps(list(map(int, matrix.shape))),
+        'index': json.dumps(None if index is None else [str(i) for i in index]),
+        'columns': json.dumps(None if columns is None else [str(c) for c in columns]),
+    }
+    table = pa.table(data).replace_schema_metadata(metadata)
+    pq.write_table(table, path + file_name + '.parquet')
+    print(f"Sparse matrix saved to {path}")
+
+
+def load_sparse_from_parquet(path_to_file: str):
+    """
+    This function loads a scipy.sparse matrix saved with save_sparse_to_parquet.
+    :param path_to_file: Path to the parquet file incl. file ending
+    :return: scipy.sparse CSR matrix, row labels (or None), column labels (or None)
+    """
+    table = pq.read_table(path_to_file)
+    metadata = {key.decode(): value.decode() for key, value in table.schema.metadata.items()}
+    values = table.column('value').to_numpy() if 'value' in table.column_names \
+        else np.ones(table.num_rows, dtype=np.int8)
+    matrix = sparse.csr_matrix((values, (table.column('row').to_numpy(), table.column('col').to_numpy())),
+                               shape=tuple(json.loads(metadata['shape'])))
+    return matrix, json.loads(metadata['index']), json.loads(metadata['columns'])
+
+
+def get_partition_path(base_path: str, directory: str = None, run_date: str = None):
+    """
+    This function returns the path of a partition of the columnar incidence storage.
+    Partitions are nested directories 'directory=<directory>/run_date=<run date>/' (hive layout), hence the files of
+    one directory or one run can be selected by path, e.g. with pyarrow.dataset.
+    :param base_path: Path to the storage, incl. / at the end
+    :param directory: (Optional) Name of the directory the incidences belong to; if None, no directory partition
+    :param run_date: (Optional) Date of the run; if None, no run date partition
+    :return: Path of the partition, incl. / at the end
+    """
+    path = base_path
+    if directory is not None:
+        path += f"directory={directory}/"
+    if run_date is not None:
+        path += f"run_date={run_date}/"
+    return path
+
+
+def save_incidence_to_parquet(incidence, path, file_name, index: list = None, columns: list = None):
+    """
+    This function saves an incidence matrix to a parquet file (cf. save_sparse_to_parquet).
+    Only the non-zero entries are stored; for binary incidences only their coordinates.
+    :param incidence: Incidence matrix as DataFrame or scipy.sparse matrix
+    :param path: Path to save the file, incl. / at the end (cf. get_partition_path)
+    :param file_name: Name of the file, without file ending
+    :param index: (Optional) Row labels; if None, the index of the DataFrame or the row numbers are used
+    :param columns: (Optional) Column labels; if None, the columns of the DataFrame or the column numbers are used
+    :return: -
+    """
+    if isinstance(incidence, pd.DataFrame):
+        index = incidence.index.tolist() if index is None else index
+        columns = incidence.columns.tolist() if columns is None else columns
+        incidence = sparse.csr_matrix(incidence.to_numpy())
+    save_sparse_to_parquet(incidence, path=path, file_name=file_name, index=index, columns=columns)
+
+
+def load_incidence_from_parquet(path_to_file: str, columns: list = None, as_df: bool = True):
+    """
+    This function loads an incidence matrix saved with save_incidence_to_parquet.
+    If columns are given, only the entries of these columns are read from the file (column projection).
+    :param path_to_file: Path to the parquet file incl. file ending
+    :param columns: (Optional) Labels of the columns to load (as saved, i.e. strings); if None, all columns are loaded
+    :param as_df: If True, the incidence is returned as DataFrame, else as scipy.sparse CSR matrix with its labels
+    :return: DataFrame with row and column labels or tuple (scipy.sparse CSR matrix, row labels, column labels)
+    """
+    if columns is None:
+        matrix, index, all_columns = load_sparse_from_parquet(path_to_file)
+        selected_columns = all_columns
+    else:
+        metadata = {key.decode(): value.decode() for key, value in pq.read_schema(path_to_file).metadata.items()}
+        num_rows, num_columns = json.loads(metadata['shape'])
+        index, all_columns = json.loads(metadata['index']), json.loads(metadata['columns'])
+        labels = all_columns if all_columns is not None else [str(c) for c in range(num_columns)]
+        label2col = {label: col for col, label in enumerate(labels)}
+        col_ids = [label2col[str(column)] for column in columns]
+
+        table = pq.read_table(path_to_file, filters=[('col', 'in', col_ids)])
+        new_col = np.empty(num_columns, dtype=np.int32)
+        new_col[col_ids] = np.arange(len(col_ids))
+        values = table.column('value').to_numpy() if 'value' in table.column_names \
+            else np.ones(table.num_rows, dtype=np.int8)
+        matrix = sparse.csr_matrix((values, (table.column('row').to_numpy(),
+                                             new_col[table.column('col').to_numpy()])),
+                                   shape=(num_rows, len(col_ids)))
+        selected_columns = [labels[col] for col in col_ids]
+
+    if not as_df:
+        return matrix, index, selected_columns
+    return pd.DataFrame(matrix.toarray(), index=index, columns=selected_columns)
+
+
+def save_topic_words_to_parquet(terms_per_topic: dict, path: str, file_name: str):
+    """
+    This function saves the topic words (cf. TopicModel.get_term_topic_incidence) to a parquet file.
+    Each row of the file is one topic with its id and its words ordered by their score.
+    :param terms_per_topic: Dictionary mapping topic ids to lists of words
+    :param path: Path to save the file, incl. / at the end
+    :param file_name: Name of the file, without file ending
+    :return: -
+    """
+    osm.exists_or_create(path=path)
+    table = pa.table({'topic_id': pa.array([int(topic_id) for topic_id in terms_per_topic], type=pa.int32()),
+                      'words': pa.array([list(words) for words in terms_per_topic.values()],
+                                        type=pa.list_(pa.string()))})
+    pq.write_table(table, path + file_name + '.parquet')
+    print(f"Topic words saved to {path}")
+
+
+def load_topic_words(path_to_file: str):
+    """
+    This function loads the topic words from a json file or a parquet file (cf. save_topic_words_to_parquet).
+    :param path_to_file: Path to the file incl. file ending
+    :return: Dictionary mapping topic ids (as strings, like in the json files) to lists of words
+    """
+    if path_to_file.endswith('.parquet'):
+        table = pq.read_table(path_to_file)
+        return {str(topic_id): words for topic_id, words in zip(table.column('topic_id').to_pylist(),
+                                                                table.column('words').to_pylist())}
+    return load_dict_from_json(path_to_file)
+
+
+def save_topic_assignments_to_parquet(ids: list, topic_nums, topic_scores, model_version: str, path: str,
+                                      file_name: str, paths: list = None):
+    """
+    This function saves the topics of documents (cf. TopicModel.assign_topics) to a parquet file.
+    Each row of the file is one document with its id, (path,) topic ids and scores; the topics are stored as lists of
+    fixed length. The model version is stored as metadata of the file.
+    :param ids: Document ids (e.g. Elasticsearch ids)
+    :param topic_nums: Topic ids of the documents; shape: (num documents, top_k), e.g. (0, 0) if there are none
+    :param topic_scores: Scores of the topics; same shape as topic_nums
+    :param model_version: Version of the topic model the topics were assigned with
+    :param path: Path to save the file, incl. / at the end
+    :param file_name: Name of the file, without file ending
+    :param paths: (Optional) Paths of the documents
+    :return: -
+    """
+    osm.exists_or_create(path=path)
+    topic_nums = np.asarray(topic_nums, dtype=np.int32)
+    topic_scores = np.asarray(topic_scores, dtype=np.float32)
+    if topic_nums.ndim != 2:  # e.g. an empty list if no document has topics
+        topic_nums = topic_nums.reshape(len(ids), -1) if len(ids) else topic_nums.reshape(0, 0)
+        topic_scores = topic_scores.reshape(topic_nums.shape)
+    top_k = topic_nums.shape[1]
+    data = {'id': pa.array([str(i) for i in ids], type=pa.string())}
+    if paths is not None:
+        data['path'] = pa.array(paths, type=pa.string())
+    if len(ids):
+        data['topic_ids'] = pa.FixedSizeListArray.from_arrays(pa.array(topic_nums.ravel()), top_k)
+        data['topic_scores'] = pa.FixedSizeListArray.from_arrays(pa.array(topic_scores.ravel()), top_k)
+    else:  # from_arrays cannot infer the list size of no values
+        data['topic_ids'] = pa.array([], type=pa.list_(pa.int32(), top_k))
+        data['topic_scores'] = pa.array([], type=pa.list_(pa.float32(), top_k))
+    table = pa.table(data).replace_schema_metadata({'model_version': model_version})
+    pq.write_table(table, path + file_name + '.parquet')
+    print(f"Topic assignments saved to {path}")
+
+
+def load_topic_assignments_from_parquet(path_to_file: str, columns: list = None):
+    """
+    This function loads the topics of documents saved with save_topic_assignments_to_parquet.
+    :param path_to_file: Path to the parquet file incl. file ending
+    :param columns: (Optional) Columns to read, e.g. ['id', 'topic_ids']; if None, all columns are read
+    :return: Dictionary mapping column names to lists (ids, paths) or arrays of shape (num documents, top_k) (topics),
+        model version
+    """
+    table = pq.read_table(path_to_file, columns=columns)
+    result = {}
+    for name in table.column_names:
+        column = table.column(name).combine_chunks()
+        if name in ('topic_ids', 'topic_scores'):
+            result[name] = column.flatten().to_numpy().reshape(len(column), column.type.list_size)
+        else:
+            result[name] = column.to_pylist()
+    return result, table.schema.metadata[b'model_version'].decode()
+
+
 def pdf2png(pdf_path: str, png_path: str, page_num: int):
     """
     This function converts a pdf file to a png file.
@@ -223,13 +450,12 @@ def pdf2png(pdf_path: str, png_path: str, page_num: int):
 def dir_topic_words2csv(dir_path: str, output_file: str, top_n: int = 5):
     """
     This function converts a json file containing the topics and their top 50 word of  a directory to a CSV file.
-    :param dir_path: Path to the directory with the topic words files
+    :param dir_path: Path to the topic words file (.json or .parquet, cf. load_topic_words)
     :param output_file: Path to save the CSV file, incl. filename and file ending
     :param top_n: Number of top words to extract from each topic
     :return: -
     """
-    with open(dir_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_topic_words(dir_path)
 
     # Extract non-empty topics
     filtered_topics = [(topic_id, ", ".join(words[:top_n])) for topic_id, words in data.items() if words]
@@ -250,7 +476,7 @@ def dir_topic_words2csv_across_dirs(path2single_dirs_json: str, path2across_dir_
     to obtain the top words for each topic, this function extracts the top words for each topic from the
     single-directory json files and saves them to a CSV file.
 
-    :param path2single_dirs_json: Path to the directory with the single-directory json files
+    :param path2single_dirs_json: Path to the directory with the single-directory json (or topic words parquet) files
     :param path2across_dir_csv: Path to the across-directory CSV file
     :param save_path: Path to save the CSV file, incl. filename and file ending
     :param top_n: Number of top words to extract from each topic in the final across-directory CSV file
@@ -269,15 +495,17 @@ def dir_topic_words2csv_across_dirs(path2single_dirs_json: str, path2across_dir_
 
     aggregated_topics = {}
 
-    # Process each JSON file in the directory
-    for file_path in get_files(path2single_dirs_json, file_type='json', recursive=True):
+    # Process each topic words file (JSON or parquet) in the directory
+    topic_word_files = get_files(path2single_dirs_json, file_type='json', recursive=True) + \
+        [path for path in get_files(path2single_dirs_json, file_type='.parquet', recursive=True)
+         if 'topic2terms' in os.path.basename(path)]
+    for file_path in topic_word_files:
         if os.path.isfile(file_path):
-            print(f"Processing {file}")
+            print(f"Processing {file_path}")
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+                data = load_topic_words(file_path)
             except Exception as e:
-                print(f"Error loading {file}: {e}")
+                print(f"Error loading {file_path}: {e}")
                 continue
 
             # Extract topics ensuring no duplicates
@@ -1,3 +1,4 @@
+import datetime
 import logging
 import os
 from elasticsearch import Elasticsearch
@@ -8,7 +9,7 @@ from constants import *
 from data.caption_images import ImageCaptioner
 from data.files import get_hash_file, extract_text_from_pdf, extract_text_from_txt
 from utils.logging_utils import init_debug_config
-from utils.os_manipulation import scan_recurse
+from utils.os_manipulation import get_top_level_directory, scan_recurse
 
 '''------initiate, fill and search in database-------
 run this code by typing and altering the path:
@@ -19,73 +20,162 @@ logger = logging.getLogger(__name__)
 
 
 class ESDatabase:
-    def __init__(self, client_addr: str = DatabaseAddr.CLIENT_ADDR.value):
+    def __init__(self, client_addr: str = DatabaseAddr.CLIENT_ADDR.value, use_routing: bool = False):
+        """
+        :param client_addr: Address of the Elasticsearch server
+        :param use_routing: If True, documents are routed by their top-level directory (cf. put_index_template).
+            Has to match the setting the index was created with.
+        """
         self.client = Elasticsearch(client_addr, request_timeout=100)
+        self.use_routing = use_routing
         init_debug_config(log_filename='init_elasticsearch_', on_server=True)
 
     def get_es_client(self):
         return self.client
 
-    def init_db(self):
+    def get_index_mappings(self):
         """
-        This function initializes the database by creating an index (i.e. the structure for an entry of type DB_NAME database).
+        Returns the mappings of the index.
         The index contains the following fields:
         - text: the text of the document. The text is not tokenized, stemmed etc.
         - path: the path to the document on the local machine.
         - embedding: the SentenceTransformer embedding of the text.
         - directory: the parent directory of the document.
+        - top_directory: the uppermost directory of the document below the dataset root; used as routing key.
         - file_name: the name of the document.
+        - topic_ids, topic_scores: the top-k topics of the document and their scores in descending order
+          (cf. insert_topic_assignments); top_topic: the topic with the highest score.
+        - topic_model_version: the version (i.e. file name) of the topic model the topics were assigned with.
 
         cf. https://www.elastic.co/guide/en/elasticsearch/reference/current/dense-vector.html for information about dense vectors and similarity measurement types
+        :return: Mappings as dictionary
         """
-        logger.info('Started creating index')
-
-        self.client.indices.create(index=DatabaseAddr.DB_NAME.value, body={
-            "mappings": {
-                "properties": {
-                    "embedding": {
-                        "type": "dense_vector",
-                        "dims": 384,
-                        "index": True,
-                        "similarity": "cosine",
-                    },
-                    "text": {
-                        "type": "text",
-                    },
-                    "directory": {
-                        "type": "text",
-                    },
-                    "path": {
-                        "type": "keyword",
-                    },
-                    "file_name": {
-                        "type": "text",
-                    },
-                    "file_type": {
-                        "type": "text",
-                    },
-                    "named_entities": {
-                        "type": "nested",
-                    },
+        mappings = {
+            "properties": {
+                "embedding": {
+                    "type": "dense_vector",
+                    "dims": EmbeddingModel.DIMS.value,
+                    "index": True,
+                    "similarity": "cosine",
                 },
-            }
-        })
-        logger.info('Finished creating index')
+                "text": {
+                    "type": "text",
+                },
+                "directory": {
+                    "type": "text",
+                },
+                "top_directory": {
+                    "type": "keyword",
+                },
+                "path": {
+                    "type": "keyword",
+                },
+                "file_name": {
+                    "type": "text",
+                },
+                "file_type": {
+                    "type": "text",
+                },
+                "named_entities": {
+                    "type": "nested",
+                },
+                **self.get_topic_mappings(),
+            },
+        }
+        if self.use_routing:
+            mappings["_routing"] = {"required": True}
+        return mappings
+
+    def get_topic_mappings(self):
+        """
+        Returns the mappings of the fields storing the topics of a document (cf. insert_topic_assignments).
+        :return: Mappings of the topic fields as dictionary
+        """
+        return {
+            "topic_ids": {
+                "type": "integer",
+            },
+            "topic_scores": {
+                "type": "float",
+                "index": False,
+            },
+            "top_topic": {
+                "type": "integer",
+            },
+            "topic_model_version": {
+                "type": "keyword",
+            },
+        }
+
+    def init_db(self, index: str = DatabaseAddr.DB_NAME.value, settings: dict = None):
+        """
+        This function initializes the database by creating an index (i.e. the structure for an entry of type DB_NAME database).
+        The fields of the index are described in get_index_mappings.
+        :param index: Name of the index to create
+        :param settings: (Optional) Index settings, e.g. number of replicas; if None, the defaults of Elasticsearch
+            (or of the index template, cf. put_index_template) are used
+        """
+        logger.info(f'Started creating index {index}')
+
+        body = {"mappings": self.get_index_mappings()}
+        if settings is not None:
+            body["settings"] = settings
+        self.client.indices.create(index=index, body=body)
+        logger.info(f'Finished creating index {index}')
 
-    def initialize_db(self, src_path="", delete_old_index=False):
+    def put_index_template(self, num_shards: int = IndexSettings.NUM_SHARDS.value):
+        """
+        Create (or overwrite) the index template for the versioned indices (cf. start_rebuild).
+        Indices created afterward are split into num_shards shards. If routing is used, all documents of one top-level
+        directory are stored in the same shard, hence per-directory queries only touch this shard.
+        cf. https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-routing-field.html
+        :param num_shards: Number of primary shards of each index
+        :return: -
+        """
+        self.client.indices.put_index_template(name=DatabaseAddr.DB_TEMPLATE_NAME.value,
+                                               index_patterns=[DatabaseAddr.DB_INDEX_PREFIX.value + "*"],
+                                               template={
+                                                   "settings": {"number_of_shards": num_shards},
+                                                   "mappings": self.get_index_mappings(),
+                                               })
+        logger.info(f'Put index template {DatabaseAddr.DB_TEMPLATE_NAME.value} with {num_shards} shards')
+
+    def get_routing(self, path: str):
+        """
+        Returns the routing key of a document, i.e. its top-level directory, if routing is used.
+        :param path: Path to the document
+        :return: Routing key or None if routing is not used
+        """
+        return get_top_level_directory(path) if self.use_routing else None
+
+    def initialize_db(self, src_path="", delete_old_index=False, rebuild=False):
         """
         Initialize the database by creating an index and inserting the embeddings of the documents in the database.
         Only call this function if you want to create a NEW database.
         Use `client = Elasticsearch(client_addr)` to connect to an existing database.
         :param src_path: Path to the directory containing the documents (.txt and .pdf)
-        :param delete_old_index: If True, the old index is deleted and a new one is created
+        :param delete_old_index: If True, the old index is deleted and a new one is created; if DatabaseAddr.DB_NAME is an
+            alias (cf. rebuild_db), the indices it points to are deleted. With rebuild, they are deleted after the swap.
+        :param rebuild: If True, the documents are loaded into a new versioned index, which replaces the old one once
+            it is complete (cf. rebuild_db). The old index stays readable in the meantime.
         :return: Elasticsearch client
         """
         logger.info('started with initialize_db()')
 
+        if rebuild:
+            if src_path == "":
+                raise ValueError('no path given')
+            self.rebuild_db(src_path=src_path, delete_old_indices=delete_old_index)
+            return self.client
+
         # delete old index and create new one
         if delete_old_index:
-            self.client.options(ignore_status=[400, 404]).indices.delete(index=DatabaseAddr.DB_NAME.value)
+            old_indices = self.get_alias_indices()
+            if old_indices:
+                # deleting the indices also removes the alias, hence an index of its name can be created
+                self.client.indices.delete(index=",".join(old_indices))
+            else:
+                self.client.options(ignore_status=[404]).indices.delete(index=DatabaseAddr.DB_NAME.value)
             self.init_db()
             logger.info('deleted old index and created new one')
 
@@ -102,7 +192,7 @@ class ESDatabase:
 
         return self.client
 
-    def insert_text_related_fields(self, src_path: str):
+    def insert_text_related_fields(self, src_path: str, index: str = DatabaseAddr.DB_NAME.value):
         """
         Insert captions of images and texts of documents (.txt and .pdf) in the database.
         Since text is used for the embeddings and named entities, these are also updated in the database.
@@ -110,13 +200,14 @@ class ESDatabase:
         For more information: https://www.sbert.net/ (21.01.2025)
 
         :param src_path: Path to the directory containing the documents (.txt and .pdf)
+        :param index: Name of the index (or alias) to write to
         :return: -
         """
         # Create the client instance
         logger.info('start with insert_text_related_fields()')
         image_captioner = ImageCaptioner()
         ner = named_entity_recognition.NamedEntityRecognition()
-        model = SentenceTransformer('sentence-transformers/msmarco-MiniLM-L-12-v3')
+        model = SentenceTransformer(EmbeddingModel.NAME.value)
 
         for path in scan_recurse(base_directory=src_path):
             text = self.obtain_text_from_file(image_captioner, path)
@@ -129,13 +220,14 @@ class ESDatabase:
 
             try:
                 # insert document in database if it does not exist, else update it
-                self.client.update(index=DatabaseAddr.DB_NAME.value, id=id, doc=update_doc, doc_as_upsert=True)
+                self.client.update(index=index, id=id, doc=update_doc, doc_as_upsert=True,
+                                   routing=self.get_routing(path))
 
             except Exception as e:
                 logging.error('error in embedding: ', e)
                 continue
 
-    def insert_text_related_fields_bulk(self, src_path: str):
+    def insert_text_related_fields_bulk(self, src_path: str, index: str = DatabaseAddr.DB_NAME.value):
         """
         Insert captions of images and texts of documents (.txt and .pdf) in the database.
         Since text is used for the embeddings and named entities, these are also updated in the database.
@@ -143,6 +235,7 @@ class ESDatabase:
         For more information: https://www.sbert.net/ (21.01.2025)
 
         :param src_path: Path to the directory containing the documents (.txt and .pdf)
+        :param index: Name of the index (or alias) to write to
         :return: -
         """
         logging.info('start with insert_text_related_fields_bulk()')
@@ -150,7 +243,7 @@ class ESDatabase:
         image_captioner = ImageCaptioner()
         ner = named_entity_recognition.NamedEntityRecognition()
         logging.info('created image_captioner and ner instance')
-        model = SentenceTransformer('sentence-transformers/msmarco-MiniLM-L-12-v3')
+        model = SentenceTransformer(EmbeddingModel.NAME.value)
         logging.info('created embedding model instance')
 
         paths = scan_recurse(base_directory=src_path)
@@ -166,7 +259,7 @@ class ESDatabase:
             id = get_hash_file(paths[idx])  # Assuming paths is the list of file paths
             update_doc = {
                 '_op_type': 'update',
-                '_index': DatabaseAddr.DB_NAME.value,
+                '_index': index,
                 '_id': id,
                 'doc': {
                     'text': texts[idx],
@@ -175,6 +268,8 @@ class ESDatabase:
                 },
                 'doc_as_upsert': True,
             }
+            if self.use_routing:
+                update_doc['_routing'] = self.get_routing(paths[idx])
             actions.append(update_doc)
         logging.info('finished creating actions list')
         # Execute bulk update
@@ -186,6 +281,60 @@ class ESDatabase:
         except Exception as e:
             logger.error(f"Bulk operation failed: {e}")
 
+    def put_topic_mappings(self, index: str = DatabaseAddr.DB_NAME.value):
+        """
+        Add the topic fields to the mappings of an existing index (created before these fields existed).
+        :param index: Name of the index (or alias)
+        :return: -
+        """
+        self.client.indices.put_mapping(index=index, properties=self.get_topic_mappings())
+        logger.info(f'Added topic fields to the mappings of {index}')
+
+    def insert_topic_assignments(self, es_ids: list, topic_nums, topic_scores, model_version: str,
+                                 routings: list = None, index: str = DatabaseAddr.DB_NAME.value,
+                                 chunk_size: int = 500):
+        """
+        Store the topics of documents in their Elasticsearch documents, tagged with the version of the topic model.
+        Afterward, incidences can be built from the index (cf. query_db.get_topic_assignments) without loading the
+        topic model.
+        Since Elasticsearch does not keep the order of array values in doc values, the order of topic_ids and
+        topic_scores is only reliable in the source; top_topic stores the best topic for aggregations.
+        :param es_ids: Elasticsearch ids of the documents
+        :param topic_nums: Topic ids of the documents in descending order of score (cf. TopicModel.assign_topics);
+            shape: (num documents, top_k)
+        :param topic_scores: Scores of the topics; same shape as topic_nums
+        :param model_version: Version of the topic model, e.g. the name returned by TopicModel.save_model
+        :param routings: (Optional) Routing keys of the documents (cf. get_texts_and_embeddings); required if the
+            index uses routing
+        :param index: Name of the index (or alias) to write to
+        :param chunk_size: Number of updates sent per bulk request
+        :return: Number of successful updates
+        """
+        logger.info(f'started inserting topic assignments of {len(es_ids)} documents (model {model_version})')
+
+        def actions():
+            for i, es_id in enumerate(es_ids):
+                action = {
+                    '_op_type': 'update',
+                    '_index': index,
+                    '_id': es_id,
+                    'doc': {
+                        'topic_ids': [int(topic) for topic in topic_nums[i]],
+                        'topic_scores': [float(score) for score in topic_scores[i]],
+                        'top_topic': int(topic_nums[i][0]),
+                        'topic_model_version': model_version,
+                    },
+                }
+                if routings is not None and routings[i] is not None:
+                    action['_routing'] = routings[i]
+                yield action
+
+        success, failed = bulk(self.client, actions(), chunk_size=chunk_size, raise_on_error=False)
+        logger.info(f"Successfully executed {success} actions.")
+        if failed:
+            logger.warning(f"Failed actions: {failed}")
+        return success
+
     def obtain_text_from_file(self, image_captioner, path: str):
         """
         Function to obtain the text from a file.
@@ -206,12 +355,13 @@ class ESDatabase:
         except Exception as e:
             return str(e)
 
-    def insert_metadata(self, src_path: str):
+    def insert_metadata(self, src_path: str, index: str = DatabaseAddr.DB_NAME.value):
         """
         Function to insert metadata of documents in the database.
         This metadata includes the path, file name, directory, file type, and parent directory.
 
         :param src_path: Path to the directory containing the documents (.txt and .pdf)
+        :param index: Name of the index (or alias) to write to
         :return: -
         """
         logger.info('started with insert_metadata()')
@@ -220,13 +370,100 @@ class ESDatabase:
 
             id = get_hash_file(path)
             doc = {'path': path, 'file_name': os.path.basename(path), 'directory': os.path.dirname(path).split('/')[-1],
-                   'file_type': path.split('.')[-1]}
+                   'top_directory': get_top_level_directory(path), 'file_type': path.split('.')[-1]}
             try:
                 # insert document in database if it does not exist, else update it
-                self.client.update(index=DatabaseAddr.DB_NAME.value, id=id, doc=doc, doc_as_upsert=True)
+                self.client.update(index=index, id=id, doc=doc, doc_as_upsert=True, routing=self.get_routing(path))
 
             except Exception as e:
                 logger.error(f'error in updating document {path}. Error is: {e}')
                 continue
 
         logger.info('finished inserting metadata')
+
+    def start_rebuild(self):
+        """
+        Create a new versioned index to bulk load the documents into.
+        The index is named after DatabaseAddr.DB_INDEX_PREFIX and the current time.
+        Refreshes are disabled and there are no replicas while loading, since both slow down indexing.
+        Readers keep using the alias DatabaseAddr.DB_NAME, which still points to the old index.
+        cf. https://www.elastic.co/guide/en/elasticsearch/reference/current/tune-for-indexing-speed.html
+        :return: Name of the new index
+        """
+        new_index = DatabaseAddr.DB_INDEX_PREFIX.value + datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        self.init_db(index=new_index, settings={
+            "index": {
+                "refresh_interval": IndexSettings.BULK_REFRESH_INTERVAL.value,
+                "number_of_replicas": IndexSettings.BULK_NUM_REPLICAS.value,
+            }
+        })
+        logger.info(f'Created index {new_index} for bulk loading')
+        return new_index
+
+    def finish_rebuild(self, new_index: str, delete_old_indices: bool = False):
+        """
+        Finish loading a new index and atomically point the alias DatabaseAddr.DB_NAME to it.
+        The new index is force merged to one segment, before the settings for reading are restored.
+        If DatabaseAddr.DB_NAME is still a concrete index (i.e. created before aliases were used), it is deleted in the
+        same atomic step, since an alias cannot have the name of an existing index.
+        :param new_index: Name of the new index (cf. start_rebuild)
+        :param delete_old_indices: If True, the indices the alias pointed to before are deleted after the swap
+        :return: -
+        """
+        alias = DatabaseAddr.DB_NAME.value
+        long_running_client = self.client.options(request_timeout=None)
+
+        long_running_client.indices.refresh(index=new_index)
+        long_running_client.indices.forcemerge(index=new_index, max_num_segments=1)
+        logger.info(f'Force merged index {new_index}')
+
+        self.client.indices.put_settings(index=new_index, body={
+            "index": {
+                "refresh_interval": IndexSettings.REFRESH_INTERVAL.value,
+                "number_of_replicas": IndexSettings.NUM_REPLICAS.value,
+            }
+        })
+        logger.info(f'Restored settings for reading of index {new_index}')
+
+        actions = []
+        old_indices = []
+        if self.client.indices.exists_alias(name=alias):
+            old_indices = [index for index in self.client.indices.get_alias(name=alias).body if index != new_index]
+            actions.extend({"remove": {"index": index, "alias": alias}} for index in old_indices)
+        elif self.client.indices.exists(index=alias):
+            actions.append({"remove_index": {"index": alias}})
+        actions.append({"add": {"index": new_index, "alias": alias}})
+        self.client.indices.update_aliases(body={"actions": actions})
+        logger.info(f'Alias {alias} points to {new_index} now')
+
+        if delete_old_indices and old_indices:
+            self.client.indices.delete(index=",".join(old_indices))
+            logger.info(f'Deleted old indices {old_indices}')
+
+    def get_alias_indices(self):
+        """
+        Returns the indices the alias DatabaseAddr.DB_NAME points to.
+        :return: List of index names; empty if DatabaseAddr.DB_NAME is no alias (e.g. a concrete index or missing)
+        """
+        alias = DatabaseAddr.DB_NAME.value
+        if not self.client.indices.exists_alias(name=alias):
+            return []
+        return list(self.client.indices.get_alias(name=alias).body)
+
+    def rebuild_db(self, src_path: str, with_text_related_fields: bool = False, delete_old_indices: bool = False):
+        """
+        Rebuild the database in a new versioned index without read downtime.
+        In contrast to initialize_db(delete_old_index=True), the old index stays readable until the new one is complete.
+        If the text related fields are computed on another server, call start_rebuild, insert_metadata and
+        insert_text_related_fields_bulk with index=<new index> and finish_rebuild separately instead.
+        :param src_path: Path to the directory containing the documents (.txt and .pdf)
+        :param with_text_related_fields: If True, the text related fields are inserted as well
+        :param delete_old_indices: If True, the indices the alias pointed to before are deleted after the swap
+        :return: Name of the new index
+        """
+        new_index = self.start_rebuild()
+        self.insert_metadata(src_path, index=new_index)
+        if with_text_related_fields:
+            self.insert_text_related_fields_bulk(src_path, index=new_index)
+        self.finish_rebuild(new_index, delete_old_indices=delete_old_indices)
+        return new_index
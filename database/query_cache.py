@@ -0,0 +1,194 @@
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from constants import DatabaseAddr
+from utils.os_manipulation import exists_or_create
+
+logger = logging.getLogger(__name__)
+
+_query_cache = None  # module wide cache used by all functions decorated with cached_query; None -> caching disabled
+
+
+class QueryCache:
+
+    def __init__(self, max_bytes: int = 2 * 1024 ** 3, disk_path: str = None, max_disk_bytes: int = 50 * 1024 ** 3):
+        """
+        Least recently used cache for results of Elasticsearch queries.
+        Results are stored pickled, hence the size of an entry is known exactly and callers cannot modify cached
+        results by accident.
+        If disk_path is given, every result is additionally written to disk (second tier). Results evicted from memory
+        are then reloaded from disk instead of being queried again, also across processes and sessions.
+        :param max_bytes: Maximum size of all results kept in memory in bytes
+        :param disk_path: Path to the directory of the on-disk tier including the '/' at the end; None -> memory only
+        :param max_disk_bytes: Maximum size of all results kept on disk in bytes
+        """
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> pickled result, ordered from least to most recently used
+        self._num_bytes = 0
+        if disk_path is not None:
+            exists_or_create(path=disk_path)
+
+    def _disk_file(self, key: str):
+        return os.path.join(self.disk_path, key + ".pkl")
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:  # would evict everything else and still not fit
+            return
+        if key in self._entries:
+            self._num_bytes -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self._num_bytes += len(data)
+        while self._num_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._num_bytes -= len(evicted)
+
+    def _put_disk(self, key: str, data: bytes):
+        with open(self._disk_file(key), "wb") as f:
+            f.write(data)
+
+        # evict least recently used files until the disk tier fits again
+        files = [os.path.join(self.disk_path, f) for f in os.listdir(self.disk_path) if f.endswith(".pkl")]
+        sizes = {f: os.path.getsize(f) for f in files}
+        total = sum(sizes.values())
+        for f in sorted(files, key=os.path.getmtime):
+            if total <= self.max_disk_bytes:
+                break
+            total -= sizes[f]
+            os.remove(f)
+
+    def get(self, key: str):
+        """
+        Look up a result.
+        :param key: Key of the result (cf. make_key)
+        :return: Tuple (hit, result); result is None if hit is False
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return True, pickle.loads(self._entries[key])
+        if self.disk_path is not None and os.path.exists(self._disk_file(key)):
+            with open(self._disk_file(key), "rb") as f:
+                data = f.read()
+            os.utime(self._disk_file(key))  # mark as recently used
+            self._put_memory(key, data)
+            return True, pickle.loads(data)
+        return False, None
+
+    def put(self, key: str, result):
+        """
+        Store a result.
+        :param key: Key of the result (cf. make_key)
+        :param result: Picklable result of the query
+        :return: -
+        """
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        self._put_memory(key, data)
+        if self.disk_path is not None:
+            self._put_disk(key, data)
+
+    def clear(self):
+        """
+        Remove all results from memory and disk.
+        :return: -
+        """
+        self._entries.clear()
+        self._num_bytes = 0
+        if self.disk_path is not None:
+            for f in os.listdir(self.disk_path):
+                if f.endswith(".pkl"):
+                    os.remove(os.path.join(self.disk_path, f))
+
+    @staticmethod
+    def make_key(func_name: str, arguments: dict, generation: str):
+        """
+        Create the key of a query result.
+        :param func_name: Name of the query function
+        :param arguments: Arguments of the query function except the client
+        :param generation: Generation of the queried index (cf. get_index_generation)
+        :return: Hex digest identifying the result
+        """
+        description = repr((func_name, sorted(arguments.items()), generation))
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+def get_index_generation(client, index: str = DatabaseAddr.DB_NAME.value):
+    """
+    Returns a fingerprint of the current state of an index.
+    The fingerprint consists of the uuid, document count and maximum sequence number of every primary shard.
+    Every indexed, updated or deleted document increases the sequence number of its shard, i.e. the fingerprint changes
+    whenever the content of the index changes (also before a refresh) and when an alias is moved to another index.
+    cf. https://www.elastic.co/guide/en/elasticsearch/reference/current/indices-stats.html
+    :param client: Elasticsearch client
+    :param index: Name of the Elasticsearch index or alias
+    :return: Fingerprint as hex digest
+    """
+    stats = client.indices.stats(index=index, level="shards")
+    state = []
+    for index_name, index_stats in sorted(stats["indices"].items()):
+        for shard_num, copies in sorted(index_stats["shards"].items()):
+            for copy in copies:
+                if copy["routing"]["primary"]:
+                    state.append((index_name, index_stats.get("uuid"), shard_num, copy["docs"]["count"],
+                                  copy["seq_no"]["max_seq_no"]))
+    return hashlib.sha256(repr(state).encode("utf-8")).hexdigest()
+
+
+def enable_query_cache(max_bytes: int = 2 * 1024 ** 3, disk_path: str = None, max_disk_bytes: int = 50 * 1024 ** 3):
+    """
+    Enable caching of the query functions decorated with cached_query.
+    :param max_bytes: Maximum size of all results kept in memory in bytes
+    :param disk_path: Path to the directory of the on-disk tier including the '/' at the end; None -> memory only
+    :param max_disk_bytes: Maximum size of all results kept on disk in bytes
+    :return: The query cache
+    """
+    global _query_cache
+    _query_cache = QueryCache(max_bytes=max_bytes, disk_path=disk_path, max_disk_bytes=max_disk_bytes)
+    logger.info(f"Enabled query cache with {max_bytes} bytes in memory and disk tier {disk_path}")
+    return _query_cache
+
+
+def disable_query_cache():
+    """
+    Disable caching of query results; cached results are dropped from memory, but kept on disk.
+    :return: -
+    """
+    global _query_cache
+    _query_cache = None
+
+
+def cached_query(func):
+    """
+    Decorator for query functions whose first parameter is the Elasticsearch client.
+    If the query cache is enabled, results are cached by function, arguments and generation of the queried index
+    (parameter 'index' or DatabaseAddr.DB_NAME). Hence, results are reused until the index changes.
+    If the query cache is disabled, the function is called as usual.
+    :param func: Query function
+    :return: Wrapped query function
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(client, *args, **kwargs):
+        if _query_cache is None:
+            return func(client, *args, **kwargs)
+
+        bound = signature.bind(client, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = {name: value for name, value in bound.arguments.items() if name != "client"}
+        index = arguments.get("index", DatabaseAddr.DB_NAME.value)
+        key = QueryCache.make_key(func.__name__, arguments, get_index_generation(client, index=index))
+
+        hit, result = _query_cache.get(key)
+        if hit:
+            logger.info(f"Query cache hit for {func.__name__}")
+            return result
+        result = func(client, *args, **kwargs)
+        _query_cache.put(key, result)
+        return result
+
+    return wrapper
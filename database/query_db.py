@@ -1,7 +1,11 @@
-from collections import defaultdict
+import heapq
+import logging
+from collections import Counter, defaultdict
 import matplotlib.pyplot as plt
+import numpy as np
 from wordcloud import WordCloud
 from constants import *
+from database.query_cache import cached_query
 from utils.os_manipulation import save_or_not, exists_or_create
 from visualization.two_d_display import scatter_documents_2d
 
@@ -13,7 +17,7 @@ def search_db(client, num_res: int = 10):
     :param num_res: Number of results to return
     :return: result of the query
     """
-    res = client.search(index=DatabaseAddr.DB_NAME, body={
+    res = client.search(index=DatabaseAddr.DB_NAME.value, body={
         'size': num_res,
         'query': {
             'match_all': {}
@@ -22,17 +26,19 @@ def search_db(client, num_res: int = 10):
     return res
 
 
+@cached_query
 def get_num_indexed_documents(client):
     """
     Returns the number of documents in the database.
     :param client: Elasticsearch client
     :return: number of documents
     """
-    client.indices.refresh(index=DatabaseAddr.DB_NAME)
-    count = int(client.cat.count(index=DatabaseAddr.DB_NAME, format="json")[0]["count"])
+    client.indices.refresh(index=DatabaseAddr.DB_NAME.value)
+    count = int(client.cat.count(index=DatabaseAddr.DB_NAME.value, format="json")[0]["count"])
     return count
 
 
+@cached_query
 def obtain_directories(client):
     """
     Returns a set of all directories in the database.
@@ -44,15 +50,19 @@ def obtain_directories(client):
     return set([r['_source']['directory'] for r in res['hits']['hits']])
 
 
-def get_directory_content(client, index: str, directory: str, scroll: str = "2m", batch_size: int = 1000):
+def iter_directory_content(client, index: str, directory: str, scroll: str = "2m", batch_size: int = 1000,
+                           routing: str = None):
     """
-    Returns a list of all texts in a given directory (only this directory and not its children).
+    Yields the texts in a given directory (only this directory and not its children) batch by batch.
+    In contrast to get_directory_content, at most one scroll batch is held in memory at a time.
     :param client: Elasticsearch client
     :param index: Name of the Elasticsearch index
     :param directory: Directory to get content from
     :param scroll: Scroll duration (default: 2 minutes)
     :param batch_size: Number of documents fetched per scroll request
-    :return: List of all texts in the directory
+    :param routing: (Optional) Routing key, i.e. top-level directory of the directory (cf. ESDatabase.use_routing);
+        if given, only the shard holding this top-level directory is searched
+    :return: Generator of lists of texts, one list per scroll batch
     """
     # Initialize the query to fetch documents in the specified directory
     query = {
@@ -66,39 +76,144 @@ def get_directory_content(client, index: str, directory: str, scroll: str = "2m"
     }
 
     # Perform the initial scroll search
-    response = client.search(index=index, body=query, scroll=scroll)
+    response = client.search(index=index, body=query, scroll=scroll, routing=routing)
     scroll_id = response["_scroll_id"]
-    texts = []
 
-    # Continue fetching results until no more documents are returned
-    while True:
-        hits = response["hits"]["hits"]
-        if not hits:
-            break
+    try:
+        # Continue fetching results until no more documents are returned
+        while True:
+            hits = response["hits"]["hits"]
+            if not hits:
+                break
 
-        texts.extend([hit["_source"]["text"] for hit in hits if "text" in hit["_source"] and hit["_source"]["text"]])
+            yield [hit["_source"]["text"] for hit in hits if "text" in hit["_source"] and hit["_source"]["text"]]
 
-        # Fetch the next batch of results
-        response = client.scroll(scroll_id=scroll_id, scroll="2m")
+            # Fetch the next batch of results
+            response = client.scroll(scroll_id=scroll_id, scroll=scroll)
+            scroll_id = response["_scroll_id"]
+    finally:
+        # Clear the scroll context to free up resources
+        client.clear_scroll(scroll_id=scroll_id)
 
-    # Clear the scroll context to free up resources
-    client.clear_scroll(scroll_id=scroll_id)
 
+@cached_query
+def get_directory_content(client, index: str, directory: str, scroll: str = "2m", batch_size: int = 1000,
+                          routing: str = None):
+    """
+    Returns a list of all texts in a given directory (only this directory and not its children).
+    :param client: Elasticsearch client
+    :param index: Name of the Elasticsearch index
+    :param directory: Directory to get content from
+    :param scroll: Scroll duration (default: 2 minutes)
+    :param batch_size: Number of documents fetched per scroll request
+    :param routing: (Optional) Routing key, i.e. top-level directory of the directory (cf. ESDatabase.use_routing)
+    :return: List of all texts in the directory
+    """
+    texts = []
+    for batch in iter_directory_content(client=client, index=index, directory=directory, scroll=scroll,
+                                        batch_size=batch_size, routing=routing):
+        texts.extend(batch)
     return texts
 
 
-def display_directory_content(client, directory: str, save_path: str = None):
+@cached_query
+def get_directory_term_frequencies(client, index: str, directory: str, max_words: int = 200,
+                                   method: str = "stream", batch_size: int = 1000, prune_factor: int = 10,
+                                   routing: str = None):
+    """
+    Returns the word frequencies of the texts in a given directory without concatenating the texts.
+    Two methods are supported:
+    - 'stream': the texts are scrolled batch by batch and tokenized with the same tokenizer WordCloud.generate uses.
+        The counts are kept in a Misra-Gries summary of capacity k = prune_factor * max_words (cf. prune_frequencies):
+        memory is bounded independently of the directory size, and every count is at most N / (k + 1) below the
+        true count (N: number of tokens). Hence every term occurring more than N / (k + 1) times is kept, no matter in
+        which batch it occurs; the counts are approximate, not exact.
+    - 'significant_text': the frequencies are computed by Elasticsearch using a significant_text aggregation on the
+        'text' field. Nothing but the buckets is transferred; the values are significance scores, not counts.
+    cf. https://www.elastic.co/guide/en/elasticsearch/reference/current/search-aggregations-bucket-significanttext-aggregation.html
+    :param client: Elasticsearch client
+    :param index: Name of the Elasticsearch index
+    :param directory: Directory to get the word frequencies of
+    :param max_words: Number of most frequent words to return
+    :param method: Either 'stream' or 'significant_text'
+    :param batch_size: Number of documents fetched per scroll request (only used if method is 'stream')
+    :param prune_factor: Capacity of the Misra-Gries summary in multiples of max_words (only used if method is 'stream')
+    :param routing: (Optional) Routing key, i.e. top-level directory of the directory (cf. ESDatabase.use_routing)
+    :return: Dictionary mapping words to their frequencies
+    """
+    if method == "significant_text":
+        query = {
+            "size": 0,
+            "query": {
+                "match": {
+                    "directory": directory
+                }
+            },
+            "aggs": {
+                "sample": {
+                    "sampler": {"shard_size": batch_size},
+                    "aggs": {
+                        "keywords": {
+                            "significant_text": {"field": "text", "size": max_words, "filter_duplicate_text": True}
+                        }
+                    }
+                }
+            }
+        }
+        response = client.search(index=index, body=query, routing=routing)
+        buckets = response["aggregations"]["sample"]["keywords"]["buckets"]
+        return {bucket["key"]: bucket["score"] for bucket in buckets}
+    elif method != "stream":
+        raise ValueError(f"Unknown method {method}; use 'stream' or 'significant_text'")
+
+    tokenizer = WordCloud()  # process_text is the tokenizer used by WordCloud.generate
+    capacity = prune_factor * max_words
+    frequencies = Counter()
+    for batch in iter_directory_content(client=client, index=index, directory=directory, batch_size=batch_size,
+                                        routing=routing):
+        for text in batch:
+            frequencies.update(tokenizer.process_text(text))
+        frequencies = prune_frequencies(frequencies, capacity)
+    return dict(frequencies.most_common(max_words))
+
+
+def prune_frequencies(frequencies: Counter, capacity: int):
+    """
+    Bound the number of terms of a Misra-Gries summary (frequent items; merging the counts of a batch into the summary
+    and pruning keeps the guarantees, cf. Agarwal et al., "Mergeable Summaries", 2012).
+    If there are more than capacity terms, the (capacity + 1)-th largest count is subtracted from all counts and the
+    terms without a positive count are dropped. Every count stays at most N / (capacity + 1) below the true count,
+    where N is the total number of counted tokens.
+    :param frequencies: Counts of the terms
+    :param capacity: Maximum number of terms
+    :return: Pruned counts (frequencies itself if it has at most capacity terms)
+    """
+    if len(frequencies) <= capacity:
+        return frequencies
+    threshold = heapq.nlargest(capacity + 1, frequencies.values())[-1]
+    return Counter({term: count - threshold for term, count in frequencies.items() if count > threshold})
+
+
+def display_directory_content(client, directory: str, save_path: str = None, method: str = "stream",
+                              routing: str = None):
     """
     Displays a wordcloud of the content of a given directory.
     If save_path is not None, saves the wordcloud as a .png file.
+    The word frequencies are computed incrementally (cf. get_directory_term_frequencies), hence memory usage does not
+    depend on the size of the directory.
     :param client: Elasticsearch client
     :param directory: Directory to display content of
     :param save_path: Path to save the wordcloud
+    :param method: Method to compute the word frequencies; either 'stream' or 'significant_text'
+    :param routing: (Optional) Routing key, i.e. top-level directory of the directory (cf. ESDatabase.use_routing)
     :return: None
     """
-    sentences = get_directory_content(client=client, directory=directory, index=DatabaseAddr.DB_NAME.value)
-    text = ' '.join(sentences)
-    wordcloud = WordCloud(max_font_size=40).generate(text)
+    frequencies = get_directory_term_frequencies(client=client, index=DatabaseAddr.DB_NAME.value,
+                                                 directory=directory, method=method, routing=routing)
+    if not frequencies:
+        logging.warning(f"No words found for directory {directory}; no wordcloud created")
+        return
+    wordcloud = WordCloud(max_font_size=40).generate_from_frequencies(frequencies)
     plt.figure()
     plt.title('Wordcloud of directory: ' + directory)
     plt.imshow(wordcloud, interpolation="bilinear")
@@ -122,6 +237,7 @@ def scatter_dir_content(client, save_path: str = None):
 
 
 # should work, since used in NER/clustering_NE.py
+@cached_query
 def get_named_entities_for_docs(client, key_name: str, nested_field_path: str = "named_entities",
                                 es_request_limit: int = 10000):
     """
@@ -175,6 +291,7 @@ def get_named_entities_for_docs(client, key_name: str, nested_field_path: str =
     return named_entities, doc_map
 
 
+@cached_query
 def get_texts_from_docs(client, es_request_limit: int = 10000):
     """
     Fetch named entities of the specified category using the scroll API for large datasets.
@@ -214,6 +331,136 @@ def get_texts_from_docs(client, es_request_limit: int = 10000):
     return texts
 
 
+@cached_query
+def get_texts_and_embeddings(client, index: str = DatabaseAddr.DB_NAME.value, batch_size: int = 1000,
+                             scroll_time: str = "2m", return_routing: bool = False):
+    """
+    Fetch the ids, texts and embeddings of all documents which have both, using the scroll API.
+    The embeddings were computed during ingestion (cf. ESDatabase.insert_text_related_fields_bulk) and can be used to
+    train the topic model without embedding the documents again (cf. TopicModel).
+    :param client: Elasticsearch client
+    :param index: Name of the Elasticsearch index
+    :param batch_size: Number of documents to retrieve per batch (default: 1000)
+    :param scroll_time: Time to keep the scroll context alive (default: 2 minutes)
+    :param return_routing: If True, the routing keys of the documents (None if indexed without routing) are returned
+        additionally, e.g. to update the documents afterward (cf. ESDatabase.insert_topic_assignments)
+    :return: List of document ids, list of texts, embeddings as array of shape (num documents, embedding dimension)
+        (and list of routing keys if return_routing)
+    """
+    ids, texts, embeddings, routings = [], [], [], []
+    query = {
+        "size": batch_size,
+        "_source": ["text", "embedding"],
+        "query": {
+            "bool": {
+                "filter": [{"exists": {"field": "text"}}, {"exists": {"field": "embedding"}}]
+            }
+        }
+    }
+
+    response = client.search(index=index, body=query, scroll=scroll_time)
+    scroll_id = response["_scroll_id"]
+
+    while True:
+        hits = response["hits"]["hits"]
+        if not hits:
+            break
+
+        for doc in hits:
+            ids.append(doc["_id"])
+            routings.append(doc.get("_routing"))
+            texts.append(doc["_source"]["text"])
+            embeddings.append(np.asarray(doc["_source"]["embedding"], dtype=np.float32))
+
+        response = client.scroll(scroll_id=scroll_id, scroll=scroll_time)
+        scroll_id = response["_scroll_id"]
+
+    client.clear_scroll(scroll_id=scroll_id)
+    embeddings = np.vstack(embeddings) if embeddings else np.empty((0, EmbeddingModel.DIMS.value), np.float32)
+    if return_routing:
+        return ids, texts, embeddings, routings
+    return ids, texts, embeddings
+
+
+@cached_query
+def get_topic_assignments(client, model_version: str, index: str = DatabaseAddr.DB_NAME.value,
+                          directory: str = None, routing: str = None, batch_size: int = 1000,
+                          scroll_time: str = "2m"):
+    """
+    Fetch the topics stored in the index (cf. ESDatabase.insert_topic_assignments) with one projected scan.
+    Only the path and topic fields are read, hence neither texts, embeddings nor the topic model are needed.
+    The result can be scattered into a document-topic incidence with TopicModel.topics2sparse_incidence.
+    :param client: Elasticsearch client
+    :param model_version: Version of the topic model the topics were assigned with
+    :param index: Name of the Elasticsearch index
+    :param directory: (Optional) Only documents in this directory (not its children)
+    :param routing: (Optional) Routing key of the directory (cf. get_directory_routing_keys)
+    :param batch_size: Number of documents to retrieve per batch (default: 1000)
+    :param scroll_time: Time to keep the scroll context alive (default: 2 minutes)
+    :return: List of document ids, list of paths, topic ids (int64) and topic scores (float32) as arrays of shape
+        (num documents, top_k); (0, 0) if no document was found
+    """
+    filters = [{"term": {"topic_model_version": model_version}}]
+    if directory is not None:
+        filters.append({"match": {"directory": directory}})
+    query = {
+        "size": batch_size,
+        "_source": ["path", "topic_ids", "topic_scores"],
+        "query": {"bool": {"filter": filters}},
+    }
+
+    ids, paths, topic_nums, topic_scores = [], [], [], []
+    response = client.search(index=index, body=query, scroll=scroll_time, routing=routing)
+    scroll_id = response["_scroll_id"]
+
+    while True:
+        hits = response["hits"]["hits"]
+        if not hits:
+            break
+        for doc in hits:
+            ids.append(doc["_id"])
+            paths.append(doc["_source"].get("path"))
+            topic_nums.append(doc["_source"]["topic_ids"])
+            topic_scores.append(doc["_source"]["topic_scores"])
+        response = client.scroll(scroll_id=scroll_id, scroll=scroll_time)
+        scroll_id = response["_scroll_id"]
+
+    client.clear_scroll(scroll_id=scroll_id)
+    if not ids:  # no document has topics of this model version (in this directory)
+        return ids, paths, np.empty((0, 0), dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    return (ids, paths, np.asarray(topic_nums, dtype=np.int64).reshape(len(ids), -1),
+            np.asarray(topic_scores, dtype=np.float32).reshape(len(ids), -1))
+
+
+@cached_query
+def get_directory_topic_counts(client, model_version: str, index: str = DatabaseAddr.DB_NAME.value,
+                               directory_field: str = "top_directory", max_directories: int = 10000,
+                               max_topics: int = 10000):
+    """
+    Count the documents per directory and (best) topic with an aggregation, i.e. without fetching any document.
+    :param client: Elasticsearch client
+    :param model_version: Version of the topic model the topics were assigned with
+    :param index: Name of the Elasticsearch index
+    :param directory_field: Keyword field to group by (default: top-level directory)
+    :param max_directories: Maximum number of directories returned
+    :param max_topics: Maximum number of topics returned per directory
+    :return: Dictionary mapping directories to dictionaries mapping topic ids to document counts
+    """
+    response = client.search(index=index, body={
+        "size": 0,
+        "query": {"term": {"topic_model_version": model_version}},
+        "aggs": {
+            "directories": {
+                "terms": {"field": directory_field, "size": max_directories},
+                "aggs": {"topics": {"terms": {"field": "top_topic", "size": max_topics}}},
+            }
+        },
+    })
+    return {bucket["key"]: {topic["key"]: topic["doc_count"] for topic in bucket["topics"]["buckets"]}
+            for bucket in response["aggregations"]["directories"]["buckets"]}
+
+
+@cached_query
 def get_column_values_scroll(client, index: str, column: str, scroll_time: str = "2m", batch_size: int = 1000):
     """
     Retrieves all values from a specific column in an Elasticsearch index using a scroll query.
@@ -259,6 +506,38 @@ def get_column_values_scroll(client, index: str, column: str, scroll_time: str =
     # Return the collected values
     return values
 
+@cached_query
+def get_directory_routing_keys(client, index: str, scroll_time: str = "2m", batch_size: int = 1000):
+    """
+    Returns the routing keys (i.e. top-level directories) of every directory in the index.
+    A directory name may occur below several top-level directories; its routing keys are then joined by commas, which
+    Elasticsearch accepts as routing for a search over several shards.
+    :param client: Elasticsearch client
+    :param index: Name of the Elasticsearch index
+    :param scroll_time: Time to keep the scroll context alive (default: 2 minutes)
+    :param batch_size: Number of documents to retrieve per batch (default: 1000)
+    :return: Dictionary mapping directory names to routing keys
+    """
+    routing_keys = defaultdict(set)
+    response = client.search(index=index, body={
+        "size": batch_size,
+        "_source": ["directory", "top_directory"],
+        "query": {"exists": {"field": "top_directory"}},
+    }, scroll=scroll_time)
+    scroll_id = response["_scroll_id"]
+
+    while True:
+        hits = response["hits"]["hits"]
+        if not hits:
+            break
+        for hit in hits:
+            routing_keys[hit["_source"]["directory"]].add(hit["_source"]["top_directory"])
+        response = client.scroll(scroll_id=scroll_id, scroll=scroll_time)
+        scroll_id = response["_scroll_id"]
+
+    client.clear_scroll(scroll_id=scroll_id)
+    return {directory: ",".join(sorted(keys)) for directory, keys in routing_keys.items()}
+
 # if __name__ == '__main__':
 #     client = Elasticsearch(constants.DatabaseAddr.CLIENT_ADDR.value, request_timeout=100)
 #
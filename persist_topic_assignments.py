@@ -0,0 +1,36 @@
+import logging
+import database.init_elasticsearch as db
+from constants import *
+from data.files import save_topic_assignments_to_parquet
+from database.query_db import get_texts_and_embeddings
+from topic.topic_modeling import TopicModel
+from utils.logging_utils import init_debug_config
+
+logger = logging.getLogger(__name__)
+
+if __name__ == '__main__':  # run code on watzmann server
+    on_server = True
+    init_debug_config(log_filename='persist_topic_assignments_', on_server=on_server)
+    model_path = Paths.SERVER_PATH_TO_PROJECT.value + 'models/'
+    model_version = 'topic_model_01_05_25'  # file name of the topic model (cf. TopicModel.save_model)
+    snapshot_path = Paths.SERVER_INC_SAVE_PATH.value + 'topic_assignments/'
+    top_k = 10
+
+    # load topic model
+    model = TopicModel(documents=None)
+    model.load_model(path=model_path, filename=model_version)
+    logging.info(f'Loaded topic model {model_version}')
+
+    # assign topics to all documents using the embeddings computed during ingestion
+    es_db = db.ESDatabase()
+    es_ids, texts, embeddings, routings = get_texts_and_embeddings(client=es_db.get_es_client(), return_routing=True)
+    topic_nums, topic_scores = model.assign_topics(embeddings=embeddings, top_k=top_k)
+    logging.info(f'Assigned topics to {len(es_ids)} documents')
+
+    # store topics in the index and as columnar snapshot
+    es_db.put_topic_mappings()
+    es_db.insert_topic_assignments(es_ids=es_ids, topic_nums=topic_nums, topic_scores=topic_scores,
+                                   model_version=model_version, routings=routings)
+    save_topic_assignments_to_parquet(ids=es_ids, topic_nums=topic_nums, topic_scores=topic_scores,
+                                      model_version=model_version, path=snapshot_path, file_name=model_version)
+    logging.info('Stored topic assignments in the index and as snapshot')
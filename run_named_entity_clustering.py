@@ -13,9 +13,10 @@ if __name__ == '__main__':
     clusterNamedEntities = ClusterNamedEntities(client=client, index=constants.DatabaseAddr.DB_NAME.value, top_n=top_n,
                                                 n_clusters=top_n // 10)
 
-    # Fetch the index mapping
+    # Fetch the index mapping; keyed by the concrete index the alias DB_NAME points to
     mapping = client.indices.get_mapping(index=constants.DatabaseAddr.DB_NAME.value)
-    named_entities_mapping = mapping[constants.DatabaseAddr.DB_NAME.value]["mappings"]["properties"]["named_entities"]["properties"]
+    index_mapping = next(iter(mapping.values()))
+    named_entities_mapping = index_mapping["mappings"]["properties"]["named_entities"]["properties"]
 
     # Extract the keys (categories)
     categories = list(named_entities_mapping.keys())
@@ -1,6 +1,6 @@
 import constants
 import database.init_elasticsearch as db
-from database.query_db import get_texts_from_docs
+from database.query_db import get_topic_assignments
 from topic.topic_fca import *
 from topic.topic_modeling import TopicModel
 
@@ -49,42 +49,32 @@ if __name__ == '__main__':
                        prefix="term_")
     print("Term-topic context loaded and saved as fimi to path: ", incidence_save_path)
 
-    # convert term-topic fimi to rows of integers representing topics incl. mapping as edn file
-    path2fimi = incidence_save_path + f"term_topic_fimi_{save_date}"
-    topic_fca.topics2integers(path2fimi=path2fimi + ".fimi", save_path=path2fimi + "_topics_as_integers.fimi")
-
-    # obtain intents of .fimi efficiently via pcbo (terminal)
-    logging.info(f"Convert fimi to intents via pcbo in terminal: ./pcbo -P4 {path2fimi}_topics_as_integers.fimi /name/of/output/file.fimi")
+    # the fimi files contain the topics as integers; the mapping is saved as edn file next to them
+    # obtain the intents of the term-topic context in-process (same concepts as ./pcbo -P4 on the fimi file)
+    num_concepts = topic_fca.compute_intents(term_topic_ctx, path_to_file=incidence_save_path,
+                                             filename=f"term_topic_intents_{save_date}", num_workers=4)
+    logging.info(f"Saved {num_concepts} intents of the term-topic context to {incidence_save_path}")
 
     # second task: doc-topic incidence for subdirectories
-    # obtain texts from ES index
+    # topics of all documents as stored in the ES index (cf. persist_topic_assignments.py)
+    model_version = 'topic_model_01_05_25'
     es_db = db.ESDatabase(client_addr=constants.DatabaseAddr.PUMBAA_CLIENT_ADDR.value)
     logging.info("Obtained Elasticsearch client")
-    sentences = get_texts_from_docs(client=es_db.get_es_client())
-    logging.info(f"Loaded {len(sentences)} sentences.")
+    es_ids, doc_paths, topic_nums, topic_scores = get_topic_assignments(client=es_db.get_es_client(),
+                                                                        model_version=model_version)
+    logging.info(f"Loaded topics of {len(es_ids)} documents.")
 
-    # obtain topic model using the sentences
-    model = TopicModel(documents=sentences)
+    # the topic model is only needed for its vocabulary and topic words
+    model = TopicModel(documents=None)
+    model.load_model(path=model_path, filename=model_version)
     logging.info("Obtained topic model")
 
     topic_fca = TopicFCA()
     logging.info("Obtained topic fca instance")
 
-    if not path.endswith('/'):
-        path = path + '/'
-
-    # topdown=False -> visit subdirectories first
-    for current_directory, subdirectories, files in os.walk(path, topdown=False):
-        for sub_dir in subdirectories:
-            logging.info(f"Starting to obtain doc-topic incidence for subdirectory {sub_dir}")
-
-            if os.path.exists(incidence_save_path + sub_dir + '/'):
-                logging.info(f"Skipping subdirectory {sub_dir} because it already exists in the save path")
-                continue
-
-            topic_fca.obtain_doc_topic_inc_per_subdir(parent_path=path + sub_dir + '/', save_path=fca_save_path,
-                                                      topic_model=model, recursive=False)
-
-            logging.info(f"Finished obtaining doc-topic incidence for subdirectory {sub_dir}")
+    # all directories below path in one pass
+    topic_fca.obtain_doc_topic_inc_per_directory(paths=doc_paths, topic_nums=topic_nums, topic_scores=topic_scores,
+                                                 save_path=fca_save_path, topic_model=model, parent_path=path,
+                                                 skip_existing=True)
 
     logging.info("The end")
@@ -0,0 +1,140 @@
+import json
+import logging
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from utils.os_manipulation import exists_or_create
+
+logger = logging.getLogger(__name__)
+
+
+def l2_normalize(vectors):
+    """
+    Scale vectors to unit length, hence their dot product is their cosine similarity.
+    :param vectors: Array of shape (num vectors, dimension)
+    :return: Normalized vectors as float32 array
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def top_k_rows(scores, k: int):
+    """
+    Returns the k largest entries of every row in descending order.
+    :param scores: Array of shape (num rows, num columns)
+    :param k: Number of entries per row; at most num columns
+    :return: Column indices and scores of the entries; both of shape (num rows, k)
+    """
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class IVFIndex:
+
+    def __init__(self, centroids, list_offsets, vectors, ids):
+        """
+        Approximate nearest neighbour index (inverted file) for cosine similarity.
+        The vectors are clustered with k-means; each cluster (list) is stored contiguously. A query only scans the
+        lists of its num_probe closest centroids, hence its cost is independent of most of the vectors.
+        Use IVFIndex.build to create an index and IVFIndex.load to load a saved one.
+        :param centroids: Normalized centroids of the lists; shape: (num lists, dimension)
+        :param list_offsets: Start of every list in vectors and the number of vectors; shape: (num lists + 1,)
+        :param vectors: Normalized vectors sorted by list; shape: (num vectors, dimension)
+        :param ids: Ids of the vectors in the same order
+        """
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.vectors = vectors
+        self.ids = ids
+
+    @classmethod
+    def build(cls, vectors, ids=None, num_lists: int = None, random_state: int = 42):
+        """
+        Build an index over vectors.
+        :param vectors: Vectors to index, e.g. document vectors; shape: (num vectors, dimension)
+        :param ids: (Optional) Ids of the vectors; if None, their positions
+        :param num_lists: Number of lists (k-means clusters); if None, about 4 * sqrt(num vectors)
+        :param random_state: Seed of k-means
+        :return: IVFIndex
+        """
+        vectors = l2_normalize(vectors)
+        ids = np.arange(len(vectors)) if ids is None else np.asarray(ids)
+        if num_lists is None:
+            num_lists = int(4 * np.sqrt(len(vectors)))
+        num_lists = max(1, min(num_lists, len(vectors)))
+
+        kmeans = MiniBatchKMeans(n_clusters=num_lists, random_state=random_state, batch_size=4096, n_init=3)
+        assignment = kmeans.fit_predict(vectors)
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=num_lists))
+        logger.info(f"Built index over {len(vectors)} vectors with {num_lists} lists")
+        return cls(centroids=l2_normalize(kmeans.cluster_centers_), list_offsets=list_offsets,
+                   vectors=vectors[order], ids=ids[order])
+
+    def save(self, path: str):
+        """
+        Save the index as .npy files and a manifest.json.
+        :param path: Path to the directory of the index including the '/' at the end
+        :return: -
+        """
+        exists_or_create(path=path)
+        for name in ["centroids", "list_offsets", "vectors", "ids"]:
+            np.save(path + name + ".npy", getattr(self, name))
+        with open(path + "manifest.json", "w") as f:
+            json.dump({"num_vectors": len(self.vectors), "num_lists": len(self.centroids),
+                       "dimension": int(self.vectors.shape[1]), "metric": "cosine"}, f, indent=4)
+        logger.info(f"Saved index to {path}")
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Load an index saved with save.
+        :param path: Path to the directory of the index including the '/' at the end
+        :param mmap: If True, the vectors are memory mapped; only the scanned lists are read from disk
+        :return: IVFIndex
+        """
+        mmap_mode = "r" if mmap else None
+        return cls(centroids=np.load(path + "centroids.npy"), list_offsets=np.load(path + "list_offsets.npy"),
+                   vectors=np.load(path + "vectors.npy", mmap_mode=mmap_mode),
+                   ids=np.load(path + "ids.npy", mmap_mode=mmap_mode))
+
+    def search(self, queries, k: int = 10, num_probe: int = 8):
+        """
+        Find the most similar vectors of a batch of queries.
+        The queries are grouped by the lists they probe, hence every probed list is read and scored once per batch
+        with one matrix product.
+        :param queries: Query vectors; shape: (num queries, dimension)
+        :param k: Number of results per query
+        :param num_probe: Number of lists scanned per query; more lists are slower, but more accurate
+            (num_probe >= number of lists is exact)
+        :return: Cosine similarities and ids of the results in descending order of similarity; both of shape
+            (num queries, k). If less than k vectors were scanned, the missing scores are -inf (and ids -1 for
+            integer ids).
+        """
+        queries = l2_normalize(queries)
+        num_probe = min(num_probe, len(self.centroids))
+        probed_lists, _ = top_k_rows(queries @ self.centroids.T, num_probe)
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_positions = np.full((len(queries), k), -1, dtype=np.int64)
+        for list_num in np.unique(probed_lists):
+            start, end = self.list_offsets[list_num], self.list_offsets[list_num + 1]
+            if start == end:
+                continue
+            query_nums = np.flatnonzero(np.any(probed_lists == list_num, axis=1))
+            scores = queries[query_nums] @ np.asarray(self.vectors[start:end]).T
+            positions = np.broadcast_to(np.arange(start, end), scores.shape)
+
+            # merge the results of this list with the best results so far
+            scores = np.hstack([best_scores[query_nums], scores])
+            positions = np.hstack([best_positions[query_nums], positions])
+            top, top_scores = top_k_rows(scores, k)
+            best_scores[query_nums] = top_scores
+            best_positions[query_nums] = np.take_along_axis(positions, top, axis=1)
+
+        ids = np.asarray(self.ids[np.maximum(best_positions, 0)])
+        if np.issubdtype(ids.dtype, np.integer):
+            ids[best_positions < 0] = -1
+        return best_scores, ids
@@ -0,0 +1,146 @@
+import numpy as np
+from scipy import sparse
+from concepts import Context
+
+
+def pack_rows(incidence, chunk_size: int = 4096):
+    """
+    Pack every row of a binary matrix into one bitset (Python int; bit j is set if column j is 1).
+    Sparse matrices are only made dense chunk by chunk.
+    :param incidence: Binary matrix (NumPy array or scipy.sparse)
+    :param chunk_size: Number of rows made dense at once
+    :return: List of bitsets, one per row
+    """
+    rows = []
+    for start in range(0, incidence.shape[0], chunk_size):
+        chunk = incidence[start:start + chunk_size]
+        chunk = chunk.toarray() if sparse.issparse(chunk) else np.asarray(chunk)
+        packed = np.packbits(chunk != 0, axis=1, bitorder="little")
+        rows.extend(int.from_bytes(row.tobytes(), "little") for row in packed)
+    return rows
+
+
+def bits2indices(bits: int, length: int):
+    """
+    Returns the positions of the set bits of a bitset.
+    :param bits: Bitset (Python int)
+    :param length: Number of bits of the bitset, e.g. the number of objects
+    :return: Sorted positions as NumPy array
+    """
+    packed = np.frombuffer(bits.to_bytes((length + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder="little", count=length))
+
+
+class BitsetContext:
+
+    def __init__(self, objects: list, properties: list, rows: list, columns: list, incidence=None):
+        """
+        Formal context kept in memory as bitsets: one bitset of attributes per object (row) and one bitset of objects
+        per attribute (column). Derivations are bitwise ANDs of these bitsets.
+        It provides the interface of concepts.Context used by TopicFCA (objects, properties, extension, intension,
+        lattice); the lattice is computed by concepts (cf. to_concepts_context) only when it is accessed.
+        Use BitsetContext.from_matrix to create a context.
+        :param objects: Names of the objects, e.g. 'doc_0'
+        :param properties: Names of the attributes, e.g. 'topic_0'
+        :param rows: Bitset of the attributes of every object
+        :param columns: Bitset of the objects of every attribute
+        :param incidence: (Optional) Binary incidence matrix as scipy.sparse CSR matrix
+        """
+        self.objects = tuple(objects)
+        self.properties = tuple(properties)
+        self.rows = rows
+        self.columns = columns
+        self.incidence = incidence
+        self.all_objects = (1 << len(self.objects)) - 1
+        self.all_properties = (1 << len(self.properties)) - 1
+        self._object_indexes = {name: index for index, name in enumerate(self.objects)}
+        self._property_indexes = {name: index for index, name in enumerate(self.properties)}
+        self._concepts_context = None
+
+    @classmethod
+    def from_matrix(cls, incidence, objects: list = None, properties: list = None):
+        """
+        Build a context from a binary matrix without any serialization.
+        :param incidence: Binary matrix (NumPy array or scipy.sparse); rows are objects, columns attributes
+        :param objects: (Optional) Names of the rows; if None, their positions as strings
+        :param properties: (Optional) Names of the columns; if None, their positions as strings
+        :return: BitsetContext
+        """
+        incidence = sparse.csr_matrix(incidence, dtype=bool)
+        incidence.eliminate_zeros()
+        num_objects, num_properties = incidence.shape
+        objects = [str(i) for i in range(num_objects)] if objects is None else objects
+        properties = [str(i) for i in range(num_properties)] if properties is None else properties
+        return cls(objects=objects, properties=properties, rows=pack_rows(incidence),
+                   columns=pack_rows(incidence.T.tocsr()), incidence=incidence)
+
+    @property
+    def shape(self):
+        return len(self.objects), len(self.properties)
+
+    def extent_bits(self, intent_bits: int):
+        """
+        Returns the objects having all attributes of a set of attributes.
+        :param intent_bits: Bitset of attributes
+        :return: Bitset of objects
+        """
+        extent = self.all_objects
+        for prop in bits2indices(intent_bits, len(self.properties)):
+            extent &= self.columns[prop]
+            if not extent:
+                break
+        return extent
+
+    def intent_bits(self, extent_bits: int):
+        """
+        Returns the attributes shared by all objects of a set of objects.
+        :param extent_bits: Bitset of objects
+        :return: Bitset of attributes
+        """
+        intent = self.all_properties
+        for obj in bits2indices(extent_bits, len(self.objects)):
+            intent &= self.rows[obj]
+            if not intent:
+                break
+        return intent
+
+    def extension(self, properties: list):
+        """
+        Returns the names of the objects having all given attributes (cf. concepts.Context.extension).
+        :param properties: Names of attributes
+        :return: Tuple of object names
+        """
+        intent = 0
+        for name in properties:
+            intent |= 1 << self._property_indexes[name]
+        return tuple(self.objects[i] for i in bits2indices(self.extent_bits(intent), len(self.objects)))
+
+    def intension(self, objects: list):
+        """
+        Returns the names of the attributes shared by all given objects (cf. concepts.Context.intension).
+        :param objects: Names of objects
+        :return: Tuple of attribute names
+        """
+        extent = 0
+        for name in objects:
+            extent |= 1 << self._object_indexes[name]
+        return tuple(self.properties[i] for i in bits2indices(self.intent_bits(extent), len(self.properties)))
+
+    def to_matrix(self):
+        """
+        Returns the incidence as dense boolean matrix; shape: (num objects, num attributes).
+        """
+        return self.incidence.toarray()
+
+    def to_concepts_context(self):
+        """
+        Convert the context to a concepts.Context (e.g. to compute and draw its lattice); computed once.
+        :return: concepts.Context
+        """
+        if self._concepts_context is None:
+            self._concepts_context = Context(self.objects, self.properties, [tuple(row) for row in self.to_matrix()])
+        return self._concepts_context
+
+    @property
+    def lattice(self):
+        return self.to_concepts_context().lattice
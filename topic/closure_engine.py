@@ -0,0 +1,128 @@
+import numpy as np
+from scipy import sparse
+
+
+def pack_words(incidence, chunk_size: int = 4096):
+    """
+    Pack every row of a binary matrix into 64 bit words (bit j of a row is bit j % 64 of word j // 64).
+    Sparse matrices are only made dense chunk by chunk.
+    :param incidence: Binary matrix (NumPy array or scipy.sparse)
+    :param chunk_size: Number of rows made dense at once
+    :return: uint64 array of shape (num rows, ceil(num columns / 64))
+    """
+    num_rows, num_columns = incidence.shape
+    num_words = max(1, (num_columns + 63) // 64)
+    words = np.zeros((num_rows, num_words * 8), dtype=np.uint8)
+    for start in range(0, num_rows, chunk_size):
+        chunk = incidence[start:start + chunk_size]
+        chunk = chunk.toarray() if sparse.issparse(chunk) else np.asarray(chunk)
+        packed = np.packbits(chunk != 0, axis=1, bitorder="little")
+        words[start:start + len(packed), :packed.shape[1]] = packed
+    return words.view("<u8")
+
+
+def unpack_words(words, length: int):
+    """
+    Unpack rows of 64 bit words (cf. pack_words).
+    :param words: uint64 array of shape (num rows, num words)
+    :param length: Number of bits per row
+    :return: Boolean array of shape (num rows, length)
+    """
+    return np.unpackbits(np.ascontiguousarray(words, dtype="<u8").view(np.uint8), axis=1, bitorder="little",
+                         count=length).astype(bool)
+
+
+def intents2arrays(intents):
+    """
+    Convert intents to one flat array of attribute ids and offsets (cf. read_fimi).
+    :param intents: Tuple (values, offsets) or list of intents (lists of attribute ids; None entries are ignored, e.g.
+        [None] for the empty intent, cf. intents_from_fimi)
+    :return: Tuple (values, offsets) as int64 arrays
+    """
+    if isinstance(intents, tuple):
+        values, offsets = intents
+        return np.asarray(values, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+    intents = [[attribute for attribute in intent if attribute is not None] for intent in intents]
+    offsets = np.zeros(len(intents) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(intent) for intent in intents])
+    values = np.fromiter((attribute for intent in intents for attribute in intent), dtype=np.int64,
+                         count=offsets[-1])
+    return values, offsets
+
+
+class ClosureEngine:
+
+    def __init__(self, incidence):
+        """
+        Computes extents and closed intents of many sets of attributes at once.
+        Every attribute column and every object row is packed into 64 bit words once; the extent of an intent is the
+        bitwise AND of its columns, the closure of an extent the bitwise AND of the rows of its objects. Both are
+        computed for a batch of intents with one np.bitwise_and.reduceat each.
+        :param incidence: Binary incidence matrix (NumPy array or scipy.sparse); rows are objects, columns attributes
+        """
+        incidence = sparse.csr_matrix(incidence, dtype=bool)
+        self.num_objects, self.num_properties = incidence.shape
+        self.row_words = pack_words(incidence)
+        self.column_words = pack_words(incidence.T.tocsr())
+
+    def extents(self, values, offsets):
+        """
+        Returns the extents of a batch of intents.
+        :param values: Attribute ids of all intents (cf. intents2arrays)
+        :param offsets: Boundaries of the intents in values; shape: (num intents + 1,)
+        :return: Packed extents; uint64 array of shape (num intents, number of words per column)
+        """
+        extents = np.full((len(offsets) - 1, self.column_words.shape[1]), np.iinfo(np.uint64).max, dtype=np.uint64)
+        # reduceat needs non-empty segments; the extent of the empty intent are all objects
+        non_empty = np.flatnonzero(offsets[1:] > offsets[:-1])
+        if len(non_empty):
+            extents[non_empty] = np.bitwise_and.reduceat(self.column_words[values], offsets[non_empty], axis=0)
+        return extents
+
+    def intents(self, extents, object_ids=None, extent_offsets=None):
+        """
+        Returns the closed intents of a batch of extents, i.e. the attributes shared by all objects of each extent.
+        :param extents: Packed extents (cf. extents)
+        :param object_ids: (Optional) Objects of all extents as returned by extent_objects
+        :param extent_offsets: (Optional) Boundaries of the extents in object_ids
+        :return: Packed intents; uint64 array of shape (num extents, number of words per row)
+        """
+        if object_ids is None:
+            object_ids, extent_offsets = self.extent_objects(extents)
+        intents = np.full((len(extents), self.row_words.shape[1]), np.iinfo(np.uint64).max, dtype=np.uint64)
+        # the intent of the empty extent are all attributes
+        non_empty = np.flatnonzero(extent_offsets[1:] > extent_offsets[:-1])
+        if len(non_empty):
+            intents[non_empty] = np.bitwise_and.reduceat(self.row_words[object_ids], extent_offsets[non_empty], axis=0)
+        return intents
+
+    def extent_objects(self, extents):
+        """
+        Returns the objects of a batch of packed extents.
+        :param extents: Packed extents (cf. extents)
+        :return: Tuple of the object ids of all extents and the boundaries of the extents in them
+        """
+        extent_nums, object_ids = np.nonzero(unpack_words(extents, self.num_objects))
+        offsets = np.zeros(len(extents) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(extent_nums, minlength=len(extents)))
+        return object_ids, offsets
+
+    def iter_concepts(self, intents, batch_size: int = None):
+        """
+        Reconstruct the concepts of intents (e.g. computed by pcbo or compute_intents) batch by batch.
+        :param intents: Tuple (values, offsets) or list of intents (cf. intents2arrays)
+        :param batch_size: Number of intents processed together; if None, chosen such that a batch of unpacked
+            extents takes about 64 MB
+        :return: Generator of tuples (object ids of the extent, attribute ids of the closed intent) as arrays
+        """
+        values, offsets = intents2arrays(intents)
+        if batch_size is None:
+            batch_size = max(1, 2 ** 26 // max(self.num_objects, 1))
+        for start in range(0, len(offsets) - 1, batch_size):
+            end = min(start + batch_size, len(offsets) - 1)
+            batch_offsets = offsets[start:end + 1]
+            extents = self.extents(values[batch_offsets[0]:batch_offsets[-1]], batch_offsets - batch_offsets[0])
+            object_ids, extent_offsets = self.extent_objects(extents)
+            closed = unpack_words(self.intents(extents, object_ids, extent_offsets), self.num_properties)
+            for i in range(end - start):
+                yield object_ids[extent_offsets[i]:extent_offsets[i + 1]], np.flatnonzero(closed[i])
@@ -0,0 +1,126 @@
+import logging
+import numpy as np
+from scipy import sparse
+from gensim.parsing.preprocessing import strip_tags
+from gensim.utils import simple_preprocess
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+def default_tokenizer(document: str):
+    """
+    Tokenize a document like Top2Vec builds its vocabulary (its default_tokenizer, which is not importable from the
+    same module in every version of top2vec).
+    :param document: Text
+    :return: List of lower case tokens without accents
+    """
+    return simple_preprocess(strip_tags(document), deacc=True)
+
+
+class WordCooccurrence:
+
+    def __init__(self, documents, vocab: list, batch_size: int = 10000):
+        """
+        Document frequencies and co-occurrence counts of a vocabulary (e.g. the topic words of a model) in a corpus.
+        The documents are tokenized like the vocabulary of Top2Vec and turned into a binary sparse document-term matrix
+        D batch by batch; the co-occurrence matrix C = D^T D (number of documents containing both words) is summed
+        over the batches, hence the corpus does not have to fit in memory.
+        The counts are computed once and shared by all coherence measures (cf. npmi_coherence, umass_coherence).
+        :param documents: Iterable of texts, e.g. a list or a CorpusStore
+        :param vocab: Words to count; words of the topics missing in vocab are treated as never occurring
+        :param batch_size: Number of documents tokenized at once
+        """
+        self.vocab = list(dict.fromkeys(vocab))
+        self.word_indexes = {word: index for index, word in enumerate(self.vocab)}
+        vectorizer = CountVectorizer(tokenizer=default_tokenizer, lowercase=False, token_pattern=None,
+                                     vocabulary=self.word_indexes, binary=True, dtype=np.int32)
+
+        self.num_docs = 0
+        self.cooccurrence = sparse.csr_matrix((len(self.vocab), len(self.vocab)), dtype=np.int64)
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) == batch_size:
+                self._add_batch(vectorizer.transform(batch))
+                batch = []
+        if batch:
+            self._add_batch(vectorizer.transform(batch))
+        # the diagonal of C holds the document frequencies
+        self.doc_freq = self.cooccurrence.diagonal().astype(np.float64)
+        logging.info(f"Counted co-occurrences of {len(self.vocab)} words in {self.num_docs} documents")
+
+    def _add_batch(self, doc_term):
+        self.cooccurrence = self.cooccurrence + (doc_term.T @ doc_term).astype(np.int64)
+        self.num_docs += doc_term.shape[0]
+
+    def word_ids(self, topic_words):
+        """
+        Returns the positions of the topic words in the vocabulary.
+        :param topic_words: Words of each topic; shape: (num topics, num words)
+        :return: Array of positions of the same shape; -1 for words not in the vocabulary
+        """
+        topic_words = np.asarray(topic_words)
+        return np.array([self.word_indexes.get(word, -1) for word in topic_words.ravel()],
+                        dtype=np.int64).reshape(topic_words.shape)
+
+    def pair_counts(self, word_ids):
+        """
+        Returns the co-occurrence counts of all pairs of words of every topic with one sparse lookup.
+        :param word_ids: Positions of the words of each topic (cf. word_ids); shape: (num topics, num words)
+        :return: Counts of shape (num topics, num words, num words); 0 for words not in the vocabulary
+        """
+        num_topics, num_words = word_ids.shape
+        rows = np.repeat(word_ids, num_words, axis=1).ravel()
+        cols = np.tile(word_ids, (1, num_words)).ravel()
+        known = (rows >= 0) & (cols >= 0)
+        counts = np.zeros(len(rows), dtype=np.float64)
+        if known.any():
+            counts[known] = np.asarray(self.cooccurrence[rows[known], cols[known]]).ravel()
+        return counts.reshape(num_topics, num_words, num_words)
+
+
+def npmi_coherence(cooccurrence: WordCooccurrence, topic_words, eps: float = 1e-12):
+    """
+    Normalized pointwise mutual information (NPMI) of the topics, i.e. the mean of
+    log(p(wi, wj) / (p(wi) p(wj))) / -log(p(wi, wj)) over all pairs of words of a topic, where p is the share of
+    documents containing the word(s). Ranges from -1 (words never co-occur) to 1 (words always co-occur).
+    :param cooccurrence: Co-occurrence counts of the corpus
+    :param topic_words: Words of each topic, e.g. the 10 most similar ones; shape: (num topics, num words)
+    :param eps: Smoothing to avoid log(0)
+    :return: NPMI of every topic; shape: (num topics,)
+    """
+    word_ids = cooccurrence.word_ids(topic_words)
+    joint = cooccurrence.pair_counts(word_ids) / max(cooccurrence.num_docs, 1)
+    marginal = np.diagonal(joint, axis1=1, axis2=2)
+    pmi = np.log((joint + eps) / (marginal[:, :, np.newaxis] * marginal[:, np.newaxis, :] + eps))
+    npmi = np.where(joint > 0, pmi / np.maximum(-np.log(joint + eps), eps), -1.0)
+
+    pairs_i, pairs_j = np.triu_indices(word_ids.shape[1], k=1)
+    return npmi[:, pairs_i, pairs_j].mean(axis=1)
+
+
+def umass_coherence(cooccurrence: WordCooccurrence, topic_words):
+    """
+    UMass coherence of the topics, i.e. the mean of log((D(wi, wj) + 1) / D(wj)) over all pairs of words of a topic
+    where wj is ranked higher than wi, and D is the number of documents containing the word(s).
+    Values are at most about 0; higher is more coherent.
+    :param cooccurrence: Co-occurrence counts of the corpus
+    :param topic_words: Words of each topic in descending order of similarity; shape: (num topics, num words)
+    :return: UMass coherence of every topic; shape: (num topics,)
+    """
+    word_ids = cooccurrence.word_ids(topic_words)
+    counts = cooccurrence.pair_counts(word_ids)
+    doc_freq = np.diagonal(counts, axis1=1, axis2=2)
+
+    pairs_i, pairs_j = np.tril_indices(word_ids.shape[1], k=-1)  # wj is ranked higher than wi
+    scores = np.log((counts[:, pairs_i, pairs_j] + 1) / np.maximum(doc_freq[:, pairs_j], 1))
+    return scores.mean(axis=1)
+
+
+def topic_diversity(topic_words):
+    """
+    Share of unique words among the words of all topics (1: no word is shared by topics, close to 0: redundant topics).
+    :param topic_words: Words of each topic, e.g. the 25 most similar ones; shape: (num topics, num words)
+    :return: Topic diversity
+    """
+    topic_words = np.asarray(topic_words)
+    return len(np.unique(topic_words)) / max(topic_words.size, 1)
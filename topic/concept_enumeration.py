@@ -0,0 +1,334 @@
+import heapq
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from topic.bitset_context import bits2indices, pack_rows
+from utils.os_manipulation import exists_or_create
+
+# columns of the context and weight planes of its objects in a worker process (cf. _init_enumeration_worker)
+_worker_columns = []
+_worker_weight_planes = None
+
+
+def closure(extent: int, intent: int, columns: list, start: int = 0):
+    """
+    Returns the attributes shared by all objects of an extent.
+    :param extent: Bitset of objects
+    :param intent: Bitset of attributes known to be shared by all objects of the extent (e.g. the intent of a
+        superconcept); these are not checked again
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param start: Only the attributes start, start + 1, ... are checked
+    :return: Bitset of attributes
+    """
+    for attribute in range(start, len(columns)):
+        if not intent >> attribute & 1 and extent & columns[attribute] == extent:
+            intent |= 1 << attribute
+    return intent
+
+
+def get_weight_planes(weights):
+    """
+    Split the weights of the objects (e.g. their multiplicity in a clarified context) into bit planes: plane b is the
+    bitset of the objects whose weight has bit b set. Hence the weighted support of an extent are a few bitwise ANDs
+    (cf. get_support).
+    :param weights: Non-negative integer weight of every object
+    :return: List of bitsets, one per bit of the largest weight
+    """
+    weights = np.asarray(weights, dtype=np.int64)
+    num_bits = int(weights.max()).bit_length() if len(weights) else 0
+    return pack_rows((weights[np.newaxis, :] >> np.arange(num_bits)[:, np.newaxis]) & 1)
+
+
+def get_support(extent: int, weight_planes: list = None):
+    """
+    Returns the support of an extent, i.e. its number of objects or the sum of their weights.
+    :param extent: Bitset of objects
+    :param weight_planes: (Optional) Weights of the objects (cf. get_weight_planes); if None, every object counts once
+    :return: Support
+    """
+    if weight_planes is None:
+        return extent.bit_count()
+    return sum((extent & plane).bit_count() << bit for bit, plane in enumerate(weight_planes))
+
+
+def iter_children(extent: int, intent: int, start: int, columns: list, min_support: int = 0,
+                  weight_planes: list = None):
+    """
+    Close-by-One step: the concepts generated from the concept (extent, intent) by adding one of the attributes start,
+    start + 1, ... and closing the intent.
+    A new concept is only accepted if its closure adds no attribute smaller than the added one (canonicity test),
+    hence every concept of the context is generated exactly once.
+    cf. S. O. Kuznetsov, "Learning of simple conceptual graphs from positive and negative examples" (1999)
+    :param extent: Bitset of the objects of the concept
+    :param intent: Bitset of the attributes of the concept
+    :param start: First attribute added to the intent
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param min_support: Concepts with less objects are skipped; since the extents of the children are subsets of the
+        extent of their parent, their children are infrequent as well (iceberg lattice)
+    :param weight_planes: (Optional) Weights of the objects the support is computed with (cf. get_support)
+    :return: Generator of tuples (extent, intent, start of the child) in the order of the added attribute
+    """
+    for attribute in range(start, len(columns)):
+        if intent >> attribute & 1:
+            continue
+        new_extent = extent & columns[attribute]
+        if min_support and get_support(new_extent, weight_planes) < min_support:
+            continue
+        if any(not intent >> k & 1 and new_extent & columns[k] == new_extent for k in range(attribute)):
+            continue  # not canonical; the concept is generated from another branch
+        yield new_extent, closure(new_extent, intent | 1 << attribute, columns, start=attribute + 1), attribute + 1
+
+
+def iter_branch(extent: int, intent: int, start: int, columns: list, min_support: int = 0,
+                weight_planes: list = None):
+    """
+    Enumerate the concept (extent, intent) and all concepts generated from it (depth first, cf. iter_children).
+    :param extent: Bitset of the objects of the concept
+    :param intent: Bitset of the attributes of the concept
+    :param start: First attribute added to the intent
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param min_support: Minimum number of objects of the enumerated concepts below the given one
+    :param weight_planes: (Optional) Weights of the objects the support is computed with (cf. get_support)
+    :return: Generator of tuples (extent, intent) as bitsets
+    """
+    stack = [(extent, intent, start)]
+    while stack:
+        extent, intent, start = stack.pop()
+        yield extent, intent
+        stack.extend(reversed(list(iter_children(extent, intent, start, columns, min_support=min_support,
+                                                 weight_planes=weight_planes))))
+
+
+def get_top_concept(columns: list, num_objects: int):
+    """
+    Returns the top concept of a context, i.e. all objects and the attributes shared by all of them.
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param num_objects: Number of objects of the context
+    :return: Tuple (extent, intent) as bitsets
+    """
+    all_objects = (1 << num_objects) - 1
+    return all_objects, closure(all_objects, 0, columns)
+
+
+def iter_concepts(columns: list, num_objects: int, min_support: int = 0, weight_planes: list = None):
+    """
+    Enumerate all (frequent) formal concepts of a context in this process (cf. iter_branch).
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param num_objects: Number of objects of the context
+    :param min_support: Minimum number of objects of the concepts; 0 enumerates the complete lattice
+    :param weight_planes: (Optional) Weights of the objects the support is computed with (cf. get_support)
+    :return: Generator of tuples (extent, intent) as bitsets
+    """
+    extent, intent = get_top_concept(columns, num_objects)
+    if get_support(extent, weight_planes) < min_support:
+        return
+    yield from iter_branch(extent, intent, 0, columns, min_support=min_support, weight_planes=weight_planes)
+
+
+def iter_top_k_concepts(columns: list, num_objects: int, k: int, weight_planes: list = None):
+    """
+    Enumerate the k concepts with the largest extents (support) in descending order of support.
+    The Close-by-One tree is traversed best first: since no concept has more objects than its parent, the concepts
+    leave the priority queue in descending order of support. Children with less objects than the k-th largest
+    support generated so far (a threshold rising during the search) are not queued at all.
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param num_objects: Number of objects of the context
+    :param k: Number of concepts
+    :param weight_planes: (Optional) Weights of the objects the support is computed with (cf. get_support)
+    :return: Generator of tuples (extent, intent) as bitsets
+    """
+    if k <= 0:
+        return
+    extent, intent = get_top_concept(columns, num_objects)
+    support = get_support(extent, weight_planes)
+    queue = [(-support, 0, extent, intent, 0)]
+    best_supports = [support]  # the k largest supports generated so far (min heap)
+    num_queued = 1
+    for _ in range(k):
+        if not queue:
+            return
+        _, _, extent, intent, start = heapq.heappop(queue)
+        yield extent, intent
+        for child_extent, child_intent, child_start in iter_children(extent, intent, start, columns,
+                                                                     min_support=get_threshold(best_supports, k),
+                                                                     weight_planes=weight_planes):
+            support = get_support(child_extent, weight_planes)
+            if support < get_threshold(best_supports, k):
+                continue
+            heapq.heappush(queue, (-support, num_queued, child_extent, child_intent, child_start))
+            num_queued += 1
+            if len(best_supports) < k:
+                heapq.heappush(best_supports, support)
+            elif support > best_supports[0]:
+                heapq.heapreplace(best_supports, support)
+
+
+def get_threshold(best_supports: list, k: int):
+    """
+    Returns the minimum support of a concept to be among the k concepts with the largest support.
+    :param best_supports: Min heap of the k largest supports found so far
+    :param k: Number of concepts
+    :return: Smallest support of best_supports if it is complete, else 0
+    """
+    return best_supports[0] if len(best_supports) == k else 0
+
+
+def get_lower_covers(extents: list):
+    """
+    Returns the lower neighbours of every concept of a set of concepts, e.g. of an iceberg lattice (Hasse diagram).
+    A concept is a lower neighbour of another one if its extent is a proper subset and no extent of the set lies in
+    between.
+    :param extents: Extents of the concepts as bitsets
+    :return: List of the positions of the lower neighbours of every concept
+    """
+    order = sorted(range(len(extents)), key=lambda i: extents[i].bit_count())
+    lower_covers = [[] for _ in extents]
+    for position, upper in enumerate(order):
+        below = [lower for lower in order[:position]
+                 if extents[lower] != extents[upper] and extents[lower] & extents[upper] == extents[lower]]
+        lower_covers[upper] = [lower for lower in below
+                               if not any(other != lower and extents[lower] & extents[other] == extents[lower]
+                                          for other in below)]
+    return lower_covers
+
+
+def intent2line(intent: int, num_properties: int):
+    """
+    Format an intent like pcbo, i.e. its attribute ids in ascending order separated by spaces.
+    :param intent: Bitset of attributes
+    :param num_properties: Number of attributes of the context
+    :return: Line without line break
+    """
+    return ' '.join(map(str, bits2indices(intent, num_properties).tolist()))
+
+
+def _init_enumeration_worker(columns: list, weight_planes: list = None):
+    global _worker_columns, _worker_weight_planes
+    _worker_columns = columns
+    _worker_weight_planes = weight_planes
+
+
+def _enumerate_branch_worker(extent: int, intent: int, start: int, save_filename: str = None, min_support: int = 0):
+    """
+    Enumerate one branch below the top concept (cf. iter_branch) in a worker process.
+    :param save_filename: (Optional) File the intents are written to (one per line like pcbo); if None, the intents
+        are returned
+    :return: Tuple (number of concepts, list of intents or save_filename)
+    """
+    concepts = iter_branch(extent, intent, start, _worker_columns, min_support=min_support,
+                           weight_planes=_worker_weight_planes)
+    if save_filename is None:
+        intents = [concept_intent for _, concept_intent in concepts]
+        return len(intents), intents
+    num_concepts = 0
+    with open(save_filename, "w", buffering=1024 ** 2) as f:
+        for _, concept_intent in concepts:
+            f.write(intent2line(concept_intent, len(_worker_columns)) + "\n")
+            num_concepts += 1
+    return num_concepts, save_filename
+
+
+def iter_branches_parallel(columns: list, num_objects: int, num_workers: int = None, part_path: str = None,
+                           min_support: int = 0, weight_planes: list = None):
+    """
+    Enumerate the intents of all concepts below the top concept with a process pool; each branch below the top
+    concept (cf. iter_children) is enumerated by one worker. The results of a branch are yielded as soon as its worker
+    finished, hence the order of the branches varies.
+    :param columns: Bitset of the objects of every attribute (cf. BitsetContext.columns)
+    :param num_objects: Number of objects of the context
+    :param num_workers: Number of processes; if None, the number of processors
+    :param part_path: (Optional) Path to a directory including the '/' at the end; if given, every worker writes the
+        intents of its branch to a file there instead of returning them
+    :param min_support: Minimum number of objects of the concepts; 0 enumerates the complete lattice
+    :param weight_planes: (Optional) Weights of the objects the support is computed with (cf. get_support)
+    :return: Generator of tuples (number of concepts, list of intents as bitsets or filename) per branch
+    """
+    top_extent, top_intent = get_top_concept(columns, num_objects)
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_enumeration_worker,
+                             initargs=(columns, weight_planes)) as executor:
+        futures = [executor.submit(_enumerate_branch_worker, extent, intent, start,
+                                   None if part_path is None else part_path + f"branch_{start}.fimi", min_support)
+                   for extent, intent, start in iter_children(top_extent, top_intent, 0, columns,
+                                                              min_support=min_support, weight_planes=weight_planes)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def iter_intents(ctx, num_workers: int = 1, min_support: int = 0, weights=None):
+    """
+    Enumerate the intents of all (frequent) formal concepts of a context, starting with the top concept.
+    :param ctx: BitsetContext
+    :param num_workers: Number of processes; 1 enumerates in this process, None uses all processors
+    :param min_support: Minimum number of objects of the concepts; 0 enumerates the complete lattice
+    :param weights: (Optional) Number of objects every object stands for, e.g. the multiplicities of a clarified
+        context (cf. ReducedContext.weights); the support of a concept is the sum of the weights of its objects
+    :return: Generator of intents as bitsets
+    """
+    weight_planes = None if weights is None else get_weight_planes(weights)
+    num_objects = len(ctx.objects)
+    if num_workers == 1 or get_support(ctx.all_objects, weight_planes) < min_support:
+        for _, intent in iter_concepts(ctx.columns, num_objects, min_support=min_support,
+                                       weight_planes=weight_planes):
+            yield intent
+        return
+    yield get_top_concept(ctx.columns, num_objects)[1]
+    for _, intents in iter_branches_parallel(ctx.columns, num_objects, num_workers=num_workers,
+                                             min_support=min_support, weight_planes=weight_planes):
+        yield from intents
+
+
+def save_intents_fimi(intents, num_properties: int, path_to_file: str, filename: str):
+    """
+    Write intents to a FIMI file like pcbo does (one intent per line).
+    :param intents: Iterable of intents as bitsets, e.g. a generator
+    :param num_properties: Number of attributes of the context
+    :param path_to_file: Path to save the file including the '/' at the end
+    :param filename: Name of the file without type extension
+    :return: Number of intents
+    """
+    exists_or_create(path=path_to_file)
+    num_concepts = 0
+    with open(path_to_file + filename + ".fimi", "w", buffering=1024 ** 2) as f:
+        for intent in intents:
+            f.write(intent2line(intent, num_properties) + "\n")
+            num_concepts += 1
+    logging.info(f"Saved {num_concepts} intents as FIMI file: {path_to_file + filename}.fimi")
+    return num_concepts
+
+
+def write_intents_fimi(ctx, path_to_file: str, filename: str, num_workers: int = 1, min_support: int = 0):
+    """
+    Compute the intents of all (frequent) formal concepts of a context and write them to a FIMI file like pcbo does
+    (one intent per line; attribute ids are the positions in ctx.properties, cf. ctx2fimi).
+    The concepts are the same as the ones of pcbo, but their order differs.
+    :param ctx: BitsetContext
+    :param path_to_file: Path to save the file including the '/' at the end
+    :param filename: Name of the file without type extension
+    :param num_workers: Number of processes; 1 enumerates in this process, None uses all processors
+    :param min_support: Minimum number of objects of the concepts; 0 enumerates the complete lattice
+    :return: Number of concepts
+    """
+    if num_workers == 1 or len(ctx.objects) < min_support:
+        return save_intents_fimi(iter_intents(ctx, num_workers=1, min_support=min_support), len(ctx.properties),
+                                 path_to_file=path_to_file, filename=filename)
+
+    exists_or_create(path=path_to_file)
+    num_properties = len(ctx.properties)
+    # every worker writes its branch to a file; the files are appended as soon as they are complete
+    part_path = path_to_file + filename + "_parts/"
+    exists_or_create(path=part_path)
+    with open(path_to_file + filename + ".fimi", "w", buffering=1024 ** 2) as f:
+        f.write(intent2line(get_top_concept(ctx.columns, len(ctx.objects))[1], num_properties) + "\n")
+        num_concepts = 1
+        for num_branch_concepts, part_filename in iter_branches_parallel(ctx.columns, len(ctx.objects),
+                                                                         num_workers=num_workers, part_path=part_path,
+                                                                         min_support=min_support):
+            with open(part_filename, "r") as part:
+                shutil.copyfileobj(part, f)
+            os.remove(part_filename)
+            num_concepts += num_branch_concepts
+    shutil.rmtree(part_path, ignore_errors=True)
+    logging.info(f"Computed {num_concepts} concepts; intents saved as FIMI file: {path_to_file + filename}.fimi")
+    return num_concepts
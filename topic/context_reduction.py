@@ -0,0 +1,144 @@
+import logging
+import numpy as np
+from topic.bitset_context import BitsetContext, bits2indices
+from topic.closure_engine import ClosureEngine, intents2arrays, pack_words
+from topic.concept_enumeration import closure
+
+
+def clarify_rows(incidence):
+    """
+    Merge identical rows of a binary matrix.
+    :param incidence: Binary matrix (NumPy array or scipy.sparse)
+    :return: Tuple of the positions of the first occurrence of every distinct row (sorted), the position of the
+        distinct row of every row (inverse) and the number of rows merged into every distinct row (multiplicity)
+    """
+    words = pack_words(incidence)
+    _, first, inverse, counts = np.unique(words, axis=0, return_index=True, return_inverse=True, return_counts=True)
+    # keep the distinct rows in the order of their first occurrence
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse.ravel()], counts[order]
+
+
+def group_classes(class_map, class_counts):
+    """
+    Group rows by the distinct row they were merged into by clarification (cf. clarify_rows).
+    :param class_map: Position of the distinct row of every row
+    :param class_counts: Number of rows merged into every distinct row
+    :return: Tuple of the rows sorted by their distinct row and the boundaries of the groups in them
+    """
+    return np.argsort(class_map, kind="stable"), np.concatenate(([0], np.cumsum(class_counts)))
+
+
+def expand_classes(class_ids, members, bounds):
+    """
+    Returns the rows merged into some distinct rows by clarification.
+    :param class_ids: Positions of distinct rows
+    :param members: Rows sorted by their distinct row (cf. group_classes)
+    :param bounds: Boundaries of the distinct rows in members
+    :return: Sorted positions of the rows
+    """
+    lengths = bounds[np.asarray(class_ids) + 1] - bounds[class_ids]
+    # positions of the members of every class: start of its group + 0, 1, ..., length - 1
+    positions = np.repeat(bounds[class_ids] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return np.sort(members[positions])
+
+
+def reducible_objects(ctx: BitsetContext):
+    """
+    Find the reducible objects of a clarified context, i.e. objects whose attributes are the intersection of the
+    attributes of all objects having more attributes (an object with all attributes is the intersection of no objects
+    and hence reducible). Removing them does not change the structure of the concept lattice.
+    :param ctx: Clarified context (no two objects have the same attributes)
+    :return: Boolean array; True for reducible objects
+    """
+    reducible = np.zeros(len(ctx.objects), dtype=bool)
+    for obj, row in enumerate(ctx.rows):
+        supersets = ctx.extent_bits(row) & ~(1 << obj)  # objects having (at least) the attributes of obj
+        meet = closure(supersets, 0, ctx.columns) if supersets else ctx.all_properties
+        reducible[obj] = meet == row
+    return reducible
+
+
+def reducible_properties(ctx: BitsetContext):
+    """
+    Find the reducible attributes of a clarified context, i.e. attributes whose objects are the intersection of the
+    objects of all attributes with more objects (cf. reducible_objects).
+    :param ctx: Clarified context (no two attributes have the same objects)
+    :return: Boolean array; True for reducible attributes
+    """
+    reducible = np.zeros(len(ctx.properties), dtype=bool)
+    for prop, column in enumerate(ctx.columns):
+        supersets = closure(column, 0, ctx.columns) & ~(1 << prop)  # attributes of all objects having prop
+        reducible[prop] = ctx.extent_bits(supersets) == column
+    return reducible
+
+
+class ReducedContext:
+
+    def __init__(self, ctx: BitsetContext, reduce_objects: bool = True):
+        """
+        Clarified and reduced version of a context.
+        Clarification merges identical objects (rows) and identical attributes (columns) and keeps their multiplicity;
+        reduction removes the objects (attributes) whose row (column) is the intersection of other rows (columns).
+        The concept lattice of the reduced context has the same structure as the one of the context, every concept
+        is mapped back to the concept of the context with to_original_concept.
+        Removing objects changes the number of objects of the concepts; without object reduction, the support of a
+        concept is the sum of the weights (multiplicities) of its objects (cf. iter_intents), e.g. for iceberg lattices.
+        :param ctx: Context to reduce
+        :param reduce_objects: If False, the objects are only clarified, hence the supports are kept
+        """
+        self.original = ctx
+        incidence = ctx.incidence
+
+        # clarification
+        object_reps, self.object_map, self.object_counts = clarify_rows(incidence)
+        property_reps, self.property_map, self.property_counts = clarify_rows(incidence.T.tocsr())
+        clarified = BitsetContext.from_matrix(incidence[object_reps][:, property_reps])
+        self.clarified = clarified  # rows and columns in the order of object_map and property_map
+
+        # reduction
+        irreducible_objects = ~reducible_objects(clarified) if reduce_objects else np.ones(clarified.shape[0], bool)
+        irreducible_properties = ~reducible_properties(clarified)
+        self.weights = self.object_counts[irreducible_objects]  # multiplicities of the objects of the reduced context
+        self.objects = object_reps[irreducible_objects]  # positions in the original context
+        self.properties = property_reps[irreducible_properties]
+        self.ctx = BitsetContext.from_matrix(clarified.incidence[irreducible_objects][:, irreducible_properties],
+                                             objects=[ctx.objects[i] for i in self.objects],
+                                             properties=[ctx.properties[i] for i in self.properties])
+        logging.info(f"Reduced context of {ctx.shape} to {self.ctx.shape} (clarified: {clarified.shape})")
+
+    def to_original_concept(self, intent_bits: int):
+        """
+        Map the intent of a concept of the reduced context to the concept of the original context.
+        :param intent_bits: Bitset of the attributes of the reduced context
+        :return: Tuple (extent, intent) as bitsets of the objects and attributes of the original context
+        """
+        extent = self.original.all_objects
+        for prop in self.properties[bits2indices(intent_bits, len(self.properties))]:
+            extent &= self.original.columns[prop]
+        return extent, closure(extent, 0, self.original.columns)
+
+    def get_original_objects(self, reduced_object: int):
+        """
+        Returns the objects of the original context merged into an object of the reduced context by clarification.
+        :param reduced_object: Position of the object in the reduced context
+        :return: Positions of the objects in the original context
+        """
+        return np.flatnonzero(self.object_map == self.object_map[self.objects[reduced_object]])
+
+    def get_original_concepts(self, intents):
+        """
+        Reconstruct the concepts of intents of the original context (e.g. computed by pcbo) on the clarified context,
+        i.e. extents and closures are computed on the distinct rows and columns only (cf. ClosureEngine).
+        :param intents: Tuple (values, offsets) or list of intents of the original context (cf. intents2arrays)
+        :return: Generator of tuples (object ids of the extent, attribute ids of the closed intent) of the original
+            context as arrays
+        """
+        values, offsets = intents2arrays(intents)
+        engine = ClosureEngine(self.clarified.incidence)
+        object_groups = group_classes(self.object_map, self.object_counts)
+        property_groups = group_classes(self.property_map, self.property_counts)
+        for object_ids, property_ids in engine.iter_concepts((self.property_map[values], offsets)):
+            yield expand_classes(object_ids, *object_groups), expand_classes(property_ids, *property_groups)
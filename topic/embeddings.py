@@ -0,0 +1,102 @@
+import functools
+import logging
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from constants import EmbeddingModel
+from utils.os_manipulation import exists_or_create
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=2)
+def get_sentence_encoder(model_name: str = EmbeddingModel.NAME.value):
+    """
+    Returns the SentenceTransformer of the given name; the model is loaded only once per process.
+    :param model_name: Name of the SentenceTransformer model
+    :return: SentenceTransformer
+    """
+    return SentenceTransformer(model_name)
+
+
+class PrecomputedEmbedder:
+
+    def __init__(self, documents: list, embeddings, model_name: str = EmbeddingModel.NAME.value):
+        """
+        Callable embedding model for Top2Vec, which returns precomputed embeddings for known documents.
+        Top2Vec calls the embedding model with batches of documents (during training) and of vocabulary words
+        (to find the topic words). Documents whose embedding is known are looked up, all other texts are encoded
+        with the SentenceTransformer the embeddings were computed with.
+        Hence, the model has to be the one used to compute the embeddings (i.e. the one used during ingestion).
+        :param documents: List of documents
+        :param embeddings: Embeddings of the documents; shape: (num documents, embedding dimension)
+        :param model_name: Name of the SentenceTransformer model the embeddings were computed with
+        """
+        if len(documents) != len(embeddings):
+            raise ValueError(f"Got {len(documents)} documents, but {len(embeddings)} embeddings")
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.doc2row = {document: row for row, document in enumerate(documents)}
+
+    def __call__(self, texts: list):
+        """
+        Embed a batch of texts.
+        :param texts: List of texts
+        :return: Embeddings of the texts as array; shape: (num texts, embedding dimension)
+        """
+        rows = [self.doc2row.get(text, -1) for text in texts]
+        missing = [i for i, row in enumerate(rows) if row == -1]
+        if not missing:
+            return np.asarray(self.embeddings[rows], dtype=np.float32)
+
+        vectors = np.empty((len(texts), self.embeddings.shape[1]), dtype=np.float32)
+        known = [i for i, row in enumerate(rows) if row != -1]
+        if known:
+            vectors[known] = self.embeddings[[rows[i] for i in known]]
+        vectors[missing] = get_sentence_encoder(self.model_name).encode([texts[i] for i in missing])
+        return vectors
+
+    def __getstate__(self):
+        # the lookup is only needed while training; do not pickle the documents and embeddings with the model
+        return {"model_name": self.model_name, "embeddings": np.empty((0, 0), dtype=np.float32), "doc2row": {}}
+
+
+def save_embedding_snapshot(path: str, ids, embeddings):
+    """
+    Save a snapshot of document embeddings, e.g. the embeddings stored in Elasticsearch (cf. get_texts_and_embeddings).
+    The snapshot consists of the files ids.npy and embeddings.npy in the given directory.
+    :param path: Path to the snapshot directory including the '/' at the end
+    :param ids: Document ids (e.g. Elasticsearch ids)
+    :param embeddings: Embeddings of the documents; shape: (num documents, embedding dimension)
+    :return: -
+    """
+    exists_or_create(path=path)
+    np.save(path + "ids.npy", np.asarray(ids, dtype=str))
+    np.save(path + "embeddings.npy", np.asarray(embeddings, dtype=np.float32))
+    logger.info(f"Saved embedding snapshot of {len(ids)} documents to {path}")
+
+
+def load_embedding_snapshot(path: str, mmap: bool = True):
+    """
+    Load a snapshot of document embeddings saved with save_embedding_snapshot.
+    :param path: Path to the snapshot directory including the '/' at the end
+    :param mmap: If True, the embeddings are memory mapped instead of read into memory
+    :return: Document ids, embeddings
+    """
+    ids = np.load(path + "ids.npy")
+    embeddings = np.load(path + "embeddings.npy", mmap_mode="r" if mmap else None)
+    return ids, embeddings
+
+
+def align_embeddings(ids, snapshot_ids, embeddings):
+    """
+    Select the embeddings of the given documents from a snapshot, in the order of ids.
+    :param ids: Ids of the documents to select
+    :param snapshot_ids: Ids of the documents in the snapshot
+    :param embeddings: Embeddings of the snapshot
+    :return: Embeddings of the given documents; shape: (len(ids), embedding dimension)
+    """
+    id2row = {doc_id: row for row, doc_id in enumerate(snapshot_ids)}
+    missing = [doc_id for doc_id in ids if doc_id not in id2row]
+    if missing:
+        raise KeyError(f"{len(missing)} documents are not in the snapshot, e.g. {missing[:5]}")
+    return np.asarray(embeddings[[id2row[doc_id] for doc_id in ids]], dtype=np.float32)
@@ -0,0 +1,77 @@
+import logging
+import numpy as np
+from scipy import sparse
+from utils.os_manipulation import exists_or_create
+
+
+def write_fimi(incidence, path_to_file: str, filename: str, attribute_labels: list = None, chunk_size: int = 65536):
+    """
+    Write a binary incidence matrix to a file in the FIMI format.
+    Each line contains the column numbers (attribute ids) of the non-zero entries of one row (object) in ascending
+    order; the lines are taken from the sparse structure chunk by chunk, hence the matrix is never dense.
+    cf. https://fcalgs.sourceforge.net/format.html
+    :param incidence: Binary incidence matrix (scipy.sparse or NumPy array); rows are objects, columns attributes
+    :param path_to_file: Path to save the file including the '/' at the end
+    :param filename: Name of the file without type extension
+    :param attribute_labels: (Optional) Labels of the columns; if given, the mapping from label to attribute id is
+        saved as <filename>_mapping.edn (cf. write_mapping)
+    :param chunk_size: Number of lines written at once
+    :return: -
+    """
+    exists_or_create(path=path_to_file)
+    incidence = sparse.csr_matrix(incidence)
+    incidence.eliminate_zeros()
+    incidence.sort_indices()
+    indptr, indices = incidence.indptr, incidence.indices
+    tokens = np.array([str(col).encode("ascii") for col in range(incidence.shape[1])], dtype=object)
+
+    with open(path_to_file + filename + ".fimi", "xb") as f:
+        for start in range(0, incidence.shape[0], chunk_size):
+            end = min(start + chunk_size, incidence.shape[0])
+            row_tokens = tokens[indices[indptr[start]:indptr[end]]]
+            bounds = indptr[start:end + 1] - indptr[start]
+            f.write(b"".join(b" ".join(row_tokens[bounds[row]:bounds[row + 1]]) + b"\n"
+                             for row in range(end - start)))
+    logging.info(f"Incidence saved as FIMI file: {path_to_file + filename}.fimi")
+
+    if attribute_labels is not None:
+        write_mapping(attribute_labels, save_filename=path_to_file + filename + "_mapping.edn")
+
+
+def write_mapping(attribute_labels: list, save_filename: str):
+    """
+    Save the mapping from attribute label to attribute id (its position in attribute_labels) as edn file.
+    :param attribute_labels: Labels of the attributes in the order of their ids
+    :param save_filename: Path to the file including the file ending .edn
+    :return: -
+    """
+    with open(save_filename, "w") as f:
+        f.write(str({str(label): i for i, label in enumerate(attribute_labels)}))
+    logging.info(f"Mapping of attributes to integers saved as edn file: {save_filename}")
+
+
+def iter_fimi(path_to_file: str):
+    """
+    Iterate over the lines of a FIMI file (e.g. the intents computed by pcbo) one at a time.
+    :param path_to_file: Path to the FIMI file including the file ending
+    :return: Generator of int32 arrays of the attribute ids of each line; empty lines are empty arrays
+    """
+    with open(path_to_file, "rb") as f:
+        for line in f:
+            yield np.array(line.split(), dtype=np.int32)
+
+
+def read_fimi(path_to_file: str):
+    """
+    Read all lines of a FIMI file into one flat array (cf. iter_fimi).
+    The attribute ids of line i are values[offsets[i]:offsets[i + 1]].
+    :param path_to_file: Path to the FIMI file including the file ending
+    :return: Tuple (values, offsets) of an int32 array of all attribute ids and an int64 array of the line boundaries
+    """
+    values, lengths = [], []
+    for line in iter_fimi(path_to_file):
+        values.append(line)
+        lengths.append(len(line))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    return (np.concatenate(values) if values else np.empty(0, dtype=np.int32)), offsets
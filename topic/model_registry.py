@@ -0,0 +1,302 @@
+import datetime
+import json
+import logging
+import os
+import pickle
+import numpy as np
+from top2vec import Top2Vec
+from constants import EmbeddingModel
+from topic.ann_index import l2_normalize, top_k_rows
+from topic.embeddings import get_sentence_encoder
+from utils.os_manipulation import exists_or_create
+
+logger = logging.getLogger(__name__)
+
+# arrays of a Top2Vec model stored per version; all of them are memory mapped when loaded
+_ARRAYS = ["topic_vectors", "topic_words", "topic_word_scores", "topic_sizes", "doc_top", "doc_dist",
+           "document_vectors", "document_ids", "vocab", "word_vectors"]
+# fitted estimators stored per version; each of them is unpickled only when accessed
+_ESTIMATORS = ["umap_model", "hdbscan_model"]
+_FULL_MODEL = "top2vec_model"
+
+
+def save_top2vec(model, file: str):
+    """
+    Save a Top2Vec model with Top2Vec.save and keep it usable afterward.
+    Top2Vec.save removes the embedding model from the live model (self.embed = None); a model trained on precomputed
+    embeddings (embedding_model 'custom') could not embed texts anymore, hence the embedding model is restored.
+    :param model: Top2Vec model
+    :param file: Path to the file
+    :return: -
+    """
+    embed = getattr(model, "embed", None)
+    try:
+        model.save(file)
+    finally:
+        model.embed = embed
+
+
+class StoredTopicModel:
+
+    def __init__(self, path: str, mmap: bool = True):
+        """
+        Query-only topic model loaded from a version of the model registry (cf. ModelRegistry.load).
+        It provides the attributes and methods of a Top2Vec model used by TopicModel (e.g. topic_vectors, topic_words,
+        get_documents_topics), hence it can be used as TopicModel.model. The arrays are memory mapped and the fitted
+        estimators are only unpickled when they are accessed.
+        :param path: Path to the directory of the version including the '/' at the end
+        :param mmap: If True, the arrays are memory mapped instead of read into memory
+        """
+        self.path = path
+        with open(path + "manifest.json", "r") as f:
+            self.manifest = json.load(f)
+        for name in self.manifest["arrays"]:
+            setattr(self, name, np.load(path + name + ".npy", mmap_mode="r" if mmap else None))
+        self.embedding_model = self.manifest["embedding_model"]
+        self._word_indexes = None
+        self._doc_id2index = None
+        self._estimators = {}
+
+    @property
+    def word_indexes(self):
+        if self._word_indexes is None:
+            self._word_indexes = {word: index for index, word in enumerate(self.vocab.tolist())}
+        return self._word_indexes
+
+    @property
+    def umap_model(self):
+        return self.load_estimator("umap_model")
+
+    @property
+    def hdbscan_model(self):
+        return self.load_estimator("hdbscan_model")
+
+    def load_estimator(self, name: str):
+        """
+        Unpickle a fitted estimator of the model (once).
+        :param name: Name of the estimator, e.g. 'umap_model'
+        :return: Estimator or None if it was not saved
+        """
+        if name not in self._estimators:
+            if name not in self.manifest["estimators"]:
+                return None
+            with open(self.path + name + ".pkl", "rb") as f:
+                self._estimators[name] = pickle.load(f)
+        return self._estimators[name]
+
+    def load_top2vec(self):
+        """
+        Load the complete Top2Vec model, e.g. to add documents to it (cf. TopicModel.add_documents).
+        :return: Top2Vec model
+        """
+        if not self.manifest["full_model"]:
+            raise FileNotFoundError(f"The complete model was not saved in {self.path}")
+        return Top2Vec.load(self.path + _FULL_MODEL)
+
+    def get_num_topics(self):
+        return len(self.topic_vectors)
+
+    def _embed_documents(self, train_corpus, batch_size: int):
+        """
+        Embed documents with the embedding model of the topic model; the embeddings are l2 normalized (cf. Top2Vec).
+        :param train_corpus: List of texts
+        :param batch_size: Number of texts embedded at once
+        :return: Embeddings as array; shape: (num texts, embedding dimension)
+        """
+        vectors = get_sentence_encoder(self.embedding_model).encode(list(train_corpus), batch_size=batch_size)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def get_documents_topics(self, doc_ids, reduced: bool = False, num_topics: int = 1):
+        """
+        Get the topics of documents of the training corpus (cf. Top2Vec.get_documents_topics).
+        :param doc_ids: Ids of the documents
+        :param reduced: Not supported; topic reduction is not stored in the registry
+        :param num_topics: Number of topics per document
+        :return: Topic ids, their scores, topic words and word scores of the documents
+        """
+        if reduced:
+            raise ValueError("Reduced topics are not stored in the model registry")
+        if self._doc_id2index is None:
+            self._doc_id2index = {doc_id: index for index, doc_id in enumerate(self.document_ids.tolist())}
+        doc_indexes = np.array([self._doc_id2index[doc_id] for doc_id in doc_ids], dtype=np.int64)
+
+        if num_topics == 1:
+            doc_topics = np.asarray(self.doc_top[doc_indexes])
+            doc_dist = np.asarray(self.doc_dist[doc_indexes])
+        else:
+            similarities = np.asarray(self.document_vectors[doc_indexes]) @ np.asarray(self.topic_vectors).T
+            doc_topics = np.flip(np.argsort(similarities, axis=1), axis=1)[:, :num_topics]
+            doc_dist = np.take_along_axis(similarities, doc_topics, axis=1)
+        return doc_topics, doc_dist, np.asarray(self.topic_words[doc_topics]), \
+            np.asarray(self.topic_word_scores[doc_topics])
+
+    def _validate_topic_num(self, topic_num: int, reduced: bool):
+        if reduced:
+            raise ValueError("Reduced topics are not stored in the model registry")
+        if not 0 <= topic_num < self.get_num_topics():
+            raise ValueError(f"Invalid topic number: valid topics numbers are 0 to {self.get_num_topics() - 1}")
+
+    def _search_topics_by_vector(self, vector, num_topics: int):
+        """
+        Get the topics closest to a l2 normalized vector (cf. Top2Vec.search_topics_by_vector).
+        :param vector: Vector; shape: (embedding dimension,)
+        :param num_topics: Number of topics to return
+        :return: Topic words, word scores, topic scores and topic ids in descending order of similarity
+        """
+        num_topics = min(num_topics, self.get_num_topics())
+        topic_nums, topic_scores = top_k_rows(vector[np.newaxis] @ np.asarray(self.topic_vectors).T, num_topics)
+        topic_nums, topic_scores = topic_nums[0], topic_scores[0]
+        return np.asarray(self.topic_words[topic_nums]), np.asarray(self.topic_word_scores[topic_nums]), \
+            topic_scores, topic_nums
+
+    def query_topics(self, query: str, num_topics: int, reduced: bool = False):
+        """
+        Semantic search of topics using a text query (cf. Top2Vec.query_topics).
+        :param query: Text query
+        :param num_topics: Number of topics to return
+        :param reduced: Not supported; topic reduction is not stored in the registry
+        :return: Topic words, word scores, topic scores and topic ids in descending order of similarity
+        """
+        if reduced:
+            raise ValueError("Reduced topics are not stored in the model registry")
+        return self._search_topics_by_vector(self._embed_documents([query], batch_size=1)[0], num_topics)
+
+    def search_topics(self, keywords, num_topics: int, keywords_neg=None, reduced: bool = False):
+        """
+        Semantic search of topics using keywords of the vocabulary (cf. Top2Vec.search_topics).
+        :param keywords: List of words the topics should be similar to
+        :param num_topics: Number of topics to return
+        :param keywords_neg: (Optional) List of words the topics should be dissimilar to
+        :param reduced: Not supported; topic reduction is not stored in the registry
+        :return: Topic words, word scores, topic scores and topic ids in descending order of similarity
+        """
+        if reduced:
+            raise ValueError("Reduced topics are not stored in the model registry")
+        if getattr(self, "word_vectors", None) is None:
+            raise ValueError(f"The word vectors were not saved in {self.path}; use query_topics instead")
+        keywords_neg = keywords_neg or []
+        for word in keywords + keywords_neg:
+            if word not in self.word_indexes:
+                raise ValueError(f"'{word}' has not been learned by the model so it cannot be searched")
+
+        word_vectors = l2_normalize(self.word_vectors[[self.word_indexes[word] for word in keywords + keywords_neg]])
+        signs = np.array([1] * len(keywords) + [-1] * len(keywords_neg), dtype=np.float32)
+        vector = l2_normalize((signs @ word_vectors)[np.newaxis])[0]
+        return self._search_topics_by_vector(vector, num_topics)
+
+    def query_documents(self, query: str, num_docs: int, return_documents: bool = True):
+        """
+        Semantic search of documents of the training corpus using a text query (cf. Top2Vec.query_documents).
+        The registry does not store the documents, hence only their scores and ids are returned (like Top2Vec does
+        for models trained with keep_documents=False); use TopicModel.query_documents_batch for many queries.
+        :param query: Text query
+        :param num_docs: Number of documents to return
+        :param return_documents: Ignored; the documents are not stored in the registry
+        :return: Document scores and ids in descending order of similarity
+        """
+        vector = self._embed_documents([query], batch_size=1)
+        num_docs = min(num_docs, len(self.document_vectors))
+        positions, scores = top_k_rows(vector @ np.asarray(self.document_vectors).T, num_docs)
+        return scores[0], np.asarray(self.document_ids[positions[0]])
+
+
+class ModelRegistry:
+
+    def __init__(self, path: str):
+        """
+        Registry of versioned topic models.
+        Each version is a directory <name>_<timestamp>/ containing the arrays of the model as .npy files, the fitted
+        estimators as separate pickles, (optionally) the complete Top2Vec model and a manifest.json describing them.
+        :param path: Path to the registry including the '/' at the end
+        """
+        self.path = path
+        exists_or_create(path=path)
+
+    def save(self, model, name: str = "topic_model", embedding_model: str = None, save_full_model: bool = True):
+        """
+        Save a new version of a topic model.
+        :param model: Top2Vec model (e.g. TopicModel.model)
+        :param name: Name of the model; the version is the name followed by the current time
+        :param embedding_model: Name of the SentenceTransformer the model embeds documents with; if None, the embedding
+            model of the Top2Vec model or EmbeddingModel.NAME for models trained on precomputed embeddings
+        :param save_full_model: If True, the complete Top2Vec model is saved as well (needed to add documents)
+        :return: Version of the model
+        """
+        version = name + "_" + datetime.datetime.now().strftime('%Y_%m_%d_%H%M%S_%f')
+        version_path = self.path + version + '/'
+        exists_or_create(path=version_path)
+
+        arrays = {}
+        for array_name in _ARRAYS:
+            value = getattr(model, array_name, None)
+            if value is None:
+                continue
+            value = np.asarray(value)
+            if value.dtype == object:  # e.g. document ids; memory mapping requires fixed size types
+                value = np.asarray(value.tolist())
+            np.save(version_path + array_name + ".npy", value)
+            arrays[array_name] = {"shape": list(value.shape), "dtype": str(value.dtype)}
+
+        estimators = []
+        for estimator_name in _ESTIMATORS:
+            estimator = getattr(model, estimator_name, None)
+            if estimator is not None:
+                with open(version_path + estimator_name + ".pkl", "wb") as f:
+                    pickle.dump(estimator, f, protocol=pickle.HIGHEST_PROTOCOL)
+                estimators.append(estimator_name)
+
+        if save_full_model:
+            save_top2vec(model, version_path + _FULL_MODEL)
+
+        if embedding_model is None:
+            embedding_model = model.embedding_model if model.embedding_model != "custom" else EmbeddingModel.NAME.value
+        manifest = {
+            "version": version,
+            "name": name,
+            "created": datetime.datetime.now().isoformat(),
+            "num_topics": len(model.topic_vectors),
+            "num_documents": len(model.document_vectors) if getattr(model, "document_vectors", None) is not None
+            else 0,
+            "embedding_model": embedding_model,
+            "arrays": arrays,
+            "estimators": estimators,
+            "full_model": save_full_model,
+        }
+        with open(version_path + "manifest.json", "w") as f:
+            json.dump(manifest, f, indent=4)
+        logger.info(f"Saved topic model version {version} to {self.path}")
+        return version
+
+    def list_versions(self, name: str = None):
+        """
+        Returns the versions in the registry from oldest to newest.
+        :param name: (Optional) Only versions of the model with this name
+        :return: List of versions
+        """
+        versions = []
+        for version in os.listdir(self.path):
+            manifest_path = self.path + version + "/manifest.json"
+            if not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            if name is None or manifest["name"] == name:
+                versions.append((manifest["created"], version))
+        return [version for created, version in sorted(versions)]
+
+    def load(self, version: str = None, name: str = None, mmap: bool = True):
+        """
+        Load a version of a topic model for queries (cf. StoredTopicModel).
+        :param version: Version of the model; if None, the latest version (of the model called name)
+        :param name: (Optional) Name of the model; only used if version is None
+        :param mmap: If True, the arrays are memory mapped instead of read into memory
+        :return: StoredTopicModel
+        """
+        if version is None:
+            versions = self.list_versions(name=name)
+            if not versions:
+                raise FileNotFoundError(f"No topic model in the registry {self.path}")
+            version = versions[-1]
+        logger.info(f"Loading topic model version {version}")
+        return StoredTopicModel(self.path + version + '/', mmap=mmap)
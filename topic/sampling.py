@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def stratified_sample_indices(strata: list, sample_size: int, min_per_stratum: int = 1, random_state: int = 42):
+    """
+    Draw a stratified random sample, e.g. of the documents of a corpus stratified by their top-level directory
+    (cf. get_top_level_directory).
+    Every stratum is sampled proportionally to its size, but with at least min_per_stratum documents (or all of them,
+    if it is smaller), hence small directories are represented as well.
+    :param strata: Stratum of each document, e.g. its top-level directory
+    :param sample_size: Number of documents to sample (approximately, because of rounding and min_per_stratum)
+    :param min_per_stratum: Minimum number of documents per stratum
+    :param random_state: Seed of the random number generator
+    :return: Sorted positions of the sampled documents
+    """
+    rng = np.random.default_rng(random_state)
+    labels, stratum_of_doc = np.unique(np.asarray(strata, dtype=str), return_inverse=True)
+    counts = np.bincount(stratum_of_doc, minlength=len(labels))
+    allocation = np.round(sample_size * counts / max(len(stratum_of_doc), 1)).astype(np.int64)
+    allocation = np.minimum(np.maximum(allocation, np.minimum(min_per_stratum, counts)), counts)
+
+    order = np.argsort(stratum_of_doc, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    sample = [rng.choice(order[starts[stratum]:starts[stratum + 1]], size=allocation[stratum], replace=False)
+              for stratum in range(len(labels))]
+    return np.sort(np.concatenate(sample)) if sample else np.empty(0, dtype=np.int64)
+
+
+def topic_share_distance(topics_a, topics_b, num_topics: int):
+    """
+    Total variation distance between the topic distributions of two sets of documents, i.e. half the sum of the
+    absolute differences of the share of documents per topic (0: same distribution, 1: disjoint topics).
+    :param topics_a: Topic of each document of the first set
+    :param topics_b: Topic of each document of the second set
+    :param num_topics: Number of topics
+    :return: Total variation distance
+    """
+    share_a = np.bincount(np.asarray(topics_a), minlength=num_topics) / max(len(topics_a), 1)
+    share_b = np.bincount(np.asarray(topics_b), minlength=num_topics) / max(len(topics_b), 1)
+    return float(0.5 * np.abs(share_a - share_b).sum())
+
+
+def cluster_topics(cluster_labels, document_vectors, topic_vectors):
+    """
+    Map the HDBSCAN cluster of each training document to its topic.
+    Top2Vec computes each topic vector as the (normalized) mean of the document vectors of a cluster and then orders
+    the topics by size, hence every cluster is mapped to the topic closest to the mean of its document vectors.
+    :param cluster_labels: HDBSCAN cluster of each training document (hdbscan_model.labels_); -1 for outliers
+    :param document_vectors: Vectors of the training documents, in the order of cluster_labels
+    :param topic_vectors: Topic vectors of the model
+    :return: Topic of each training document; -1 for outliers
+    """
+    cluster_labels = np.asarray(cluster_labels)
+    topics = np.full(len(cluster_labels), -1, dtype=np.int64)
+    clustered = cluster_labels != -1
+    if not clustered.any():
+        return topics
+    labels, cluster_of_doc = np.unique(cluster_labels[clustered], return_inverse=True)
+    centroids = np.zeros((len(labels), np.shape(document_vectors)[1]), dtype=np.float64)
+    np.add.at(centroids, cluster_of_doc, np.asarray(document_vectors, dtype=np.float64)[clustered])
+    topics[clustered] = np.argmax(centroids @ np.asarray(topic_vectors, dtype=np.float64).T, axis=1)[cluster_of_doc]
+    return topics
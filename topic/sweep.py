@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import hdbscan
+import numpy as np
+import pandas as pd
+import umap
+from sklearn.feature_extraction.text import CountVectorizer
+from constants import EmbeddingModel
+from topic.coherence import default_tokenizer
+from topic.embeddings import get_sentence_encoder
+from utils.os_manipulation import exists_or_create
+
+logger = logging.getLogger(__name__)
+
+# defaults of Top2Vec; a configuration of the sweep overrides single arguments
+DEFAULT_UMAP_ARGS = {'n_neighbors': 15, 'n_components': 5, 'metric': 'cosine'}
+DEFAULT_HDBSCAN_ARGS = {'min_cluster_size': 15, 'metric': 'euclidean', 'cluster_selection_method': 'eom'}
+
+
+def fingerprint(*parts):
+    """
+    Returns a fingerprint of the given parts, e.g. of the embeddings and the arguments of a reduction.
+    Arrays are hashed by their content, everything else by its JSON representation (sequences element by element).
+    :param parts: Arrays, dictionaries, strings, numbers or sequences (e.g. documents)
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(str((part.shape, part.dtype)).encode("utf-8"))
+            for row in range(0, len(part), 100000):  # chunks, since the array may be memory mapped
+                digest.update(np.ascontiguousarray(part[row:row + 100000]).tobytes())
+        elif isinstance(part, (dict, str, int, float)) or part is None:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        else:  # sequence, e.g. documents
+            for element in part:
+                digest.update(json.dumps(element, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cluster(reduced_path: str, hdbscan_args: dict):
+    """
+    Cluster the reduced document vectors with HDBSCAN (one trial of the sweep; runs in a worker process).
+    :param reduced_path: Path to the .npy file of the reduced document vectors
+    :param hdbscan_args: Arguments of HDBSCAN
+    :return: Number of topics, share of outliers, duration of the clustering in seconds
+    """
+    start = time.perf_counter()
+    labels = hdbscan.HDBSCAN(**hdbscan_args).fit(np.load(reduced_path, mmap_mode="r")).labels_
+    return int(len(set(labels) - {-1})), float(np.mean(labels == -1)), time.perf_counter() - start
+
+
+class TopicModelSweep:
+
+    def __init__(self, cache_path: str, documents: list = None, embeddings=None,
+                 embedding_model: str = EmbeddingModel.TOPIC_MODEL_NAME.value):
+        """
+        Hyper-parameter sweep over the stages of Top2Vec (vocabulary, UMAP, HDBSCAN).
+        The embeddings and every UMAP reduction are computed once and cached on disk by the fingerprint of their input
+        and arguments, hence a configuration only differing in the HDBSCAN arguments only clusters again.
+        The best configuration can be trained afterward with TopicModel.create_model(min_count, umap_args,
+        hdbscan_args).
+        :param cache_path: Path to the cache directory including the '/' at the end
+        :param documents: Documents of the corpus; needed for the vocabulary and if no embeddings are given
+        :param embeddings: (Optional) Precomputed embeddings of the documents (e.g. from Elasticsearch)
+        :param embedding_model: Name of the SentenceTransformer used if no embeddings are given; the default is the one
+            of TopicModel, hence the sweep and the trained model see the same embeddings
+        """
+        self.cache_path = cache_path
+        self.documents = documents
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        exists_or_create(path=cache_path)
+
+    def get_embeddings(self):
+        """
+        Returns the l2 normalized embeddings of the documents; computed once and cached.
+        :return: Embeddings and the duration of their computation in seconds (0 if cached)
+        """
+        if self.embeddings is not None:
+            embeddings = np.asarray(self.embeddings, dtype=np.float32)
+            return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12), 0.0
+
+        cache_file = self.cache_path + "embeddings_" + fingerprint(self.embedding_model, self.documents) + ".npy"
+        if os.path.exists(cache_file):
+            return np.load(cache_file, mmap_mode="r"), 0.0
+        start = time.perf_counter()
+        embeddings = get_sentence_encoder(self.embedding_model).encode(list(self.documents),
+                                                                         normalize_embeddings=True)
+        np.save(cache_file, np.asarray(embeddings, dtype=np.float32))
+        logger.info(f"Embedded {len(self.documents)} documents")
+        return np.load(cache_file, mmap_mode="r"), time.perf_counter() - start
+
+    def get_reduced_path(self, embeddings, umap_args: dict):
+        """
+        Returns the path to the UMAP reduction of the embeddings; computed once per arguments and cached.
+        :param embeddings: l2 normalized embeddings (cf. get_embeddings)
+        :param umap_args: Arguments of UMAP
+        :return: Path to the .npy file of the reduced vectors and the duration of the reduction in seconds (0 if cached)
+        """
+        cache_file = self.cache_path + "umap_" + fingerprint(embeddings, umap_args) + ".npy"
+        if os.path.exists(cache_file):
+            return cache_file, 0.0
+        start = time.perf_counter()
+        reduced = umap.UMAP(**umap_args).fit(embeddings).embedding_
+        np.save(cache_file, np.asarray(reduced, dtype=np.float32))
+        logger.info(f"Reduced embeddings with UMAP {umap_args}")
+        return cache_file, time.perf_counter() - start
+
+    def get_vocab_sizes(self, min_counts: list):
+        """
+        Returns the size of the vocabulary of Top2Vec for every min_count; the corpus is tokenized once.
+        :param min_counts: Values of min_count
+        :return: Dictionary mapping min_count to the number of words occurring more than min_count times
+        """
+        if self.documents is None:
+            return {min_count: None for min_count in min_counts}
+        vectorizer = CountVectorizer(tokenizer=default_tokenizer, lowercase=False, token_pattern=None)
+        word_counts = np.asarray(vectorizer.fit_transform(self.documents).sum(axis=0)).ravel()
+        return {min_count: int(np.sum(word_counts > min_count)) for min_count in min_counts}
+
+    def run(self, configurations: list, num_workers: int = None, save_path: str = None):
+        """
+        Run the sweep.
+        :param configurations: List of dictionaries with the keys 'min_count', 'umap_args' and 'hdbscan_args'
+            (each optional); the arguments override the defaults of Top2Vec (DEFAULT_UMAP_ARGS, DEFAULT_HDBSCAN_ARGS)
+        :param num_workers: Number of processes running the HDBSCAN trials; if None, the number of processors
+        :param save_path: (Optional) Path to save the results as sweep_results.csv including the '/' at the end
+        :return: DataFrame with one row per configuration: its arguments, vocabulary size, number of topics, share of
+            outlier documents and the durations of embedding, UMAP and HDBSCAN in seconds
+        """
+        embeddings, embedding_time = self.get_embeddings()
+        configurations = [{'min_count': configuration.get('min_count', 10),
+                           'umap_args': {**DEFAULT_UMAP_ARGS, **configuration.get('umap_args', {})},
+                           'hdbscan_args': {**DEFAULT_HDBSCAN_ARGS, **configuration.get('hdbscan_args', {})}}
+                          for configuration in configurations]
+        vocab_sizes = self.get_vocab_sizes(sorted({configuration['min_count'] for configuration in configurations}))
+
+        # the reductions run one after another (UMAP is multithreaded), the clusterings in parallel
+        reductions = {}
+        for configuration in configurations:
+            key = fingerprint(configuration['umap_args'])
+            if key not in reductions:
+                reductions[key] = self.get_reduced_path(embeddings, configuration['umap_args'])
+
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(_cluster, reductions[fingerprint(configuration['umap_args'])][0],
+                                       configuration['hdbscan_args']) for configuration in configurations]
+            trials = [future.result() for future in futures]
+
+        results = []
+        reported_umap = set()
+        for configuration, (num_topics, outlier_share, hdbscan_time) in zip(configurations, trials):
+            key = fingerprint(configuration['umap_args'])
+            results.append({
+                'min_count': configuration['min_count'],
+                'umap_args': json.dumps(configuration['umap_args'], sort_keys=True),
+                'hdbscan_args': json.dumps(configuration['hdbscan_args'], sort_keys=True),
+                'vocab_size': vocab_sizes[configuration['min_count']],
+                'num_topics': num_topics,
+                'outlier_share': outlier_share,
+                'embedding_time': embedding_time if not results else 0.0,
+                'umap_time': reductions[key][1] if key not in reported_umap else 0.0,
+                'hdbscan_time': hdbscan_time,
+            })
+            reported_umap.add(key)
+        results = pd.DataFrame(results)
+
+        if save_path is not None:
+            exists_or_create(path=save_path)
+            results.to_csv(save_path + "sweep_results.csv", index=False)
+            logger.info(f"Saved sweep results to {save_path}")
+        return results
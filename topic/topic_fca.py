@@ -1,10 +1,20 @@
+import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from concepts import Context
-from fcapy.context import FormalContext
-from data.files import extract_text_from_pdf, save_df_to_csv
+from data.files import (extract_text_from_pdf, get_partition_path, load_incidence_from_parquet, save_df_to_csv,
+                        save_incidence_to_parquet, save_topic_words_to_parquet)
+from topic.bitset_context import BitsetContext, bits2indices
+from topic.closure_engine import ClosureEngine
+from topic.concept_enumeration import (get_lower_covers, get_weight_planes, iter_intents, iter_top_k_concepts,
+                                       save_intents_fimi, write_intents_fimi)
+from topic.context_reduction import ReducedContext
+from topic.fimi_io import iter_fimi, read_fimi, write_fimi
+from topic.topic_modeling import TopicModel
 from utils.logging_utils import get_date, init_debug_config
 from utils.os_manipulation import exists_or_create
 
@@ -52,17 +62,27 @@ class TopicFCA:
         """
         return original.split("_")[-1] if strip_prefix else prefix + original
 
+    def matrix2ctx(self, incidence, objects: list = None, properties: list = None):
+        """
+        Build a context directly from a binary incidence matrix, e.g. a thresholded doc-topic incidence
+        (cf. BitsetContext). Nothing is written to disk.
+        :param incidence: Binary matrix (NumPy array or scipy.sparse); rows are objects, columns attributes
+        :param objects: (Optional) Names of the objects, e.g. 'doc_0'; if None, their positions
+        :param properties: (Optional) Names of the attributes, e.g. 'topic_0'; if None, their positions
+        :return: Formal context
+        """
+        return BitsetContext.from_matrix(incidence, objects=objects, properties=properties)
+
     def csv2ctx(self, path_to_file: str, filename: str, prefix: str = "doc_", strip_prefix: bool = False):
         """
-        Load a context from a csv file.
+        Load a context from a csv file (or a parquet file written by save_incidence_to_parquet).
         The entries in the csv file are expected to be 0 or 1.
         They are converted to False or True.
         Moreover, the index column and the first row are converted to the object and attribute names (of type string).
-        Since one library is used to read the csv file and another one to work with the context, the context is saved to a
-        txt file and loaded again using the second python library.
+        The context is built in memory from the incidence matrix (cf. matrix2ctx).
 
         :param path_to_file: Path to the csv file including the '/' at the end
-        :param filename: Complete filename of the csv file including the type extension
+        :param filename: Complete filename of the csv (or parquet) file including the type extension
         :param prefix: Prefix of the object ids; might be either "doc_" or "term_"
         :param strip_prefix: If True, the prefix is stripped from the objects and attributes.
             This is useful when the goal is to reduce the size of context diagram.
@@ -70,22 +90,21 @@ class TopicFCA:
         """
         if not path_to_file.endswith("/"):
             path_to_file += "/"
-        df = pd.read_csv(path_to_file + filename, index_col=0)
-        df = df.map(lambda x: True if x == 1 else False)
-        df.set_index(np.array([self._apply_prefix_action(original=str(doc_id), prefix=prefix, strip_prefix=strip_prefix)
-                               for doc_id in df.index.tolist()]), inplace=True)
-        df.columns = np.array([self._apply_prefix_action(original=str(topic_id), prefix="topic_",
-                                                         strip_prefix=strip_prefix) for topic_id in df.columns.tolist()])
-
-        new_filename = "read_context_" + filename.split(".")[0]
         try:
-            ctx_version1 = FormalContext.from_pandas(df)
-
-            self.save_ctx_as_txt(ctx_version1.print_data(ctx_version1.n_objects, ctx_version1.n_attributes),
-                                 save_path=path_to_file, filename=new_filename)
-            ctx = self.load_ctx_from_txt(load_path=path_to_file, filename=new_filename)
-
-            return ctx
+            if filename.endswith(".parquet"):  # cf. save_incidence_to_parquet
+                incidence, index, columns = load_incidence_from_parquet(path_to_file + filename, as_df=False)
+                incidence = incidence == 1
+                index = range(incidence.shape[0]) if index is None else index
+                columns = range(incidence.shape[1]) if columns is None else columns
+            else:
+                df = pd.read_csv(path_to_file + filename, index_col=0)
+                incidence, index, columns = df.to_numpy() == 1, df.index.tolist(), df.columns.tolist()
+
+            objects = [self._apply_prefix_action(original=str(doc_id), prefix=prefix, strip_prefix=strip_prefix)
+                       for doc_id in index]
+            properties = [self._apply_prefix_action(original=str(topic_id), prefix="topic_", strip_prefix=strip_prefix)
+                          for topic_id in columns]
+            return self.matrix2ctx(incidence, objects=objects, properties=properties)
         except Exception as e:
             logging.error(f"Error loading context: {e}")
             return False
@@ -128,21 +147,34 @@ class TopicFCA:
         """
         Convert a context to a file in the FIMI format.
         According to the FIMI format, each line represents an object.
-        The line contains a list of its attributes/features.
+        The line contains a list of its attributes/features as integers (their position in ctx.properties); the mapping
+        from attribute name to integer is saved as <filename>_mapping.edn, hence there is no need for topics2integers.
+        The lines are written directly from the incidence matrix of the context (cf. write_fimi).
 
          cf. https://fcalgs.sourceforge.net/pcbo-amai.html, https://fcalgs.sourceforge.net/format.html
         :param ctx: Context to convert
         :param path_to_file: Path to save the file including the '/' at the end
         :param filename: Name of the file without type extension
-        :param prefix: Prefix of the object ids; might be either "doc_" or "term_"
+        :param prefix: Unused; the objects are written in the order of ctx.objects
+        :return: -
+        """
+        incidence = ctx.incidence if isinstance(ctx, BitsetContext) else np.array(ctx.bools, dtype=bool)
+        write_fimi(incidence, path_to_file=path_to_file, filename=filename, attribute_labels=list(ctx.properties))
+
+    def incidence2fimi(self, incidence, path_to_file: str, filename: str = "context_format_fimi",
+                       attribute_labels: list = None):
+        """
+        Write a binary incidence matrix (e.g. scipy.sparse term-topic incidence) to a file in the FIMI format.
+        Each line contains the column numbers of the non-zero entries of one row, i.e. the attributes are integers and
+        there is no need for topics2integers. The rows are read from the sparse structure, the matrix is never dense.
+        If attribute_labels is given, the mapping from label to integer is saved as edn file (cf. topics2integers).
+        :param incidence: Binary incidence matrix (scipy.sparse or NumPy array); rows are objects, columns attributes
+        :param path_to_file: Path to save the file including the '/' at the end
+        :param filename: Name of the file without type extension
+        :param attribute_labels: (Optional) Labels of the columns, e.g. the vocabulary for the term-topic incidence
         :return: -
         """
-        exists_or_create(path=path_to_file)
-        with open(path_to_file + filename + ".fimi", "x") as f:
-            for object_id in range(len(ctx.objects)):
-                f.write(f"{' '.join(map(str, list(self.doc2topics(ctx, doc_ids=[object_id], prefix=prefix))))}\n")
-        f.close()
-        logging.info(f"Context saved as FIMI file: {path_to_file + filename}.fimi")
+        write_fimi(incidence, path_to_file=path_to_file, filename=filename, attribute_labels=attribute_labels)
 
     def topics2integers(self, path2fimi: str, save_path: str):
         """
@@ -150,36 +182,19 @@ class TopicFCA:
         When converting the term-topic context to a FIMI file, the topics are saved as strings (without any numerical
         identifier).
         Since pcbo stops with a segmentation fault, the topics need to be converted to strings.
+        The file is converted line by line. FIMI files written by ctx2fimi or incidence2fimi already contain integers.
         :param path2fimi: Path to the FIMI file including the file ending .fimi
         :param save_path: Path to the save the new FIMI file including the filename and file ending .fimi
         :return: -
         """
-        # each line in the FIMI file represents an object
-        with open(path2fimi, "r") as f:
-            lines = f.readlines()
-        f.close()
-
         topic2int_dict = {}  # mapping from topic to integer
 
-        def str_to_int(element: str):
-            """
-            Convert the element to an integer.
-            :param element: String element
-            :return: Integer element
-            """
-            # strip the newline or extra whitespace
-            element = element.strip()
-
-            if element not in topic2int_dict:
-                topic2int_dict[element] = len(topic2int_dict)
-            return topic2int_dict[element]
-
-        with open(save_path, "w") as f:
-            for line in lines:
+        # each line in the FIMI file represents an object
+        with open(path2fimi, "r") as f_in, open(save_path, "w") as f_out:
+            for line in f_in:
                 # split the line into elements, map them to integers
-                converted_line = ' '.join(map(str, map(str_to_int, line.split())))
-                f.write(f"{converted_line}\n")
-        f.close()
+                f_out.write(' '.join(str(topic2int_dict.setdefault(element, len(topic2int_dict)))
+                                     for element in line.split()) + "\n")
         logging.info(f"Context saved as fimi file: {save_path}")
 
         # save the mapping to edn file
@@ -189,31 +204,138 @@ class TopicFCA:
             f.write(str(topic2int_dict))
         logging.info(f"Context converted to integers and saved as edn file: {save_filename}")
 
-
-    def intents_from_fimi(self, path_to_file: str, filename: str):
+    def intents_from_fimi(self, path_to_file: str, filename: str, as_arrays: bool = False):
         """
         Load intents from a FIMI file.
+        The file is read line by line (cf. iter_fimi).
         :param path_to_file: Path to the FIMI file including the '/' at the end
         :param filename: Complete filename of the FIMI file including the type extension
-        :return: List of intents
+        :param as_arrays: If True, the intents are returned as flat int32 array and offsets (cf. read_fimi)
+        :return: List of intents ([None] for the empty intent) or tuple (values, offsets)
         """
-        with open(path_to_file + filename, "r") as f:
-            intents = f.readlines()
-        f.close()
+        if as_arrays:
+            return read_fimi(path_to_file + filename)
+        return [intent.tolist() if len(intent) else [None] for intent in iter_fimi(path_to_file + filename)]
 
-        def to_int(element):
-            return int(element) if element else None
+    def compute_intents(self, ctx, path_to_file: str = None, filename: str = "intents", num_workers: int = None,
+                        min_support=0, reduce: bool = True):
+        """
+        Compute the intents of all formal concepts of a context in this process instead of running pcbo on its FIMI
+        file (Close-by-One on the bitsets of the context, cf. concept_enumeration). The branches below the top concept
+        are enumerated in parallel.
+        :param ctx: Formal context (cf. csv2ctx)
+        :param path_to_file: (Optional) Path to save the intents as FIMI file (like pcbo) including the '/' at the end;
+            if None, the intents are returned
+        :param filename: Name of the FIMI file without type extension
+        :param num_workers: Number of processes; 1 enumerates in this process, None uses all processors
+        :param min_support: (Optional) Only concepts with at least this many objects (iceberg lattice, cf.
+            get_min_support); 0 computes the complete lattice
+        :param reduce: If True, the lattice is computed on the clarified and reduced context (cf. reduce_ctx) and its
+            intents are mapped back to the context; for an iceberg lattice, the objects are only clarified and weighted
+            by their multiplicity, since removing objects changes the number of objects of the concepts
+        :return: Number of concepts if path_to_file is given, else list of intents (cf. intents_from_fimi)
+        """
+        min_support = self.get_min_support(ctx, min_support)
+        if reduce:
+            reduced = self.reduce_ctx(ctx, reduce_objects=not min_support)
+            intents = (reduced.to_original_concept(intent)[1]
+                       for intent in iter_intents(reduced.ctx, num_workers=num_workers, min_support=min_support,
+                                                  weights=reduced.weights))
+            if path_to_file is not None:
+                return save_intents_fimi(intents, len(ctx.properties), path_to_file=path_to_file, filename=filename)
+        elif path_to_file is not None:
+            return write_intents_fimi(ctx, path_to_file=path_to_file, filename=filename, num_workers=num_workers,
+                                      min_support=min_support)
+        else:
+            intents = iter_intents(ctx, num_workers=num_workers, min_support=min_support)
+        return [bits2indices(intent, len(ctx.properties)).tolist() or [None] for intent in intents]
+
+    def reduce_ctx(self, ctx, reduce_objects: bool = True):
+        """
+        Clarify and reduce a context (cf. ReducedContext): documents with the same topics and topics with the same
+        documents are merged, documents (topics) whose topics (documents) are the intersection of the ones of others
+        are removed. The concept lattice keeps its structure; ReducedContext maps its concepts back to the context.
+        :param ctx: Formal context (BitsetContext, cf. csv2ctx)
+        :param reduce_objects: If False, documents are only merged (weighted by their multiplicity, cf.
+            ReducedContext.weights), hence the number of documents of the concepts is kept (iceberg lattices)
+        :return: ReducedContext; the reduced context is its attribute ctx
+        """
+        return ReducedContext(ctx, reduce_objects=reduce_objects)
+
+    def get_min_support(self, ctx, min_support):
+        """
+        Returns the minimum support as number of objects.
+        :param ctx: Formal context
+        :param min_support: Number of objects (int) or share of the objects (float between 0 and 1)
+        :return: Number of objects
+        """
+        if isinstance(min_support, float) and 0 < min_support < 1:
+            return int(np.ceil(min_support * len(ctx.objects)))
+        return int(min_support or 0)
 
-        return [list(map(to_int, i.removesuffix('\n').split(' '))) for i in intents]
+    def get_iceberg_lattice(self, ctx, min_support=None, top_k: int = None, num_workers: int = 1,
+                            reduce: bool = True):
+        """
+        Get the frequent concepts of a context (iceberg lattice) without computing the complete lattice.
+        With min_support, all concepts with at least min_support objects are enumerated (Close-by-One pruned at
+        infrequent concepts, cf. compute_intents); with top_k, the top_k concepts with the most objects are enumerated
+        best first with a rising support threshold. If both are given, the top_k concepts meeting min_support are
+        returned. The runtime depends on the number of frequent concepts, not on the size of the complete lattice.
+        min_support=0 without top_k returns the complete lattice.
+        :param ctx: Formal context (BitsetContext, cf. csv2ctx)
+        :param min_support: (Optional) Number of objects (int) or share of the objects (float between 0 and 1)
+        :param top_k: (Optional) Number of concepts with the largest support
+        :param num_workers: Number of processes used for min_support; 1 enumerates in this process
+        :param reduce: If True, the concepts are enumerated on the clarified context with the multiplicities of the
+            objects as weights (and on the reduced context for the complete lattice, cf. reduce_ctx)
+        :return: List of concepts in descending order of support; each concept is a list of its extent (object
+            names), its intent (set of attribute names) and the positions of its lower neighbours in the list
+        """
+        if min_support is None and top_k is None:
+            raise ValueError("Either min_support or top_k is required for an iceberg lattice")
+        min_support = self.get_min_support(ctx, min_support)
+        if reduce:
+            reduced = self.reduce_ctx(ctx, reduce_objects=not (min_support or top_k is not None))
+            enumerated_ctx, weights, to_concept = reduced.ctx, reduced.weights, reduced.to_original_concept
+        else:
+            enumerated_ctx, weights, to_concept = ctx, None, lambda intent: (ctx.extent_bits(intent), intent)
+        if top_k is not None:
+            weight_planes = None if weights is None else get_weight_planes(weights)
+            concepts = [to_concept(intent) for _, intent in iter_top_k_concepts(enumerated_ctx.columns,
+                                                                                len(enumerated_ctx.objects), k=top_k,
+                                                                                weight_planes=weight_planes)]
+            concepts = [(extent, intent) for extent, intent in concepts if extent.bit_count() >= min_support]
+        else:
+            concepts = [to_concept(intent) for intent in iter_intents(enumerated_ctx, num_workers=num_workers,
+                                                                      min_support=min_support, weights=weights)]
+        concepts.sort(key=lambda concept: -concept[0].bit_count())
+        lower_covers = get_lower_covers([extent for extent, _ in concepts])
+        logging.info(f"Obtained iceberg lattice of {len(concepts)} concepts")
+        return [[tuple(ctx.objects[i] for i in bits2indices(extent, len(ctx.objects))),
+                 {ctx.properties[i] for i in bits2indices(intent, len(ctx.properties))}, lower]
+                for (extent, intent), lower in zip(concepts, lower_covers)]
 
     def reconstruct_concept_from_intent(self, ctx, intent: list[int]):
         """
         Reconstructs a formal concept given its intent.
+        For a BitsetContext, the extent is the bitwise AND of the columns of the intent and the closure the bitwise AND
+        of the rows of the extent; the attribute ids are the positions in ctx.properties (cf. ctx2fimi).
 
         :param ctx: List of lists (binary matrix) representing the formal context.
-        :param intent: List of attribute indices representing the intent.
+        :param intent: List of attribute indices representing the intent ([None] for the empty intent).
         :return: extent, intent_closure representing the reconstructed formal concept.
         """
+        if isinstance(ctx, BitsetContext):
+            intent_bits = 0
+            for attribute in intent:
+                if attribute is not None:
+                    intent_bits |= 1 << attribute
+            extent_bits = ctx.extent_bits(intent_bits)
+            extent = tuple(ctx.objects[i] for i in bits2indices(extent_bits, len(ctx.objects)))
+            intent_closure = {ctx.properties[i] for i in bits2indices(ctx.intent_bits(extent_bits),
+                                                                      len(ctx.properties))} if extent else set()
+            return extent, intent_closure
+
         extent = self.topic2docs(ctx=ctx, topic_ids=intent if intent[0] else [])
         input_extent = [int(e.split("_")[1]) for e in extent]
 
@@ -227,92 +349,297 @@ class TopicFCA:
             intent_closure = set()
         return extent, intent_closure
 
-    def get_concept_lattice(self, ctx, intents):
+    def get_concept_lattice(self, ctx, intents, reduce: bool = True):
         """
         Get the concept lattice of a context.
+        For a BitsetContext, the concepts are reconstructed in batches by a ClosureEngine (packed columns and rows).
         :param ctx: Formal context
-        :param intents: List of intents
+        :param intents: List of intents (cf. intents_from_fimi, compute_intents) or tuple (values, offsets)
+            (cf. intents_from_fimi with as_arrays=True)
+        :param reduce: If True, the concepts of a BitsetContext are reconstructed on its clarified context, i.e. on
+            distinct documents and topics only (cf. ReducedContext.get_original_concepts)
         :return: Concept lattice as a list of lists, where each inner list represent the extents and intent closures of one
         formal concept.
         """
+        if isinstance(ctx, BitsetContext):
+            concepts = self.reduce_ctx(ctx, reduce_objects=False).get_original_concepts(intents) if reduce \
+                else ClosureEngine(ctx.incidence).iter_concepts(intents)
+            objects, properties = np.array(ctx.objects, dtype=object), np.array(ctx.properties, dtype=object)
+            return [[tuple(objects[object_ids]), set(properties[attribute_ids]) if len(object_ids) else set()]
+                    for object_ids, attribute_ids in concepts]
 
         return [list(self.reconstruct_concept_from_intent(ctx, input_intent)) for input_intent in intents]
 
-    def obtain_doc_topic_inc_per_subdir(self, parent_path: str, save_path: str, topic_model, recursive: bool = True):
+    def obtain_doc_topic_inc_per_subdir(self, parent_path: str, save_path: str, topic_model, recursive: bool = True,
+                                        plot_density: bool = True, storage_format: str = "csv"):
         """
         Obtain the document-topic incidence for each subdirectory in the parent directory.
-        If a Subdirectory contains a directory, the function is called recursively.
+        The texts of each directory are extracted and assigned to topics; for a whole corpus whose topics are known
+        (e.g. stored in the index), obtain_doc_topic_inc_per_directory is much faster.
         :param parent_path: Path to the uppermost directory regarded
         :param save_path: Path to save the document-topic incidence, including the '/' at the end
         :param topic_model: Topic model
-        :param recursive: If True, the function is called recursively for each subdirectory
+        :param recursive: If True, all directories below the parent directory are regarded, else only the parent
+            directory and its subdirectories
+        :param plot_density: If True, the density plot of the threshold search is saved per directory
+        :param storage_format: "csv" or "parquet" (cf. write_directory_incidences)
         :return:
         """
         logging.info(f"Parent directory: {parent_path}")
         if not parent_path.endswith("/"):
             parent_path += "/"
         date = get_date()
+        term_topic_incidence, vocab, topic_words = self.get_term_topic_lookup(topic_model)
 
-        # obtain all subdirectories
+        # os.walk visits every directory below the parent directory exactly once
+        directories = []
         for current_directory, subdirectories, files in os.walk(parent_path):
-            logging.info(f"iteration: current_directory: {current_directory}, subdirectories: {subdirectories}, files: {files}")
-
-            if '/' in current_directory:
-                parent_dir_name = current_directory.split("/")[-2] \
-                    if current_directory.endswith("/") else current_directory.split("/")[-1]
-            else:
-                parent_dir_name = current_directory
+            if not recursive and os.path.normpath(current_directory) != os.path.normpath(parent_path):
+                subdirectories.clear()  # do not descend below the subdirectories of the parent directory
+            directories.append((current_directory, files))
+        dir_names = self.get_directory_names([directory for directory, _ in directories], parent_path=parent_path)
+
+        for current_directory, files in directories:
+            logging.info(f"iteration: current_directory: {current_directory}, files: {files}")
+            parent_dir_name = dir_names[current_directory]
             logging.info(f"Current directory: {parent_dir_name}; starting now")
 
-            if recursive:
-                for subdir in subdirectories:
-                    self.obtain_doc_topic_inc_per_subdir(parent_path=parent_path + subdir + "/", save_path=save_path,
-                                                         topic_model=topic_model, recursive=recursive)  # recursive call
-
-            exists_or_create(save_path + parent_dir_name)
-            logging.info(f"Created: {save_path + parent_dir_name}")
-
-            # obtain the document-topic incidence for the current directory
             # obtain texts
-            text_files = [current_directory + file for file in files if
+            text_files = [os.path.join(current_directory, file) for file in files if
                           (file.endswith(('.txt', '.pdf', '.png', '.jpg', '.jpeg')))]
             texts = [extract_text_from_pdf(path, find_caption=True)[0] for path in text_files]
             logging.info(f"Obtained texts for {parent_dir_name}")
 
-            incidence_save_path = save_path + parent_dir_name + '/'
-            logging.info(f"Incidence save path is: {incidence_save_path}")
-
-            doc_topic_incidence = topic_model.get_document_topic_incidence(doc_ids=np.arange(len(texts)))
-            save_df_to_csv(df=doc_topic_incidence, path=incidence_save_path,
-                           file_name=f"{parent_dir_name}_doc_topic_incidence_{date}")
-            logging.info(f"Obtained & saved doc-topic incidence for {parent_dir_name}: saved under path: {incidence_save_path}{parent_dir_name}_doc_topic_incidence_{date}")
-
-            # determine optimal threshold for document-topic incidence
-            threshold, row_norm_doc_topic_df = topic_model.determine_threshold_doc_topic_threshold(doc_topic_incidence,
-                                                                                                   opt_density=0.1,
-                                                                                                   save_path=incidence_save_path)
-            logging.info(f"Optimal threshold for {parent_dir_name}: {threshold}")
-            thres_row_norm_doc_topic_df = topic_model.apply_threshold_doc_topic_incidence(row_norm_doc_topic_df,
-                                                                                          threshold=threshold)
-            save_df_to_csv(df=thres_row_norm_doc_topic_df, path=incidence_save_path,
-                           file_name=f"{parent_dir_name}_thres_row_norm_doc_topic_incidence_{date}")
-            logging.info(f"Obtained & saved thresholded doc-topic incidence for {parent_dir_name} under path: {incidence_save_path}{parent_dir_name}_thres_row_norm_doc_topic_incidence_{date}")
-
-            # translate docs IDs to document names
-            translated_thres_row_norm_doc_topic_incidence = thres_row_norm_doc_topic_df.rename(
-                index={i: text_files[i] for i in range(len(text_files))})
-            save_df_to_csv(df=translated_thres_row_norm_doc_topic_incidence, path=incidence_save_path,
-                           file_name=f"{parent_dir_name}_translated_thres_row_norm_doc_topic_incidence_{date}")
-            logging.info(f"Translated doc IDs to document names for {parent_dir_name}.\nSaved under path: {incidence_save_path}{parent_dir_name}_translated_thres_row_norm_doc_topic_incidence_{date}")
-
-            # term-topic incidence
-            save_path_topic_words = incidence_save_path + f"{parent_dir_name}_topic2terms_{date}.json"
-            term_topic_incidence = topic_model.get_term_topic_incidence(doc_ids=np.arange(len(texts)),
-                                                                        save_path_topic_words=save_path_topic_words)
-            save_df_to_csv(df=term_topic_incidence, path=incidence_save_path,
-                           file_name=f"{parent_dir_name}_term_topic_incidence_{date}")
-            logging.info(f"Obtained & saved term-topic incidence for {parent_dir_name} under path: {incidence_save_path}")
-            logging.info(f"Finished {parent_dir_name}")
+            # topics of the texts of this directory (not of the first documents of the training corpus)
+            if texts:
+                topic_nums, topic_score, topics_words, word_scores = topic_model.get_doc_topics(texts=texts,
+                                                                                                num_topics=10)
+                write_directory_incidences(dir_name=parent_dir_name, text_files=text_files, topic_nums=topic_nums,
+                                           topic_scores=topic_score, save_path=save_path,
+                                           term_topic_incidence=term_topic_incidence, vocab=vocab,
+                                           topic_words=topic_words, date=date, plot_density=plot_density,
+                                           storage_format=storage_format)
+
+    def get_directory_name(self, directory: str):
+        """
+        Returns the name of a directory, i.e. the last component of its path.
+        :param directory: Path to the directory, with or without the '/' at the end
+        :return: Name of the directory
+        """
+        return os.path.basename(os.path.normpath(directory))
+
+    def get_directory_names(self, directories: list, parent_path: str = None):
+        """
+        Returns unique names of directories to save their results under (cf. write_directory_incidences).
+        The name of a directory is its path relative to the parent directory with '_' instead of '/', e.g.
+        'A_images' and 'B_images' for A/images/ and B/images/; the parent directory itself is named by its name.
+        Names that would still coincide are numbered.
+        :param directories: Paths of the directories
+        :param parent_path: (Optional) Directory the names are relative to; if None, the deepest directory containing
+            all directories
+        :return: Dictionary mapping directory paths to their names
+        """
+        if not directories:
+            return {}
+        if parent_path is None:
+            parent_path = os.path.commonpath([os.path.normpath(directory) for directory in directories])
+        names, used = {}, set()
+        for directory in sorted(directories):
+            relative_path = os.path.relpath(os.path.normpath(directory), os.path.normpath(parent_path))
+            name = self.get_directory_name(parent_path) if relative_path == "." else relative_path.replace(os.sep, "_")
+            unique_name, num = name, 1
+            while unique_name in used:
+                unique_name, num = f"{name}_{num}", num + 1
+            used.add(unique_name)
+            names[directory] = unique_name
+        return names
+
+    def get_term_topic_lookup(self, topic_model):
+        """
+        Obtain everything needed to build term-topic incidences without the topic model (cf. write_directory_incidences).
+        :param topic_model: Topic model
+        :return: Term-topic incidence of all topics as scipy.sparse CSR matrix, vocabulary, topic words per topic
+        """
+        num_topics = topic_model.get_num_topics()
+        term_topic_incidence = topic_model.get_term_topic_incidence_sparse(topic_nums=np.arange(num_topics))
+        topic_words = [list(words) for words in topic_model.model.topic_words]
+        return term_topic_incidence, list(topic_model.model.vocab), topic_words
+
+    def group_by_directory(self, paths: list, parent_path: str = None):
+        """
+        Group documents by the directory they are stored in (only this directory and not its parents).
+        :param paths: Paths of the documents
+        :param parent_path: (Optional) Only documents below this directory are regarded
+        :return: Dictionary mapping directory paths to the (sorted) positions of their documents in paths
+        """
+        if parent_path is not None and not parent_path.endswith("/"):
+            parent_path += "/"
+        directories = {}
+        for position, path in enumerate(paths):
+            if path is None or (parent_path is not None and not path.startswith(parent_path)):
+                continue
+            directories.setdefault(os.path.dirname(path), []).append(position)
+        return {directory: sorted(positions, key=lambda position: paths[position])
+                for directory, positions in directories.items()}
+
+    def obtain_doc_topic_inc_per_directory(self, paths: list, topic_nums, topic_scores, save_path: str, topic_model,
+                                           parent_path: str = None, num_workers: int = None,
+                                           plot_density: bool = False, skip_existing: bool = False,
+                                           storage_format: str = "csv"):
+        """
+        Obtain the document-topic incidence for every directory of the corpus in one pass.
+        In contrast to obtain_doc_topic_inc_per_subdir, the topics are assigned once for the whole corpus (e.g. read
+        from the index, cf. query_db.get_topic_assignments) and no texts are extracted. The documents are grouped by
+        their directory and the incidences of the directories are written by parallel worker processes.
+        The files written per directory are the same as the ones of obtain_doc_topic_inc_per_subdir.
+        :param paths: Paths of the documents
+        :param topic_nums: Topics of the documents in descending order of score; shape: (num documents, top_k)
+        :param topic_scores: Scores of the topics; same shape as topic_nums
+        :param save_path: Path to save the incidences, including the '/' at the end
+        :param topic_model: Topic model the topics were assigned with; used only for its vocabulary and topic words
+        :param parent_path: (Optional) Only directories below this directory are regarded; the results of a directory
+            are saved under its path relative to parent_path (cf. get_directory_names)
+        :param num_workers: Number of worker processes; if None, the number of processors
+        :param plot_density: If True, the density plot of the threshold search is saved per directory
+        :param skip_existing: If True, directories whose results exist in save_path already are skipped (e.g. to
+            resume an interrupted run)
+        :param storage_format: "csv" or "parquet" (cf. write_directory_incidences)
+        :return: List of the names of the processed directories
+        """
+        topic_nums = np.asarray(topic_nums)
+        topic_scores = np.asarray(topic_scores)
+        date = get_date()
+        directories = self.group_by_directory(paths, parent_path=parent_path)
+        logging.info(f"Grouped {len(paths)} documents into {len(directories)} directories")
+        # directories of the same name (e.g. A/images/ and B/images/) must not write to the same files
+        dir_names = self.get_directory_names(list(directories), parent_path=parent_path)
+        if skip_existing:
+            directories = {directory: positions for directory, positions in directories.items()
+                           if not os.path.exists(get_directory_save_path(save_path, dir_names[directory],
+                                                                         storage_format=storage_format))}
+
+        term_topic_incidence, vocab, topic_words = self.get_term_topic_lookup(topic_model)
+        # the lookup is sent once per worker process instead of once per directory
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_directory_worker,
+                                 initargs=(term_topic_incidence, vocab, topic_words)) as executor:
+            futures = {executor.submit(_write_directory_incidences_worker, dir_names[directory],
+                                       [paths[position] for position in positions], topic_nums[positions],
+                                       topic_scores[positions], save_path, date, plot_density,
+                                       storage_format): directory
+                       for directory, positions in directories.items()}
+            processed = []
+            for future in as_completed(futures):
+                processed.append(future.result())
+                logging.info(f"Finished {futures[future]} ({len(processed)}/{len(futures)})")
+        return processed
+
+
+def write_directory_incidences(dir_name: str, text_files: list, topic_nums, topic_scores, save_path: str,
+                              term_topic_incidence, vocab: list, topic_words: list, date: str = None,
+                              plot_density: bool = True, storage_format: str = "csv"):
+    """
+    Write the incidences of one directory: document-topic incidence, thresholded (and translated) document-topic
+    incidence, term-topic incidence and the topic words.
+    Only the lookup of the topic model (cf. TopicFCA.get_term_topic_lookup) is needed, not the topic model itself.
+    :param dir_name: Unique name of the directory (cf. TopicFCA.get_directory_names); the files are saved in save_path + dir_name + '/' (csv) or in the partition
+        of the directory and date (parquet, cf. get_partition_path)
+    :param text_files: Paths of the documents of the directory
+    :param topic_nums: Topics of the documents; shape: (num documents, topics per document)
+    :param topic_scores: Scores of the topics; same shape as topic_nums
+    :param save_path: Path to save the incidences, including the '/' at the end
+    :param term_topic_incidence: Term-topic incidence of all topics as scipy.sparse CSR matrix
+    :param vocab: Vocabulary of the topic model, i.e. the columns of term_topic_incidence
+    :param topic_words: Topic words per topic
+    :param date: Date used in the file names; if None, the current date
+    :param plot_density: If True, the density plot of the threshold search is saved
+    :param storage_format: "csv" (one csv file per incidence and a json file of the topic words) or "parquet"
+        (sparse parquet files, cf. save_incidence_to_parquet)
+    :return: Name of the directory
+    """
+    date = date or get_date()
+    incidence_save_path = get_directory_save_path(save_path, dir_name, run_date=date, storage_format=storage_format)
+    save_incidence = save_incidence_to_parquet if storage_format == "parquet" else save_df_to_csv
+    exists_or_create(incidence_save_path)
+    logging.info(f"Incidence save path is: {incidence_save_path}")
+    thresholds = TopicModel(documents=None)  # the threshold functions do not need a trained model
+    num_topics = term_topic_incidence.shape[0]
+
+    doc_topic_incidence = pd.DataFrame(thresholds.topics2sparse_incidence(topic_nums=topic_nums,
+                                                                          topic_scores=topic_scores,
+                                                                          num_topics=num_topics).toarray())
+    save_incidence(doc_topic_incidence, path=incidence_save_path,
+                   file_name=f"{dir_name}_doc_topic_incidence_{date}")
+    logging.info(f"Obtained & saved doc-topic incidence for {dir_name}: saved under path: {incidence_save_path}{dir_name}_doc_topic_incidence_{date}")
+
+    # determine optimal threshold for document-topic incidence
+    threshold, row_norm_doc_topic_df = thresholds.determine_threshold_doc_topic_threshold(doc_topic_incidence,
+                                                                                          opt_density=0.1,
+                                                                                          save_path=incidence_save_path,
+                                                                                          plot=plot_density,
+                                                                                          show=False)
+    logging.info(f"Optimal threshold for {dir_name}: {threshold}")
+    thres_row_norm_doc_topic_df = thresholds.apply_threshold_doc_topic_incidence(row_norm_doc_topic_df,
+                                                                                 threshold=threshold)
+    save_incidence(thres_row_norm_doc_topic_df, path=incidence_save_path,
+                   file_name=f"{dir_name}_thres_row_norm_doc_topic_incidence_{date}")
+    logging.info(f"Obtained & saved thresholded doc-topic incidence for {dir_name} under path: {incidence_save_path}{dir_name}_thres_row_norm_doc_topic_incidence_{date}")
+
+    # translate docs IDs to document names
+    translated_thres_row_norm_doc_topic_incidence = thres_row_norm_doc_topic_df.rename(
+        index={i: text_files[i] for i in range(len(text_files))})
+    save_incidence(translated_thres_row_norm_doc_topic_incidence, path=incidence_save_path,
+                   file_name=f"{dir_name}_translated_thres_row_norm_doc_topic_incidence_{date}")
+    logging.info(f"Translated doc IDs to document names for {dir_name}.\nSaved under path: {incidence_save_path}{dir_name}_translated_thres_row_norm_doc_topic_incidence_{date}")
+
+    # term-topic incidence: rows of the topics of the documents, all other rows are empty
+    is_doc_topic = np.zeros(num_topics, dtype=bool)
+    is_doc_topic[np.asarray(topic_nums).ravel()] = True
+    terms_per_topic = {topic_num: topic_words[topic_num] if is_doc_topic[topic_num] else []
+                       for topic_num in range(num_topics)}
+    if storage_format == "parquet":
+        save_topic_words_to_parquet(terms_per_topic, path=incidence_save_path,
+                                    file_name=f"{dir_name}_topic2terms_{date}")
+    else:
+        with open(incidence_save_path + f"{dir_name}_topic2terms_{date}.json", "w") as f:
+            json.dump(terms_per_topic, f, indent=4)
+    dir_term_topic_incidence = sparse.csr_matrix(term_topic_incidence.multiply(is_doc_topic[:, np.newaxis]))
+    if storage_format == "parquet":  # no dense topics x vocabulary matrix
+        save_incidence_to_parquet(dir_term_topic_incidence, path=incidence_save_path,
+                                  file_name=f"{dir_name}_term_topic_incidence_{date}", columns=vocab)
+    else:
+        save_df_to_csv(pd.DataFrame(dir_term_topic_incidence.toarray().astype(bool), columns=vocab),
+                       path=incidence_save_path, file_name=f"{dir_name}_term_topic_incidence_{date}")
+    logging.info(f"Obtained & saved term-topic incidence for {dir_name} under path: {incidence_save_path}")
+    logging.info(f"Finished {dir_name}")
+    return dir_name
+
+
+def get_directory_save_path(save_path: str, dir_name: str, run_date: str = None, storage_format: str = "csv"):
+    """
+    Returns the path the incidences of a directory are saved in (cf. write_directory_incidences).
+    :param save_path: Path to save the incidences, including the '/' at the end
+    :param dir_name: Name of the directory
+    :param run_date: (Optional) Date of the run; only used for parquet; if None, the partition of the directory
+    :param storage_format: "csv" or "parquet"
+    :return: Path including the '/' at the end
+    """
+    if storage_format == "parquet":
+        return get_partition_path(save_path, directory=dir_name, run_date=run_date)
+    return save_path + dir_name + '/'
+
+
+_worker_lookup = {}  # lookup of the topic model per worker process, cf. _init_directory_worker
+
+
+def _init_directory_worker(term_topic_incidence, vocab: list, topic_words: list):
+    _worker_lookup.update(term_topic_incidence=term_topic_incidence, vocab=vocab, topic_words=topic_words)
+
+
+def _write_directory_incidences_worker(dir_name: str, text_files: list, topic_nums, topic_scores, save_path: str,
+                                       date: str, plot_density: bool, storage_format: str):
+    return write_directory_incidences(dir_name=dir_name, text_files=text_files, topic_nums=topic_nums,
+                                      topic_scores=topic_scores, save_path=save_path, date=date,
+                                      plot_density=plot_density, storage_format=storage_format, **_worker_lookup)
 
 # if __name__ == '__main__':
 #     on_server = True
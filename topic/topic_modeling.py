@@ -1,44 +1,285 @@
 import datetime
 import json
+import logging
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
+from scipy import sparse
 from scipy.special import softmax
 from top2vec import Top2Vec
 from wordcloud import WordCloud
+from constants import EmbeddingModel
+from topic.ann_index import IVFIndex, l2_normalize, top_k_rows
+from topic.embeddings import PrecomputedEmbedder, get_sentence_encoder
+from topic.model_registry import ModelRegistry, StoredTopicModel, save_top2vec
+from topic.sampling import cluster_topics, stratified_sample_indices, topic_share_distance
 from utils.os_manipulation import exists_or_create
 
 
 class TopicModel:
 
-    def __init__(self, documents: list):
+    def __init__(self, documents: list, embeddings=None, embedding_model: str = None):
+        """
+        Topic model based on Top2Vec.
+        :param documents: List of documents; if None, no model is created (e.g. to load one afterward)
+        :param embeddings: (Optional) Precomputed embeddings of the documents, e.g. the ones stored in Elasticsearch
+            (cf. get_texts_and_embeddings, load_embedding_snapshot); shape: (num documents, embedding dimension).
+            If given, the documents are not embedded again.
+        :param embedding_model: Name of the embedding model; if None, EmbeddingModel.TOPIC_MODEL_NAME is used for
+            documents without embeddings and EmbeddingModel.NAME (the model used during ingestion) for precomputed ones
+        """
         self.model = None
+        self.document_index = None  # approximate nearest neighbour index of the document vectors, cf. build_document_index
+        self.sample_indices = None  # positions of the training documents in the corpus, cf. from_sample
+        self.cooccurrence = None  # co-occurrence counts of the topic words, cf. get_topic_coherence
         self.documents = documents
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
         # pretrained models: universal-sentence-encoder, sentence-transformers
         # model trains own model: doc2vec
         if documents is not None:
             self.create_model()
 
-    def create_model(self):
+    def create_model(self, min_count: int = 10, umap_args: dict = None, hdbscan_args: dict = None):
+        """
+        Train the Top2Vec model on the documents (and their embeddings, if given).
+        :param min_count: Words occurring at most min_count times are not in the vocabulary
+        :param umap_args: (Optional) Arguments of UMAP; if None, the defaults of Top2Vec (cf. topic.sweep)
+        :param hdbscan_args: (Optional) Arguments of HDBSCAN; if None, the defaults of Top2Vec (cf. topic.sweep)
+        :return: -
+        """
+        if self.embeddings is not None:
+            # Top2Vec looks up the documents' embeddings and only embeds the vocabulary
+            embedding_model = PrecomputedEmbedder(documents=self.documents, embeddings=self.embeddings,
+                                                  model_name=self.embedding_model or EmbeddingModel.NAME.value)
+        else:
+            # Universal Sentence Encoder multilingual
+            # https://www.sbert.net/docs/sentence_transformer/pretrained_models.html, 20.11.2024
+            embedding_model = self.embedding_model or EmbeddingModel.TOPIC_MODEL_NAME.value
         self.model = Top2Vec(documents=self.documents,
                              document_ids=list(range(len(self.documents))),
-                             # Universal Sentence Encoder multilingual
-                             # https://www.sbert.net/docs/sentence_transformer/pretrained_models.html, 20.11.2024
-                             embedding_model='distiluse-base-multilingual-cased',
+                             embedding_model=embedding_model,
                              workers=8,
-                             min_count=10)
+                             min_count=min_count,
+                             umap_args=umap_args,
+                             hdbscan_args=hdbscan_args)
+
+    @classmethod
+    def from_sample(cls, documents, strata: list, sample_size: int, embeddings=None, embedding_model: str = None,
+                    min_per_stratum: int = 1, random_state: int = 42):
+        """
+        Train a topic model on a stratified sample of the corpus instead of the whole corpus.
+        UMAP and HDBSCAN only see the sample, hence the memory used for training depends on the sample size.
+        Afterward, assign_topics assigns every document of the corpus to a topic in batches (cf. get_sample_agreement).
+        :param documents: Documents of the corpus; list or CorpusStore (only the sampled documents are read)
+        :param strata: Stratum of each document, e.g. its top-level directory
+        :param sample_size: Number of documents to train on (cf. stratified_sample_indices)
+        :param embeddings: (Optional) Precomputed embeddings of the corpus; may be memory mapped
+            (cf. load_embedding_snapshot), only the sampled rows are read
+        :param embedding_model: Name of the embedding model (cf. __init__)
+        :param min_per_stratum: Minimum number of documents per stratum
+        :param random_state: Seed of the sampling
+        :return: TopicModel trained on the sample; sample_indices are the positions of the sample in the corpus
+        """
+        sample_indices = stratified_sample_indices(strata, sample_size=sample_size, min_per_stratum=min_per_stratum,
+                                                   random_state=random_state)
+        logging.info(f"Training topic model on a sample of {len(sample_indices)} of {len(strata)} documents")
+        sample_embeddings = np.asarray(embeddings[sample_indices], dtype=np.float32) if embeddings is not None \
+            else None
+        topic_model = cls(documents=[documents[int(i)] for i in sample_indices], embeddings=sample_embeddings,
+                          embedding_model=embedding_model)
+        topic_model.sample_indices = sample_indices
+        return topic_model
+
+    def get_sample_agreement(self, topic_nums, topic_scores):
+        """
+        Report how well the topics found on the training sample (cf. from_sample) agree with the topics assigned to the
+        whole corpus.
+        - topic_share_distance: total variation distance between the topic shares of the sample (topics of the
+          training documents, doc_top) and of the corpus (assigned topics); 0 if the topics are equally frequent.
+        - sample_label_agreement: share of the sampled documents in an HDBSCAN cluster whose assigned topic is the
+          topic of their cluster (cf. cluster_topics); HDBSCAN outliers are excluded, NaN without the HDBSCAN model.
+        - num_sample_outliers: number of sampled documents HDBSCAN marked as outliers.
+        - mean_score_sample, mean_score_rest: mean similarity of the sampled and the remaining documents to their
+          topic; a much lower score of the remaining documents indicates topics missing in the sample.
+        :param topic_nums: Topics assigned to all documents of the corpus (cf. assign_topics); shape: (num docs, top_k)
+        :param topic_scores: Scores of the topics; same shape as topic_nums
+        :return: Dictionary of the measures
+        """
+        topic_nums = np.asarray(topic_nums).reshape(len(topic_nums), -1)[:, 0]
+        topic_scores = np.asarray(topic_scores).reshape(len(topic_scores), -1)[:, 0]
+        sample_topics = np.asarray(self.model.doc_top)  # document ids of the model are the positions in the sample
+        is_rest = np.ones(len(topic_nums), dtype=bool)
+        is_rest[self.sample_indices] = False
+
+        hdbscan_model = getattr(self.model, "hdbscan_model", None)
+        if hdbscan_model is not None:
+            labels = np.asarray(hdbscan_model.labels_)
+            sample_cluster_topics = cluster_topics(labels, self.model.document_vectors[:len(labels)],
+                                                   self.model.topic_vectors)
+        else:
+            sample_cluster_topics = np.full(len(self.sample_indices), -1, dtype=np.int64)
+        clustered = sample_cluster_topics != -1
+
+        agreement = {
+            "num_sample": len(self.sample_indices),
+            "num_rest": int(is_rest.sum()),
+            "topic_share_distance": topic_share_distance(sample_topics, topic_nums, num_topics=self.get_num_topics()),
+            "sample_label_agreement": float(np.mean(topic_nums[self.sample_indices][clustered] ==
+                                                    sample_cluster_topics[clustered])) if clustered.any()
+            else float("nan"),
+            "num_sample_outliers": int(len(clustered) - clustered.sum()) if hdbscan_model is not None else 0,
+            "mean_score_sample": float(np.mean(topic_scores[self.sample_indices])),
+            "mean_score_rest": float(np.mean(topic_scores[is_rest])) if is_rest.any() else float("nan"),
+        }
+        logging.info(f"Agreement of sample and corpus topics: {agreement}")
+        return agreement
+
+    def get_topic_coherence(self, texts=None, num_words: int = 10, num_diversity_words: int = 25):
+        """
+        Evaluate the topics with coherence measures (NPMI, UMass) and their diversity.
+        The co-occurrences of the topic words are counted once per corpus (cf. WordCooccurrence) and reused by later
+        calls with the same or fewer num_words.
+        :param texts: (Optional) Iterable of texts to count co-occurrences in, e.g. a CorpusStore; if None, the training
+            documents
+        :param num_words: Number of most similar words per topic scored by the coherence measures
+        :param num_diversity_words: Number of most similar words per topic used for the topic diversity
+        :return: Dictionary of the NPMI and UMass coherence per topic (arrays), their means and the topic diversity
+        """
+        # imported here, so that the dependencies of the metrics never prevent loading a model
+        from topic.coherence import WordCooccurrence, npmi_coherence, topic_diversity, umass_coherence
+
+        topic_words = np.asarray(self.model.topic_words)[:, :num_words]
+        if texts is not None or self.cooccurrence is None or \
+                not set(topic_words.ravel().tolist()) <= set(self.cooccurrence.word_indexes):
+            texts = self.documents if texts is None else texts
+            if texts is None:
+                raise ValueError("No documents to count the co-occurrences of the topic words in")
+            self.cooccurrence = WordCooccurrence(documents=texts, vocab=topic_words.ravel().tolist())
+
+        npmi = npmi_coherence(self.cooccurrence, topic_words)
+        umass = umass_coherence(self.cooccurrence, topic_words)
+        coherence = {
+            "npmi": npmi,
+            "umass": umass,
+            "mean_npmi": float(npmi.mean()),
+            "mean_umass": float(umass.mean()),
+            "topic_diversity": topic_diversity(np.asarray(self.model.topic_words)[:, :num_diversity_words]),
+        }
+        logging.info(f"Topic coherence: NPMI {coherence['mean_npmi']:.4f}, UMass {coherence['mean_umass']:.4f}, "
+                     f"diversity {coherence['topic_diversity']:.4f}")
+        return coherence
+
+    def add_documents(self, documents: list, embeddings=None, min_similarity: float = 0.2,
+                      drift_threshold: float = 0.25, retrain_on_drift: bool = True):
+        """
+        Add new documents to the model without refitting UMAP and HDBSCAN.
+        The new documents are embedded (or their embeddings are looked up) and assigned to the existing topics.
+        Afterward, the drift is measured as the share of new documents whose similarity to every topic vector is below
+        min_similarity, i.e. documents no existing topic describes well.
+        If the drift exceeds drift_threshold, the model is trained again on all documents (if retrain_on_drift and the
+        training documents are known) or a warning is logged.
+        :param documents: List of new documents
+        :param embeddings: (Optional) Embeddings of the new documents computed with the embedding model of the topic
+            model; shape: (num new documents, embedding dimension)
+        :param min_similarity: Cosine similarity to the closest topic vector below which a document counts as drifted
+        :param drift_threshold: Share of drifted documents above which a full retraining is triggered
+        :param retrain_on_drift: If True, the model is trained again from scratch once the drift threshold is crossed
+        :return: Dictionary with the number of new documents, the drift share and whether the model was retrained
+        """
+        if len(documents) == 0:  # nothing to add; document_vectors[-0:] would be all documents
+            return {"num_new_docs": 0, "drift_share": 0.0, "retrained": False}
+        if isinstance(self.model, StoredTopicModel):  # query-only model loaded from the registry
+            self.model = self.model.load_top2vec()
+            if self.model.embedding_model == "custom":
+                self.model.set_embedding_model(get_sentence_encoder(self.embedding_model or
+                                                                    EmbeddingModel.NAME.value).encode)
+        start_id = int(np.max(self.model.document_ids)) + 1
+        doc_ids = list(range(start_id, start_id + len(documents)))
+
+        # Top2Vec embeds the joined tokens of added documents by default; embed the raw texts like during training,
+        # which are also what PrecomputedEmbedder looks the given embeddings up by
+        if embeddings is not None:
+            # Top2Vec embeds added documents with its embedding model; let it look up the given embeddings instead
+            previous_embed = self.model.embed
+            self.model.set_embedding_model(PrecomputedEmbedder(documents=documents, embeddings=embeddings,
+                                                               model_name=self.embedding_model or
+                                                               EmbeddingModel.NAME.value))
+            try:
+                self.model.add_documents(documents=documents, doc_ids=doc_ids, use_embedding_model_tokenizer=True)
+            finally:
+                self.model.embed = previous_embed
+        else:
+            self.model.add_documents(documents=documents, doc_ids=doc_ids, use_embedding_model_tokenizer=True)
+
+        # similarity of each new document to its closest topic; vectors are l2 normalized
+        new_vectors = self.model.document_vectors[-len(documents):]
+        closest_similarity = np.max(new_vectors @ self.model.topic_vectors.T, axis=1)
+        drift_share = float(np.mean(closest_similarity < min_similarity))
+        logging.info(f"Added {len(documents)} documents; drift share: {drift_share}")
+
+        if self.documents is not None:
+            self.documents = list(self.documents) + list(documents)
+            if self.embeddings is not None and embeddings is not None:
+                self.embeddings = np.vstack([self.embeddings, embeddings])
+            elif self.embeddings is not None:  # embeddings of new documents unknown -> embed all documents again
+                self.embeddings = None
+
+        retrained = False
+        if drift_share > drift_threshold:
+            if retrain_on_drift and self.documents is not None:
+                logging.info(f"Drift share {drift_share} exceeds {drift_threshold}; retraining the topic model")
+                self.create_model()
+                retrained = True
+            else:
+                logging.warning(f"Drift share {drift_share} exceeds {drift_threshold}; the topic model should be "
+                                f"retrained on all documents")
+
+        return {"num_new_docs": len(documents), "drift_share": drift_share, "retrained": retrained}
 
     def save_model(self, path: str = "models/"):
         """
         Save the model to a file.
-        The name of the file is 'topic_model' and the current date.
+        The name of the file is 'topic_model' and the current date and time, hence later saves do not overwrite earlier
+        ones.
         :param path: Path to the file
-        :return: -
+        :return: Name of the file, i.e. the version of the model (cf. ESDatabase.insert_topic_assignments)
         """
         exists_or_create(path=path)
-        self.model.save(path + "topic_model_" + datetime.datetime.now().strftime('%x').replace('/', '_'))
+        filename = "topic_model_" + datetime.datetime.now().strftime('%m_%d_%y_%H%M%S')
+        save_top2vec(self.model, path + filename)
+        return filename
+
+    def save_to_registry(self, path: str = "models/registry/", name: str = "topic_model",
+                         save_full_model: bool = True):
+        """
+        Save the model as new version in the model registry (cf. ModelRegistry.save).
+        In contrast to save_model, the arrays of the model are stored separately, hence query-only processes can load
+        them quickly with load_from_registry.
+        :param path: Path to the registry including the '/' at the end
+        :param name: Name of the model
+        :param save_full_model: If True, the complete Top2Vec model is saved as well (needed to add documents)
+        :return: Version of the model
+        """
+        embedding_model = (self.embedding_model or EmbeddingModel.NAME.value) \
+            if self.model.embedding_model == "custom" else None
+        return ModelRegistry(path).save(self.model, name=name, embedding_model=embedding_model,
+                                        save_full_model=save_full_model)
+
+    def load_from_registry(self, path: str = "models/registry/", version: str = None, name: str = None):
+        """
+        Load a version of the model from the model registry for queries (cf. StoredTopicModel).
+        Topic assignment, document topics and incidences are available; the complete Top2Vec model is only loaded if
+        documents are added.
+        :param path: Path to the registry including the '/' at the end
+        :param version: Version of the model; if None, the latest version
+        :param name: (Optional) Name of the model; only used if version is None
+        :return: -
+        """
+        self.model = ModelRegistry(path).load(version=version, name=name)
 
     def load_model(self, path: str = "models/", filename: str = "topic_model"):
         """
@@ -47,6 +288,9 @@ class TopicModel:
         :return: -
         """
         self.model = Top2Vec.load(path + filename)
+        if self.model.embedding_model == "custom":  # trained on precomputed embeddings, cf. PrecomputedEmbedder
+            encoder = get_sentence_encoder(self.embedding_model or EmbeddingModel.NAME.value)
+            self.model.set_embedding_model(encoder.encode)
 
     def get_num_topics(self):
         """
@@ -66,6 +310,7 @@ class TopicModel:
         :param word: Text query
         :param num_topics: Number of topics to return
         :return: array of most similar topics described by 50 most similar words; shape: (num topics, 50)
+        (cf. query_topics_batch for many queries)
         """
         return self.model.query_topics(word, num_topics=num_topics)
 
@@ -74,10 +319,85 @@ class TopicModel:
         Semantic search of documents using text query.
         :param word: Text query
         :param num_docs: Number of documents to return
-        :return: Documents, their score and ID in descending order of similarity
+        :return: Documents, their score and ID in descending order of similarity; only score and ID for a model loaded
+            from the registry, which does not store the documents (cf. query_documents_batch for many queries)
         """
         return self.model.query_documents(word, num_docs=num_docs, return_documents=True)
 
+    def embed_queries(self, queries, batch_size: int = 1024):
+        """
+        Embed a batch of queries with the embedding model of the topic model.
+        :param queries: List of query strings or array of query vectors of shape (num queries, embedding dimension)
+        :param batch_size: Number of queries embedded at once
+        :return: l2 normalized query vectors; shape: (num queries, embedding dimension)
+        """
+        if isinstance(queries, np.ndarray) and queries.ndim == 2:
+            return l2_normalize(queries)
+        return self.model._embed_documents(list(queries), batch_size)
+
+    def build_document_index(self, path: str = None, num_lists: int = None):
+        """
+        Build an approximate nearest neighbour index over the document vectors (cf. IVFIndex) for
+        query_documents_batch.
+        :param path: (Optional) Path to save the index to including the '/' at the end
+        :param num_lists: Number of lists of the index; if None, about 4 * sqrt(num documents)
+        :return: -
+        """
+        self.document_index = IVFIndex.build(self.model.document_vectors, ids=self.model.document_ids,
+                                             num_lists=num_lists)
+        if path is not None:
+            self.document_index.save(path)
+
+    def load_document_index(self, path: str):
+        """
+        Load an index saved with build_document_index; the vectors are memory mapped.
+        :param path: Path to the index including the '/' at the end
+        :return: -
+        """
+        self.document_index = IVFIndex.load(path)
+
+    def query_documents_batch(self, queries, num_docs: int = 10, num_probe: int = 8, batch_size: int = 1024):
+        """
+        Semantic search of documents for many queries at once.
+        The queries are embedded together and searched in the document index (cf. build_document_index); without an
+        index, all document vectors are scanned.
+        :param queries: List of query strings or array of query vectors of shape (num queries, embedding dimension)
+        :param num_docs: Number of documents per query
+        :param num_probe: Number of lists of the index scanned per query (cf. IVFIndex.search)
+        :param batch_size: Number of queries embedded and scored at once
+        :return: Cosine similarities and ids of the documents in descending order of similarity; both of shape
+            (num queries, num_docs)
+        """
+        vectors = self.embed_queries(queries, batch_size=batch_size)
+        if self.document_index is not None:
+            return self.document_index.search(vectors, k=num_docs, num_probe=num_probe)
+
+        document_vectors = self.model.document_vectors
+        num_docs = min(num_docs, len(document_vectors))
+        scores = np.empty((len(vectors), num_docs), dtype=np.float32)
+        positions = np.empty((len(vectors), num_docs), dtype=np.int64)
+        for start in range(0, len(vectors), batch_size):
+            end = min(start + batch_size, len(vectors))
+            positions[start:end], scores[start:end] = top_k_rows(vectors[start:end] @ document_vectors.T, num_docs)
+        return scores, np.asarray(self.model.document_ids)[positions]
+
+    def query_topics_batch(self, queries, num_topics: int = 5, batch_size: int = 1024):
+        """
+        Semantic search of topics for many queries at once (cf. get_closest_topics).
+        Since there are few topics, all topic vectors are scored exactly (cf. assign_topics).
+        :param queries: List of query strings or array of query vectors of shape (num queries, embedding dimension)
+        :param num_topics: Number of topics per query
+        :param batch_size: Number of queries embedded and scored at once
+        :return: Cosine similarities and ids of the topics in descending order of similarity; both of shape
+            (num queries, num_topics)
+        """
+        if isinstance(queries, np.ndarray) and queries.ndim == 2:
+            topic_nums, topic_scores = self.assign_topics(embeddings=queries, top_k=num_topics, batch_size=batch_size)
+        else:
+            topic_nums, topic_scores = self.assign_topics(texts=list(queries), top_k=num_topics,
+                                                          batch_size=batch_size)
+        return topic_scores, topic_nums
+
     def get_wordcloud_of_similar_topics(self, num_topics: int, word: str = None):
         """
         This function creates a wordcloud of the topics most similar to the word.
@@ -101,59 +421,173 @@ class TopicModel:
             canvas.draw()
             plt.show()
 
-    def get_doc_topics(self, doc_ids: list, num_topics: int = 1):
+    def assign_topics(self, texts: list = None, embeddings=None, top_k: int = 1, batch_size: int = 1024):
+        """
+        This function assigns topics to arbitrary (e.g. unseen) documents.
+        The documents are embedded in batches (unless their embeddings are given); the similarities to all topics are
+        computed as one matrix product per batch against the topic vectors.
+        :param texts: List of texts; ignored if embeddings are given
+        :param embeddings: (Optional) Embeddings of the documents computed with the embedding model of the topic model;
+            shape: (num documents, embedding dimension)
+        :param top_k: Number of topics per document
+        :param batch_size: Number of documents embedded and scored at once
+        :return: Topic ids and their cosine similarity scores in descending order of similarity;
+            both arrays have the shape (num documents, top_k)
+        """
+        topic_vectors = self.model.topic_vectors  # l2 normalized
+        top_k = min(top_k, len(topic_vectors))
+        num_docs = len(embeddings) if embeddings is not None else len(texts)
+        topic_nums = np.empty((num_docs, top_k), dtype=np.int64)
+        topic_scores = np.empty((num_docs, top_k), dtype=np.float32)
+
+        for start in range(0, num_docs, batch_size):
+            end = min(start + batch_size, num_docs)
+            if embeddings is not None:
+                vectors = np.asarray(embeddings[start:end], dtype=np.float32)
+                vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            else:
+                vectors = self.model._embed_documents(texts[start:end], batch_size)  # l2 normalized
+
+            similarities = vectors @ topic_vectors.T
+            # top_k topics per document (unordered), then sort them by similarity
+            top = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+            top_similarities = np.take_along_axis(similarities, top, axis=1)
+            order = np.argsort(-top_similarities, axis=1)
+            topic_nums[start:end] = np.take_along_axis(top, order, axis=1)
+            topic_scores[start:end] = np.take_along_axis(top_similarities, order, axis=1)
+
+        return topic_nums, topic_scores
+
+    def get_doc_topics(self, doc_ids: list = None, num_topics: int = 1, texts: list = None, embeddings=None):
         """
         This function returns the topics of documents.
+        The documents are either documents of the training corpus (doc_ids) or arbitrary documents (texts or
+        embeddings, cf. assign_topics).
         :param doc_ids: List of document ids
         :param num_topics: Number of topics to return
+        :param texts: (Optional) List of texts; used instead of doc_ids
+        :param embeddings: (Optional) Embeddings of documents; used instead of doc_ids and texts
         :return: Topics of documents
         """
-        topic_nums, topic_score, topics_words, word_scores = self.model.get_documents_topics(doc_ids=doc_ids,
-                                                                                             num_topics=num_topics)
+        if texts is None and embeddings is None:
+            topic_nums, topic_score, topics_words, word_scores = self.model.get_documents_topics(doc_ids=doc_ids,
+                                                                                                 num_topics=num_topics)
+        else:
+            topic_nums, topic_score = self.assign_topics(texts=texts, embeddings=embeddings, top_k=num_topics)
+            topics_words = self.model.topic_words[topic_nums]
+            word_scores = self.model.topic_word_scores[topic_nums]
         print("obtained document topics")
         return topic_nums, topic_score, topics_words, word_scores
 
-    def get_document_topic_incidence(self, doc_ids: list):
+    def topics2sparse_incidence(self, topic_nums, topic_scores, num_topics: int = None):
+        """
+        This function scatters the topics of documents into a sparse document-topic incidence matrix.
+        Entry (i, j) is the score of topic j for document i, if j is among the topics returned for document i, else 0.
+        :param topic_nums: Topics of documents as returned by get_doc_topics; shape: (num docs, num topics per doc)
+        :param topic_scores: Scores of the topics; same shape as topic_nums
+        :param num_topics: Number of columns of the matrix; if None, number of topics of the model
+        :return: Document-topic incidence as scipy.sparse CSR matrix; shape: (num docs, num topics)
+        """
+        if num_topics is None:
+            num_topics = self.get_num_topics()
+        topic_nums = np.asarray(topic_nums)
+        topic_scores = np.asarray(topic_scores)
+        if topic_nums.ndim == 1:  # one topic per document
+            topic_nums = topic_nums.reshape(-1, 1)
+            topic_scores = topic_scores.reshape(-1, 1)
+
+        num_docs, topics_per_doc = topic_nums.shape
+        rows = np.repeat(np.arange(num_docs), topics_per_doc)
+        incidence = sparse.csr_matrix((topic_scores.ravel(), (rows, topic_nums.ravel())),
+                                      shape=(num_docs, num_topics))
+        incidence.eliminate_zeros()
+        return incidence
+
+    def get_document_topic_incidence_sparse(self, doc_ids: list = None, num_topics: int = 10, texts: list = None,
+                                            embeddings=None):
+        """
+        This function returns the incidence of topics in documents as sparse matrix.
+        In contrast to get_document_topic_incidence, no dense matrix is created, hence it scales to many documents.
+        :param doc_ids: List of document ids
+        :param num_topics: Number of topics per document
+        :param texts: (Optional) List of texts; used instead of doc_ids (cf. get_doc_topics)
+        :param embeddings: (Optional) Embeddings of documents; used instead of doc_ids and texts
+        :return: Incidence of topics in documents as scipy.sparse CSR matrix; row i corresponds to the i-th document
+        """
+        topic_nums, topic_score, topics_words, word_scores = self.get_doc_topics(doc_ids=doc_ids,
+                                                                                 num_topics=num_topics, texts=texts,
+                                                                                 embeddings=embeddings)
+        return self.topics2sparse_incidence(topic_nums=topic_nums, topic_scores=topic_score)
+
+    def sparse_incidence2df(self, incidence, index: list = None, columns: list = None):
+        """
+        This function returns a sparse incidence matrix as pandas DataFrame with sparse columns.
+        Only the non-zero entries are stored, but the usual DataFrame operations (e.g. to_csv) are available.
+        :param incidence: scipy.sparse incidence matrix
+        :param index: (Optional) Row labels; if None, the row numbers are used
+        :param columns: (Optional) Column labels; if None, the column numbers are used
+        :return: DataFrame with sparse columns
+        """
+        return pd.DataFrame.sparse.from_spmatrix(incidence, index=index, columns=columns)
+
+    def sparse_incidence2arrow(self, incidence, row_name: str = "doc", column_name: str = "topic"):
+        """
+        This function returns a sparse incidence matrix as Arrow table in coordinate format.
+        Each row of the table is one non-zero entry of the matrix.
+        :param incidence: scipy.sparse incidence matrix
+        :param row_name: Name of the table column holding the row numbers
+        :param column_name: Name of the table column holding the column numbers
+        :return: pyarrow.Table with the columns row_name, column_name and 'value'
+        """
+        coo = incidence.tocoo()
+        return pa.table({row_name: coo.row.astype(np.int64), column_name: coo.col.astype(np.int32),
+                         "value": coo.data})
+
+    def get_document_topic_incidence(self, doc_ids: list = None, texts: list = None, embeddings=None):
         """
         This function returns the incidence of topics in documents.
         :param doc_ids: List of document ids
+        :param texts: (Optional) List of texts; used instead of doc_ids (cf. get_doc_topics)
+        :param embeddings: (Optional) Embeddings of documents; used instead of doc_ids and texts
         :return: Incidence of topics in documents
         """
         # default number of topics returned by model is 1
-        topic_nums, topic_score, topics_words, word_scores = self.get_doc_topics(doc_ids=doc_ids, num_topics=10)
-
-        # create dataframe with document-topic incidence
         # use num_docs instead of doc_ids, bc here we want to index return object not topic model object
-        doc_topic_columns = {topic_num: [0 if topic_num not in topic_nums[doc_id] else \
-                                             topic_score[doc_id][np.where(topic_nums[doc_id] == topic_num)[0][0]] \
-                                         for doc_id in range(len(topic_score))] for topic_num in
-                             range(self.model.get_num_topics())}
+        incidence = self.get_document_topic_incidence_sparse(doc_ids=doc_ids, num_topics=10, texts=texts,
+                                                             embeddings=embeddings)
 
         # real values are topic scores in [0, 1]
-        document_topic_incidence = pd.DataFrame(doc_topic_columns)  # automatic index == document id in TopicModel
+        document_topic_incidence = pd.DataFrame(incidence.toarray())  # automatic index == document id in TopicModel
 
         return document_topic_incidence
 
-    def get_term_topic_incidence(self, doc_ids: list, save_path_topic_words: str = None):
+    def get_term_topic_incidence_sparse(self, doc_ids: list = None, save_path_topic_words: str = None,
+                                        texts: list = None, embeddings=None, topic_nums=None):
         """
-        This function returns the incidence of terms in topics.
+        This function returns the incidence of terms in topics as sparse matrix.
+        A term is incident to a topic, if the topic is among the topics of the documents and the term is one of the
+        topic words. Hence, only the topic words are looked up, instead of every term of the vocabulary in every topic.
         :param doc_ids: List of document ids
         :param save_path_topic_words: Path to save the topics words including file name and json ending; if None, no saving
-        :return: Incidence of terms in topics
+        :param texts: (Optional) List of texts; used instead of doc_ids (cf. get_doc_topics)
+        :param embeddings: (Optional) Embeddings of documents; used instead of doc_ids and texts
+        :param topic_nums: (Optional) Topics of the documents as returned by get_doc_topics (10 per document);
+            if given, the topics are not obtained again
+        :return: Incidence of terms in topics as scipy.sparse CSR matrix of type int8; shape: (num topics, num terms),
+            column j corresponds to self.model.vocab[j]
         """
         num_topics = self.get_num_topics()
-        topic_nums, topic_score, topics_words, word_scores = self.get_doc_topics(doc_ids=doc_ids, num_topics=10)
-        num_docs = len(topic_score)
+        if topic_nums is None:
+            topic_nums, topic_score, topics_words, word_scores = self.get_doc_topics(doc_ids=doc_ids, num_topics=10,
+                                                                                     texts=texts,
+                                                                                     embeddings=embeddings)
 
-        # create term-topic incidence dataframe
-        # use num_docs instead of doc_ids, bc here we want to index return object not topic model object
-        topic_index_per_doc = {topic_num: [-1 if topic_num not in topic_nums[doc_id]
-                                           else np.where(topic_nums[doc_id] == topic_num)[0][0]
-                                           for doc_id in range(num_docs)] for topic_num in range(num_topics)}
+        # topics of any document
+        is_doc_topic = np.zeros(num_topics, dtype=bool)
+        is_doc_topic[np.asarray(topic_nums).ravel()] = True
 
-        terms_per_topic = {topic_num: {term for doc_id in range(num_docs)
-                                       if topic_index_per_doc[topic_num][doc_id] != -1
-                                       for term in topics_words[doc_id][topic_index_per_doc[topic_num][doc_id]]}
+        # the topic words of a topic are the same for all documents
+        terms_per_topic = {topic_num: list(self.model.topic_words[topic_num]) if is_doc_topic[topic_num] else []
                            for topic_num in range(num_topics)}
 
         if save_path_topic_words:
@@ -161,61 +595,128 @@ class TopicModel:
             if not save_path_topic_words.endswith('.json'):
                 save_path_topic_words += '.json'
 
-            # Convert sets to lists
-            terms_per_topic_serializable = {
-                topic_num: list(terms)
-                for topic_num, terms in terms_per_topic.items()
-            }
-            print("Made terms per topic serializable")
-
-            # Save to JSON file
+            # Save to JSON file; words are ordered by their score
             with open(save_path_topic_words, "w") as f:
-                json.dump(terms_per_topic_serializable, f, indent=4)
+                json.dump(terms_per_topic, f, indent=4)
             print(f"Saved terms per topic to {save_path_topic_words}")
 
         print("obtained terms per topic")
-        term_topic_columns = {term: [term in terms_per_topic[topic_num] for topic_num in range(num_topics)] for term in
-                              self.model.vocab}
-
-        print("obtained term_topic_columns")
+        word_indexes = self.model.word_indexes
+        topic_index = np.concatenate([np.full(len(terms_per_topic[topic_num]), topic_num)
+                                      for topic_num in range(num_topics)]).astype(np.int64)
+        term_index = np.array([word_indexes[term] for topic_num in range(num_topics)
+                               for term in terms_per_topic[topic_num]], dtype=np.int64)
 
         # values are binary: 1 if term is in topic, 0 otherwise
-        term_topic_incidence = pd.DataFrame(term_topic_columns)  # automatic index == term id in TopicModel
+        term_topic_incidence = sparse.csr_matrix((np.ones(len(term_index), dtype=np.int8), (topic_index, term_index)),
+                                                 shape=(num_topics, len(self.model.vocab)))
+        term_topic_incidence.sum_duplicates()
+        term_topic_incidence.data[:] = 1
         return term_topic_incidence
 
+    def get_term_topic_incidence(self, doc_ids: list = None, save_path_topic_words: str = None, texts: list = None,
+                                 embeddings=None, topic_nums=None):
+        """
+        This function returns the incidence of terms in topics.
+        :param doc_ids: List of document ids
+        :param save_path_topic_words: Path to save the topics words including file name and json ending; if None, no saving
+        :param texts: (Optional) List of texts; used instead of doc_ids (cf. get_doc_topics)
+        :param embeddings: (Optional) Embeddings of documents; used instead of doc_ids and texts
+        :param topic_nums: (Optional) Topics of the documents as returned by get_doc_topics (10 per document)
+        :return: Incidence of terms in topics
+        """
+        term_topic_incidence = self.get_term_topic_incidence_sparse(doc_ids=doc_ids,
+                                                                    save_path_topic_words=save_path_topic_words,
+                                                                    texts=texts, embeddings=embeddings,
+                                                                    topic_nums=topic_nums)
+
+        # values are binary: 1 if term is in topic, 0 otherwise
+        # automatic index == topic id in TopicModel, columns are the terms
+        return pd.DataFrame(term_topic_incidence.toarray().astype(bool), columns=self.model.vocab)
+
     def row_normalize_df(self, df):
         """
         This function normalizes the rows of a dataframe.
-        :param df: Dataframe to normalize
-        :return: Normalized dataframe
+        :param df: Dataframe or scipy.sparse matrix to normalize; rows of a sparse matrix summing up to 0 stay 0
+        :return: Normalized dataframe (or scipy.sparse CSR matrix)
         """
+        if sparse.issparse(df):
+            normalized = sparse.csr_matrix(df, dtype=float, copy=True)
+            row_sums = np.asarray(normalized.sum(axis=1)).ravel()
+            entry_sums = np.repeat(row_sums, np.diff(normalized.indptr))
+            normalized.data = np.divide(normalized.data, entry_sums, out=np.zeros_like(normalized.data),
+                                        where=entry_sums != 0)
+            return normalized
         return df.div(df.sum(axis=1), axis=0)
 
     def get_density_doc_topic_threshold(self, normalized_doc_topic_incidence, threshold: float):
         """
         This function returns the density of the document-topic incidence matrix.
-        :param normalized_doc_topic_incidence: Normalized document-topic incidence matrix
-        :param threshold: Threshold for weights in the matrix to be considered as relevant
+        :param normalized_doc_topic_incidence: Normalized document-topic incidence matrix (DataFrame or scipy.sparse)
+        :param threshold: Threshold for weights in the matrix to be considered as relevant; non-negative
         :return: Density of the document-topic incidence matrix (proportion of weights above threshold)
         """
-        return np.mean(normalized_doc_topic_incidence > threshold)
+        return self.get_density_curve(normalized_doc_topic_incidence, thresholds=np.array([threshold]))[0]
+
+    def _sorted_weights(self, incidence):
+        """
+        This function returns the positive weights of an incidence matrix in ascending order and the number of cells.
+        Zeros and NaNs (rows without any topic) never exceed a non-negative threshold, hence they are dropped.
+        :param incidence: Incidence matrix (DataFrame, NumPy array or scipy.sparse)
+        :return: Sorted 1-D array of positive weights, number of cells of the matrix
+        """
+        weights = incidence.data if sparse.issparse(incidence) else np.asarray(incidence, dtype=float).ravel()
+        weights = weights[weights > 0]  # also drops NaNs
+        return np.sort(weights), incidence.shape[0] * incidence.shape[1]
+
+    def get_density_curve(self, normalized_doc_topic_incidence, thresholds=None):
+        """
+        This function returns the density of the document-topic incidence matrix for many thresholds at once.
+        The weights are sorted once; the number of weights above each threshold is then found by binary search.
+        :param normalized_doc_topic_incidence: Normalized document-topic incidence matrix (DataFrame or scipy.sparse)
+        :param thresholds: (Optional) Array of non-negative thresholds; if None, 100 thresholds in [0, 1]
+        :return: Array of densities (proportion of weights above threshold), one per threshold
+        """
+        if thresholds is None:
+            thresholds = np.linspace(0, 1, 100)
+        weights, num_cells = self._sorted_weights(normalized_doc_topic_incidence)
+        num_above = len(weights) - np.searchsorted(weights, thresholds, side='right')
+        return num_above / num_cells
+
+    def find_density_threshold(self, normalized_doc_topic_incidence, opt_density: float = 0.1):
+        """
+        This function returns the largest threshold for which the density of the thresholded matrix exceeds
+        opt_density, i.e. the threshold keeping the fewest weights while the density is still above opt_density.
+        The result is exact (not restricted to a grid of thresholds); it is a weight of the matrix itself or 0.
+        :param normalized_doc_topic_incidence: Normalized document-topic incidence matrix (DataFrame or scipy.sparse)
+        :param opt_density: Optimal density of the document-topic incidence matrix
+        :return: Threshold; 0 (keep all weights) if even all weights do not exceed opt_density
+        """
+        weights, num_cells = self._sorted_weights(normalized_doc_topic_incidence)
+        # density > opt_density <=> number of weights above threshold >= num_required
+        num_required = int(np.floor(opt_density * num_cells)) + 1
+        if num_required > len(weights):
+            return 0.0
+        # keep the num_required largest weights (and ties); threshold is the next smaller weight
+        smallest_kept = weights[len(weights) - num_required]
+        next_smaller = np.searchsorted(weights, smallest_kept, side='left') - 1
+        return float(weights[next_smaller]) if next_smaller >= 0 else 0.0
 
     def display_density_doc_topic_threshold(self, normalized_doc_topic_incidence, save_path: str = None,
-                                            opt_density: float = 0.1):
+                                            opt_density: float = 0.1, show: bool = True):
         """
         This function displays the density of the document-topic incidence matrix for different thresholds.
         :param normalized_doc_topic_incidence: Normalized document-topic incidence matrix
+        :param save_path: Path to save the plot; if None, no saving
+        :param opt_density: Optimal density of the document-topic incidence matrix
+        :param show: If True, the plot is shown (blocks with interactive backends)
         :return: Density of the document-topic incidence matrix (proportion of weights above threshold)
         """
         plt.figure()
         thresholds = np.linspace(0, 1, 100)
-        densities = [self.get_density_doc_topic_threshold(normalized_doc_topic_incidence, threshold) for threshold in
-                     thresholds]
+        densities = self.get_density_curve(normalized_doc_topic_incidence, thresholds=thresholds)
         plt.fill_between(thresholds, densities, color='skyblue', alpha=0.6, label='Density')
-        if np.where(np.array(densities) - opt_density > 0)[0].size == 0:  # if only negative values, array is empty
-            opt_threshold = np.max(densities)  # keep all values
-        else:
-            opt_threshold = thresholds[np.where(np.array(densities) - opt_density > 0)[0][-1]]
+        opt_threshold = self.find_density_threshold(normalized_doc_topic_incidence, opt_density=opt_density)
 
         plt.axvline(x=opt_threshold, color='purple', linestyle='--',
                     label=f'Optimal threshold = {np.round(opt_threshold, decimals=2)} '
@@ -231,40 +732,52 @@ class TopicModel:
             date = datetime.datetime.now().strftime('%x').replace('/', '_')
             exists_or_create(path=save_path)
             plt.savefig(save_path + title + '_' + date + '.svg', format='svg')
-        plt.show()
+        if show:
+            plt.show()
+        plt.close()
         return densities, thresholds, opt_threshold
 
     def determine_threshold_doc_topic_threshold(self, doc_topic_incidence, opt_density: float = 0.1,
-                                                save_path: str = None):
+                                                save_path: str = None, plot: bool = True, show: bool = True):
         """
-        This function displays the density of the document-topic incidence matrix for different thresholds.
-        :param doc_topic_incidence: Document-topic incidence matrix
+        This function determines the optimal threshold of the document-topic incidence matrix
+        (cf. find_density_threshold) and optionally displays the density for different thresholds.
+        :param doc_topic_incidence: Document-topic incidence matrix (DataFrame or scipy.sparse)
         :param save_path: Path to save the plot; if None, no saving
         :param opt_density: Optimal density of the document-topic incidence matrix
+        :param plot: If False, no figure is created at all (headless)
+        :param show: If True, the plot is shown; only used if plot is True
         :return: Optimal density of the document-topic incidence matrix (proportion of weights above threshold),
                 Row normalized document-topic incidence matrix
         """
         normalized_doc_topic_incidence = self.row_normalize_df(doc_topic_incidence)
-        densities, thresholds, opt_threshold = self.display_density_doc_topic_threshold(normalized_doc_topic_incidence,
-                                                                                        save_path=save_path,
-                                                                                        opt_density=opt_density)
+        if plot:
+            densities, thresholds, opt_threshold = self.display_density_doc_topic_threshold(
+                normalized_doc_topic_incidence, save_path=save_path, opt_density=opt_density, show=show)
+        else:
+            opt_threshold = self.find_density_threshold(normalized_doc_topic_incidence, opt_density=opt_density)
         return opt_threshold, normalized_doc_topic_incidence
 
     def apply_threshold_doc_topic_incidence(self, doc_topic_incidence, threshold: float = None):
         """
         This function applies a threshold to the document-topic incidence matrix.
-        :param doc_topic_incidence: Document-topic incidence matrix;
+        :param doc_topic_incidence: Document-topic incidence matrix (DataFrame or scipy.sparse);
                 if threshold is None, row normalized matrix is calculated;
                 if threshold is provided, input matrix is assumed to be row normalized
         :param threshold: (Optional) Threshold for weights in the matrix to be considered as relevant;
                 if None, optimal threshold is determined
-        :return: Document-topic incidence matrix with threshold applied
+        :return: Document-topic incidence matrix with threshold applied (scipy.sparse CSR matrix, if input is sparse)
         """
         if threshold is None:
             # determine optimal threshold
             # overwrites doc_topic_incidence with row normalized version
             threshold, doc_topic_incidence = self.determine_threshold_doc_topic_threshold(doc_topic_incidence)
-        return doc_topic_incidence.map(lambda x: 1 if x > threshold else 0)
+        if sparse.issparse(doc_topic_incidence):
+            thresholded = sparse.csr_matrix(doc_topic_incidence, copy=True)
+            thresholded.data = (thresholded.data > threshold).astype(np.int8)
+            thresholded.eliminate_zeros()
+            return thresholded
+        return (doc_topic_incidence > threshold).astype(int)
 
 #
 # if __name__ == '__main__':
@@ -22,6 +22,17 @@ def save_or_not(plt, file_name: str, save_path: str, format: str = 'png'):
         plt.savefig(save_path + file_name, bbox_inches='tight', format=format)
 
 
+def get_top_level_directory(path: str, root_marker: str = '/ETYNTKE/'):
+    """
+    This function returns the uppermost directory of a file below the dataset root.
+    E.g. '.../ETYNTKE/Vehicles/Cars/file.pdf' -> 'Vehicles'
+    :param path: Path to the file
+    :param root_marker: Last segment of the dataset root including the surrounding '/'
+    :return: Name of the top-level directory
+    """
+    return path.split(root_marker)[-1].split('/')[0]
+
+
 def scan_recurse(base_directory: str):
     base_directory = base_directory.split('*')[0] if '*' in base_directory else base_directory
 
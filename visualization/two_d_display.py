@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 import constants
-from utils.os_manipulation import save_or_not
+from utils.os_manipulation import get_top_level_directory, save_or_not
 from visualization.plotting_utils import obtain_low_dim_embs
 
 
@@ -113,7 +113,7 @@ def scatter_documents_2d(client, save_path=None, on_server=False, reducer='PCA',
     embeddings = [r['_source']['embedding'] for r in results]
     class_dirs = [r['_source']['directory'] for r in results]
     # uppermost directory if on server else the directory
-    colour_criteria = [r['_source']['path'].split('/ETYNTKE/')[-1].split('/')[0] for r in results] \
+    colour_criteria = [get_top_level_directory(r['_source']['path']) for r in results] \
         if on_server else class_dirs
     if preprocess_dirs:
         colour_criteria = process_directory_names(colour_criteria)
@@ -1,6 +1,7 @@
 import logging
 import re
 import textwrap
+import graphviz
 import constants
 import utils.logging_utils as logging_utils
 import utils.os_manipulation as osm
@@ -66,8 +67,39 @@ def flatten_comprehension(matrix):
     return [item for row in matrix for item in row]
 
 
+def iceberg_graphviz(concepts: list, **kwargs):
+    """
+    This function draws an (iceberg) lattice like concepts draws a complete lattice (cf. ctx.lattice.graphviz): each
+    concept is labeled with the attributes it introduces (above) and the objects not in any of its lower
+    neighbours (below).
+    :param concepts: Concepts with their lower neighbours as returned by TopicFCA.get_iceberg_lattice
+    :param kwargs: Further arguments of graphviz.Digraph, e.g. engine or graph_attr
+    :return: graphviz.Digraph
+    """
+    dot = graphviz.Digraph(name="IcebergLattice",
+                           node_attr={'shape': 'circle', 'width': '.25', 'style': 'filled', 'label': ''},
+                           edge_attr={'dir': 'none', 'labeldistance': '1.5', 'minlen': '2'}, **kwargs)
+    upper_covers = [[] for _ in concepts]
+    for upper, (_, _, lower_covers) in enumerate(concepts):
+        for lower in lower_covers:
+            upper_covers[lower].append(upper)
+
+    for i, (extent, intent, lower_covers) in enumerate(concepts):
+        name = f"c{i}"
+        dot.node(name)
+        objects = set(extent).difference(*[concepts[lower][0] for lower in lower_covers])
+        properties = set(intent).difference(*[concepts[upper][1] for upper in upper_covers[i]])
+        if objects:
+            dot.edge(name, name, headlabel=' '.join(o for o in extent if o in objects), labelangle='270',
+                     color='transparent')
+        if properties:
+            dot.edge(name, name, taillabel=' '.join(sorted(properties)), labelangle='90', color='transparent')
+        dot.edges((name, f"c{lower}") for lower in lower_covers)
+    return dot
+
+
 def display_context(path2csv: str, save_path: str, filename_of_csv: str, on_server: bool = False,
-                    translated: bool = False):
+                    translated: bool = False, min_support=None, top_k: int = None):
     """
     This function displays the context as a graph and saves it.
     :param path2csv: Path to the csv file that contains the context
@@ -76,6 +108,9 @@ def display_context(path2csv: str, save_path: str, filename_of_csv: str, on_serv
     :param on_server: Boolean indicating whether the code is running on the server or locally
     :param translated: Boolean indicating whether the document/ directory names should translated in the graph
         (i.e. not IDs)
+    :param min_support: (Optional) Only display the concepts with at least this many objects (int) or this share of
+        the objects (float); for large contexts whose complete lattice cannot be drawn
+    :param top_k: (Optional) Only display the top_k concepts with the most objects
     :return: -
     """
 
@@ -102,7 +137,14 @@ def display_context(path2csv: str, save_path: str, filename_of_csv: str, on_serv
                 filename += "_translated"
 
             # Generate the graph object
-            dot = ctx.lattice.graphviz(engine='dot', graph_attr={'ranksep': '1.5', 'nodesep': '1.0'})
+            # the concepts are computed on the clarified (and for the complete lattice reduced) context
+            if min_support is not None or top_k is not None:
+                # iceberg lattice: only the frequent concepts are computed and drawn
+                concepts = topic_fca.get_iceberg_lattice(ctx, min_support=min_support, top_k=top_k)
+                filename += "_iceberg"
+            else:
+                concepts = topic_fca.get_iceberg_lattice(ctx, min_support=0)  # complete lattice
+            dot = iceberg_graphviz(concepts, engine='dot', graph_attr={'ranksep': '1.5', 'nodesep': '1.0'})
 
 
             # Apply regex-based text wrapping, number simplification, and font size adjustment for node labels
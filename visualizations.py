@@ -4,7 +4,7 @@ import constants
 from data import files
 from elasticsearch import Elasticsearch
 from database.init_elasticsearch import ESDatabase
-from database.query_db import get_column_values_scroll, display_directory_content
+from database.query_db import get_column_values_scroll, get_directory_routing_keys, display_directory_content
 from utils.logging_utils import get_date, init_debug_config
 import utils.os_manipulation as osm
 from visualization.two_d_display import scatter_documents_2d
@@ -76,11 +76,16 @@ if __name__ == '__main__':
     client = Elasticsearch(constants.DatabaseAddr.CLIENT_ADDR.value, request_timeout=100)
 
     # obtain directories & display content
-    directories = get_column_values_scroll(client=client, index=constants.DatabaseAddr.DB_NAME.value,
-                                           column="directory")
+    use_routing = False     # True if the index was created with ESDatabase(use_routing=True)
+    if use_routing:     # each directory is only searched in the shard(s) of its top-level directory
+        routing_keys = get_directory_routing_keys(client=client, index=constants.DatabaseAddr.DB_NAME.value)
+    else:
+        directories = get_column_values_scroll(client=client, index=constants.DatabaseAddr.DB_NAME.value,
+                                               column="directory")
+        routing_keys = {dir: None for dir in set(directories)}
 
-    for dir in directories:
-        display_directory_content(client=client, directory=dir,
+    for dir, routing in routing_keys.items():
+        display_directory_content(client=client, directory=dir, routing=routing,
                                   save_path=constants.Paths.SERVER_PLOTS_SAVE_PATH.value + 'wordclouds/')
 
     logging.info('Finished visualizations')